@@ -12,9 +12,8 @@ from pathlib import Path
 current_dir = os.path.dirname(os.path.abspath(__file__))
 sys.path.insert(0, current_dir)
 
-from src.sam2_basic_demo import run_basic_sam2_demo
-from src.sam2_video_tracker import run_complete_video_tracking
-from scripts.video_to_frames import video_to_frames
+# 各コマンドの実装は torch / matplotlib / SAM2 を読み込むため import が重い。
+# 使うコマンドの分岐内で遅延インポートし、`frames` や `help` を軽く保つ。
 
 
 def show_help():
@@ -57,6 +56,7 @@ SAM2 動画内物体検出・追跡アプリケーション
   --negative <x,y>     負の座標点（除外する領域）
   --model <サイズ>      使用モデル (tiny/small/base_plus/large, デフォルト: tiny)
   --quality <1-100>    JPEG品質 (フレーム分割時, デフォルト: 95)
+  --video              結果をフレームごとの画像ではなく動画 (tracked.mp4) で出力 (追跡時)
 
 使用例の流れ:
   1. python app.py frames input.mp4 input/dog_images/
@@ -106,6 +106,8 @@ def main():
             print(f"エラー: 動画ファイルが見つかりません: {input_video}")
             return
         
+        from scripts.video_to_frames import video_to_frames
+
         try:
             frame_count = video_to_frames(input_video, output_dir, quality)
             print(f"完了: {frame_count}フレームを {output_dir} に保存しました")
@@ -155,6 +157,8 @@ def main():
             else:
                 i += 1
         
+        from src.sam2_basic_demo import run_basic_sam2_demo
+
         try:
             run_basic_sam2_demo(
                 video_dir=video_dir,
@@ -185,6 +189,7 @@ def main():
         point_coords = [[300, 300]]
         point_labels = [1]
         model_size = "tiny"
+        output_format = "images"
         
         # オプション解析
         i = 4
@@ -209,6 +214,9 @@ def main():
             elif sys.argv[i] == "--model" and i + 1 < len(sys.argv):
                 model_size = sys.argv[i + 1]
                 i += 2
+            elif sys.argv[i] == "--video":
+                output_format = "video"
+                i += 1
             else:
                 i += 1
         
@@ -220,12 +228,15 @@ def main():
             "labels": point_labels
         }]
         
+        from src.sam2_video_tracker import run_complete_video_tracking
+
         try:
             analysis = run_complete_video_tracking(
                 video_dir=video_dir,
                 output_dir=output_dir,
                 objects_to_track=objects_to_track,
-                model_size=model_size
+                model_size=model_size,
+                output_format=output_format
             )
             
             print(f"\\n追跡完了！結果は {output_dir} に保存されました。")
@@ -4,8 +4,6 @@
 # This source code is licensed under the license found in the
 # LICENSE file in the root directory of this source tree.
 
-from hydra import initialize_config_module
-from hydra.core.global_hydra import GlobalHydra
-
-if not GlobalHydra.instance().is_initialized():
-    initialize_config_module("sam2", version_base="1.2")
+# Hydra (and omegaconf) are only needed to build a model from a config, so the
+# config module is initialized in `sam2.build_sam` rather than on package import.
+# This keeps `import sam2` (and e.g. `sam2.utils.amg`) free of the hydra import cost.
@@ -5,7 +5,11 @@
 # LICENSE file in the root directory of this source tree.
 
 # Adapted from https://github.com/facebookresearch/segment-anything/blob/main/segment_anything/automatic_mask_generator.py
-from typing import Any, Dict, List, Optional, Tuple
+import math
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
 
 import numpy as np
 import torch
@@ -14,19 +18,22 @@ from torchvision.ops.boxes import batched_nms, box_area  # type: ignore
 from sam2.modeling.sam2_base import SAM2Base
 from sam2.sam2_image_predictor import SAM2ImagePredictor
 from sam2.utils.amg import (
-    area_from_rle,
     batch_iterator,
     batched_mask_to_box,
     box_xyxy_to_xywh,
     build_all_layer_point_grids,
     calculate_stability_score,
     coco_encode_rle,
+    CompactRLE,
     generate_crop_boxes,
     is_box_near_crop_edge,
-    mask_to_rle_pytorch,
+    mask_nms,
+    mask_to_rle_compact,
     MaskData,
-    remove_small_regions,
+    remove_small_regions_batch,
     rle_to_mask,
+    rles_to_masks,
+    sampled_mask_iou_matrix,
     uncrop_boxes_xyxy,
     uncrop_masks,
     uncrop_points,
@@ -53,6 +60,10 @@ class SAM2AutomaticMaskGenerator:
         output_mode: str = "binary_mask",
         use_m2m: bool = False,
         multimask_output: bool = True,
+        crop_batch_size: int = 1,
+        filter_low_res_masks: bool = False,
+        adaptive_sampling_stride: int = 1,
+        nms_mode: str = "box",
         **kwargs,
     ) -> None:
         """
@@ -101,6 +112,30 @@ class SAM2AutomaticMaskGenerator:
             memory.
           use_m2m (bool): Whether to add a one step refinement using previous mask predictions.
           multimask_output (bool): Whether to output multimask at each point of the grid.
+          crop_batch_size (int): The number of crops of the same crop layer whose
+            image embeddings are computed in a single image encoder call. Higher
+            numbers may be faster but use more GPU memory.
+          filter_low_res_masks (bool): If true (and use_m2m is false), masks are
+            first filtered by predicted IoU and by a stability score computed on
+            the 256x256 low res logits, and only the survivors are upscaled to
+            the crop resolution, where the stability filter is applied again.
+            This makes upscaling cost proportional to the kept masks, but can
+            drop a few masks that would pass the full resolution filter.
+          adaptive_sampling_stride (int): If >1, each crop is first sampled with
+            a coarse grid keeping every adaptive_sampling_stride-th point of the
+            point grid along each side. The remaining points are then only run
+            through the model if they are not well inside (i.e. together with
+            their neighbors at half the grid spacing) a mask accepted from the
+            coarse grid. The number of points run and skipped by the last call
+            to generate are reported in `sampling_stats`.
+          nms_mode (str): How duplicate masks are removed. Can be 'box' (box IoU
+            NMS within each crop, then across crops) or 'mask'. With 'mask',
+            the masks of each crop are first deduplicated with box_nms_thresh,
+            then the survivors of all crops in a single NMS step, with
+            box_nms_thresh for masks of the same crop and crop_nms_thresh for
+            masks of different crops. Mask IoU is computed on the RLEs sampled
+            on a coarse grid (box IoU for masks too small to be sampled). It
+            does not suppress nested objects whose boxes overlap.
         """
 
         assert (points_per_side is None) != (
@@ -122,6 +157,7 @@ class SAM2AutomaticMaskGenerator:
             "uncompressed_rle",
             "coco_rle",
         ], f"Unknown output_mode {output_mode}."
+        assert nms_mode in ["box", "mask"], f"Unknown nms_mode {nms_mode}."
         if output_mode == "coco_rle":
             try:
                 from pycocotools import mask as mask_utils  # type: ignore  # noqa: F401
@@ -148,6 +184,11 @@ class SAM2AutomaticMaskGenerator:
         self.output_mode = output_mode
         self.use_m2m = use_m2m
         self.multimask_output = multimask_output
+        self.crop_batch_size = crop_batch_size
+        self.filter_low_res_masks = filter_low_res_masks
+        self.adaptive_sampling_stride = adaptive_sampling_stride
+        self.nms_mode = nms_mode
+        self._reset_sampling_stats()
 
     @classmethod
     def from_pretrained(cls, model_id: str, **kwargs) -> "SAM2AutomaticMaskGenerator":
@@ -192,49 +233,286 @@ class SAM2AutomaticMaskGenerator:
                  the mask, given in XYWH format.
         """
 
+        return list(self.generate_iter(image))
+
+    @torch.no_grad()
+    def generate_iter(self, image: np.ndarray) -> Iterator[Dict[str, Any]]:
+        """
+        Generates masks for the given image, yielding the records described in
+        `generate` one at a time. Masks are kept as RLEs until their record is
+        yielded, so with output_mode='binary_mask' only the masks still held by
+        the consumer are decoded at any time.
+
+        Arguments:
+          image (np.ndarray): The image to generate masks for, in HWC uint8 format.
+
+        Returns:
+          (iterator(dict(str, any))): The mask records, in the same order as
+            returned by `generate`.
+        """
+
         # Generate masks
         mask_data = self._generate_masks(image)
+        yield from self._write_records(mask_data)
 
-        # Encode masks
-        if self.output_mode == "coco_rle":
-            mask_data["segmentations"] = [
-                coco_encode_rle(rle) for rle in mask_data["rles"]
-            ]
-        elif self.output_mode == "binary_mask":
-            mask_data["segmentations"] = [rle_to_mask(rle) for rle in mask_data["rles"]]
-        else:
-            mask_data["segmentations"] = mask_data["rles"]
-
-        # Write mask records
-        curr_anns = []
-        for idx in range(len(mask_data["segmentations"])):
-            ann = {
-                "segmentation": mask_data["segmentations"][idx],
-                "area": area_from_rle(mask_data["rles"][idx]),
+    @torch.no_grad()
+    def generate_batch(
+        self,
+        images: List[np.ndarray],
+        image_batch_size: int = 4,
+        num_workers: int = 2,
+        interleave_points: Optional[bool] = None,
+    ) -> List[List[Dict[str, Any]]]:
+        """
+        Generates masks for several images. See `generate_batch_iter`.
+
+        Returns:
+          (list(list(dict(str, any)))): For each image, the list of mask
+            records described in `generate`.
+        """
+        return list(
+            self.generate_batch_iter(
+                images,
+                image_batch_size=image_batch_size,
+                num_workers=num_workers,
+                interleave_points=interleave_points,
+            )
+        )
+
+    @torch.no_grad()
+    def generate_batch_iter(
+        self,
+        images: Iterable[np.ndarray],
+        image_batch_size: int = 4,
+        num_workers: int = 2,
+        interleave_points: Optional[bool] = None,
+    ) -> Iterator[List[Dict[str, Any]]]:
+        """
+        Generates masks for a stream of images, for high throughput offline use.
+        Images are taken image_batch_size at a time, and their crops are embedded
+        image_batch_size at a time in a single image encoder call. The point
+        batches of all crops embedded together can be interleaved so that every
+        decoder call gets points_per_batch points. The per-image CPU work
+        (duplicate removal across crops, mask encoding and writing records) runs
+        on num_workers threads while the model processes the next images.
+
+        Arguments:
+          images (iterable(np.ndarray)): The images to generate masks for, in
+            HWC uint8 format.
+          image_batch_size (int): The number of images (and crops) embedded in a
+            single image encoder call.
+          num_workers (int): The number of threads for CPU postprocessing.
+          interleave_points (bool or None): Whether point batches span several
+            crops. If None, they do unless the model runs on CPU, where decoding
+            is memory bound and gathering per-point image features is slower.
+            Ignored with adaptive_sampling_stride > 1, where crops are processed
+            one at a time.
+
+        Returns:
+          (iterator(list(dict(str, any)))): For each image, in order, the list
+            of mask records described in `generate`.
+        """
+        images = iter(images)
+        pending = deque()
+        with ThreadPoolExecutor(max_workers=max(1, num_workers)) as executor:
+            while True:
+                images_batch = list(islice(images, image_batch_size))
+                if len(images_batch) == 0:
+                    break
+                for mask_data, n_crops in self._generate_masks_batch(
+                    images_batch, interleave_points
+                ):
+                    pending.append(executor.submit(self._finalize, mask_data, n_crops))
+                # Hand over finished images, and bound the pending work
+                while pending and (
+                    pending[0].done() or len(pending) > 2 * image_batch_size
+                ):
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+
+    def _finalize(self, mask_data: MaskData, n_crops: int) -> List[Dict[str, Any]]:
+        return list(self._write_records(self._dedupe_crops(mask_data, n_crops)))
+
+    def _write_records(self, mask_data: MaskData) -> Iterator[Dict[str, Any]]:
+        rles = mask_data["rles"]
+        areas = rles.areas()
+
+        # Encode masks and write mask records
+        for idx in range(len(rles)):
+            rle = rles[idx]
+            if self.output_mode == "coco_rle":
+                segmentation = coco_encode_rle(rle)
+            elif self.output_mode == "binary_mask":
+                segmentation = rle_to_mask(rle)
+            else:
+                segmentation = rle
+            yield {
+                "segmentation": segmentation,
+                "area": int(areas[idx]),
                 "bbox": box_xyxy_to_xywh(mask_data["boxes"][idx]).tolist(),
                 "predicted_iou": mask_data["iou_preds"][idx].item(),
                 "point_coords": [mask_data["points"][idx].tolist()],
                 "stability_score": mask_data["stability_score"][idx].item(),
                 "crop_box": box_xyxy_to_xywh(mask_data["crop_boxes"][idx]).tolist(),
             }
-            curr_anns.append(ann)
-
-        return curr_anns
 
     def _generate_masks(self, image: np.ndarray) -> MaskData:
         orig_size = image.shape[:2]
+        self._reset_sampling_stats()
         crop_boxes, layer_idxs = generate_crop_boxes(
             orig_size, self.crop_n_layers, self.crop_overlap_ratio
         )
 
-        # Iterate over image crops
+        # Iterate over image crops, embedding up to crop_batch_size crops of the
+        # same layer in a single image encoder call
         data = MaskData()
-        for crop_box, layer_idx in zip(crop_boxes, layer_idxs):
-            crop_data = self._process_crop(image, crop_box, layer_idx, orig_size)
-            data.cat(crop_data)
+        for crop_batch in self._batch_crops(crop_boxes, layer_idxs):
+            cropped_ims = [image[y0:y1, x0:x1, :] for (x0, y0, x1, y1), _ in crop_batch]
+            if len(cropped_ims) > 1:
+                self.predictor.set_image_batch(cropped_ims)
+            else:
+                self.predictor.set_image(cropped_ims[0])
+            for img_idx, (crop_box, layer_idx) in enumerate(crop_batch):
+                crop_data = self._process_crop(
+                    image, crop_box, layer_idx, orig_size, img_idx=img_idx
+                )
+                data.cat(crop_data)
+            self.predictor.reset_predictor()
+
+        return self._dedupe_crops(data, len(crop_boxes))
+
+    def _generate_masks_batch(
+        self, images: List[np.ndarray], interleave_points: Optional[bool] = None
+    ) -> List[Tuple[MaskData, int]]:
+        """
+        Generates the masks of several images, embedding their crops
+        len(images) at a time. Returns for each image its MaskData (before
+        duplicate removal between crops) and its number of crops.
+        """
+        self._reset_sampling_stats()
+        if interleave_points is None:
+            interleave_points = self.predictor.device.type != "cpu"
+        interleave_points = interleave_points and self.adaptive_sampling_stride <= 1
+        crops = []  # (image index, crop box, layer index) of all images
+        n_crops = []
+        for i, image in enumerate(images):
+            crop_boxes, layer_idxs = generate_crop_boxes(
+                image.shape[:2], self.crop_n_layers, self.crop_overlap_ratio
+            )
+            crops.extend(
+                (i, crop_box, layer_idx)
+                for crop_box, layer_idx in zip(crop_boxes, layer_idxs)
+            )
+            n_crops.append(len(crop_boxes))
+
+        data = [MaskData() for _ in images]
+        for (crop_batch,) in batch_iterator(len(images), crops):
+            cropped_ims = [
+                images[i][y0:y1, x0:x1, :] for i, (x0, y0, x1, y1), _ in crop_batch
+            ]
+            if len(cropped_ims) > 1:
+                self.predictor.set_image_batch(cropped_ims)
+            else:
+                self.predictor.set_image(cropped_ims[0])
+            if not interleave_points:
+                crops_data = [
+                    self._process_crop(
+                        images[i], crop_box, layer_idx, images[i].shape[:2], img_idx=j
+                    )
+                    for j, (i, crop_box, layer_idx) in enumerate(crop_batch)
+                ]
+            else:
+                crops_data = self._process_crops_interleaved(images, crop_batch)
+            for (i, _, _), crop_data in zip(crop_batch, crops_data):
+                data[i].cat(crop_data)
+            self.predictor.reset_predictor()
+        return list(zip(data, n_crops))
+
+    def _process_crops_interleaved(
+        self, images: List[np.ndarray], crop_batch: List[Tuple[int, List[int], int]]
+    ) -> List[MaskData]:
+        """
+        Runs the point grids of all crops of the current image batch, with point
+        batches spanning several crops so that decoder batches stay full.
+        """
+        crop_sizes, points, point_crop_idxs = [], [], []
+        for j, (i, (x0, y0, x1, y1), layer_idx) in enumerate(crop_batch):
+            cropped_im_size = (y1 - y0, x1 - x0)
+            points_scale = np.array(cropped_im_size)[None, ::-1]
+            crop_points = self.point_grids[layer_idx] * points_scale
+            crop_sizes.append(cropped_im_size)
+            points.append(crop_points)
+            point_crop_idxs.append(np.full(len(crop_points), j))
+            self.sampling_stats["points"] += len(crop_points)
+            self.sampling_stats["decoder_calls"] += len(crop_points)
+        points = np.concatenate(points)
+        point_crop_idxs = np.concatenate(point_crop_idxs)
+
+        crops_data = [MaskData() for _ in crop_batch]
+        for batch_points, batch_crop_idxs in batch_iterator(
+            self.points_per_batch, points, point_crop_idxs
+        ):
+            crop_idxs = list(dict.fromkeys(batch_crop_idxs.tolist()))
+            in_points, crop_points = [], []
+            for j in crop_idxs:
+                cur_points = torch.as_tensor(
+                    batch_points[batch_crop_idxs == j],
+                    dtype=torch.float32,
+                    device=self.predictor.device,
+                )
+                crop_points.append(cur_points)
+                in_points.append(
+                    self.predictor._transforms.transform_coords(
+                        cur_points, normalize=True, orig_hw=crop_sizes[j]
+                    )
+                )
+            in_points = torch.cat(in_points)
+            in_labels = torch.ones(
+                in_points.shape[0], dtype=torch.int, device=in_points.device
+            )
+            img_ids = torch.cat(
+                [torch.full((len(p),), j) for j, p in zip(crop_idxs, crop_points)]
+            )
+            masks, iou_preds, low_res_masks = self.predictor._predict(
+                in_points[:, None, :],
+                in_labels[:, None],
+                multimask_output=self.multimask_output,
+                return_logits=True,
+                img_idx=img_ids,
+                upscale_masks=False,
+            )
 
+            # Filter and compress the outputs of each crop separately
+            start = 0
+            for j, cur_points in zip(crop_idxs, crop_points):
+                rows = slice(start, start + len(cur_points))
+                start += len(cur_points)
+                i, crop_box, _ = crop_batch[j]
+                crops_data[j].cat(
+                    self._postprocess_batch(
+                        cur_points,
+                        masks[rows],
+                        iou_preds[rows],
+                        low_res_masks[rows],
+                        crop_sizes[j],
+                        crop_box,
+                        images[i].shape[:2],
+                        normalize=True,
+                        img_idx=j,
+                        upscaled=False,
+                    )
+                )
+        return [
+            self._finish_crop(crop_data, crop_box)
+            for crop_data, (_, crop_box, _) in zip(crops_data, crop_batch)
+        ]
+
+    def _dedupe_crops(self, data: MaskData, n_crops: int) -> MaskData:
         # Remove duplicate masks between crops
-        if len(crop_boxes) > 1:
+        if self.nms_mode == "mask":
+            data.filter(self._mask_nms(data))
+        elif n_crops > 1:
             # Prefer masks from smaller crops
             scores = 1 / box_area(data["crop_boxes"])
             scores = scores.to(data["boxes"].device)
@@ -248,41 +526,120 @@ class SAM2AutomaticMaskGenerator:
         data.to_numpy()
         return data
 
+    def _mask_nms(self, data: MaskData) -> torch.Tensor:
+        """
+        Deduplicates the masks of all crops at once with mask IoU, preferring
+        masks from smaller crops and then masks with higher predicted IoU.
+        """
+        if len(data["rles"]) == 0:
+            return torch.zeros(0, dtype=torch.int64)
+        ious = sampled_mask_iou_matrix(data["rles"], data["boxes"])
+        crop_boxes = data["crop_boxes"].cpu()
+        crop_areas = box_area(crop_boxes).numpy()
+        iou_preds = data["iou_preds"].detach().float().cpu().numpy()
+        # Rank by crop area first, so scores only need to order masks
+        order = np.lexsort((-iou_preds, crop_areas))
+        scores = torch.empty(len(order))
+        scores[torch.as_tensor(order)] = -torch.arange(len(order), dtype=torch.float)
+        same_crop = (crop_boxes[:, None, :] == crop_boxes[None, :, :]).all(dim=-1)
+        iou_threshold = torch.where(
+            same_crop,
+            torch.tensor(self.box_nms_thresh),
+            torch.tensor(self.crop_nms_thresh),
+        )
+        return mask_nms(ious, scores, iou_threshold)
+
+    def _batch_crops(
+        self, crop_boxes: List[List[int]], layer_idxs: List[int]
+    ) -> List[List[Tuple[List[int], int]]]:
+        """Groups consecutive crops of one layer into batches of crop_batch_size."""
+        batches = []
+        for crop_box, layer_idx in zip(crop_boxes, layer_idxs):
+            if (
+                len(batches) == 0
+                or batches[-1][-1][1] != layer_idx
+                or len(batches[-1]) >= self.crop_batch_size
+            ):
+                batches.append([])
+            batches[-1].append((crop_box, layer_idx))
+        return batches
+
     def _process_crop(
         self,
         image: np.ndarray,
         crop_box: List[int],
         crop_layer_idx: int,
         orig_size: Tuple[int, ...],
+        img_idx: Optional[int] = None,
     ) -> MaskData:
-        # Crop the image and calculate embeddings
+        # Crop the image and calculate embeddings, unless they were already
+        # computed for a batch of crops (then img_idx selects this crop)
         x0, y0, x1, y1 = crop_box
         cropped_im = image[y0:y1, x0:x1, :]
         cropped_im_size = cropped_im.shape[:2]
-        self.predictor.set_image(cropped_im)
+        set_here = img_idx is None
+        if set_here:
+            self.predictor.set_image(cropped_im)
+            img_idx = -1
 
         # Get points for this crop
         points_scale = np.array(cropped_im_size)[None, ::-1]
         points_for_image = self.point_grids[crop_layer_idx] * points_scale
 
         # Generate masks for this crop in batches
-        data = MaskData()
-        for (points,) in batch_iterator(self.points_per_batch, points_for_image):
-            batch_data = self._process_batch(
-                points, cropped_im_size, crop_box, orig_size, normalize=True
+        if self.adaptive_sampling_stride > 1:
+            # Run a coarse grid first, then only the points not already well
+            # inside one of the accepted masks
+            is_coarse = self._coarse_points(len(points_for_image))
+            data = self._process_points(
+                points_for_image[is_coarse],
+                cropped_im_size,
+                crop_box,
+                orig_size,
+                img_idx,
             )
-            data.cat(batch_data)
-            del batch_data
-        self.predictor.reset_predictor()
-
-        # Remove duplicates within this crop.
-        keep_by_nms = batched_nms(
-            data["boxes"].float(),
-            data["iou_preds"],
-            torch.zeros_like(data["boxes"][:, 0]),  # categories
-            iou_threshold=self.box_nms_thresh,
+            refine_points = points_for_image[~is_coarse]
+            if len(data["rles"]) > 0 and len(refine_points) > 0:
+                covered = self._covered_points(
+                    refine_points, data["rles"], crop_box, len(points_for_image)
+                )
+                refine_points = refine_points[~covered]
+            data.cat(
+                self._process_points(
+                    refine_points, cropped_im_size, crop_box, orig_size, img_idx
+                )
+            )
+            n_points_run = int(is_coarse.sum()) + len(refine_points)
+        else:
+            data = self._process_points(
+                points_for_image, cropped_im_size, crop_box, orig_size, img_idx
+            )
+            n_points_run = len(points_for_image)
+        self.sampling_stats["points"] += len(points_for_image)
+        self.sampling_stats["decoder_calls"] += n_points_run
+        self.sampling_stats["decoder_calls_saved"] += (
+            len(points_for_image) - n_points_run
         )
-        data.filter(keep_by_nms)
+        if set_here:
+            self.predictor.reset_predictor()
+
+        return self._finish_crop(data, crop_box)
+
+    def _finish_crop(self, data: MaskData, crop_box: List[int]) -> MaskData:
+        # Remove duplicates within this crop
+        if self.nms_mode == "box":
+            keep_by_nms = batched_nms(
+                data["boxes"].float(),
+                data["iou_preds"],
+                torch.zeros_like(data["boxes"][:, 0]),  # categories
+                iou_threshold=self.box_nms_thresh,
+            )
+            data.filter(keep_by_nms)
+        elif len(data["rles"]) > 0:
+            # This also bounds the number of masks compared at once by the
+            # cross-crop step in _dedupe_crops
+            ious = sampled_mask_iou_matrix(data["rles"], data["boxes"])
+            data.filter(mask_nms(ious, data["iou_preds"], self.box_nms_thresh))
 
         # Return to the original image frame
         data["boxes"] = uncrop_boxes_xyxy(data["boxes"], crop_box)
@@ -291,6 +648,73 @@ class SAM2AutomaticMaskGenerator:
 
         return data
 
+    def _process_points(
+        self,
+        points: np.ndarray,
+        cropped_im_size: Tuple[int, ...],
+        crop_box: List[int],
+        orig_size: Tuple[int, ...],
+        img_idx: int,
+    ) -> MaskData:
+        data = MaskData()
+        for (batch_points,) in batch_iterator(self.points_per_batch, points):
+            batch_data = self._process_batch(
+                batch_points,
+                cropped_im_size,
+                crop_box,
+                orig_size,
+                normalize=True,
+                img_idx=img_idx,
+            )
+            data.cat(batch_data)
+            del batch_data
+        return data
+
+    def _reset_sampling_stats(self) -> None:
+        self.sampling_stats = {
+            "points": 0,
+            "decoder_calls": 0,
+            "decoder_calls_saved": 0,
+        }
+
+    def _coarse_points(self, n_points: int) -> np.ndarray:
+        """Selects the points of the coarse grid used by adaptive sampling."""
+        stride = self.adaptive_sampling_stride
+        n_per_side = int(round(math.sqrt(n_points)))
+        if n_per_side * n_per_side != n_points:
+            # Not a square grid (e.g. custom point_grids), subsample uniformly
+            is_coarse = np.arange(n_points) % (stride * stride) == 0
+        else:
+            rows, cols = np.divmod(np.arange(n_points), n_per_side)
+            is_coarse = (rows % stride == stride // 2) & (cols % stride == stride // 2)
+        if not is_coarse.any():
+            is_coarse[:1] = True
+        return is_coarse
+
+    def _covered_points(
+        self,
+        points: np.ndarray,
+        rles: CompactRLE,
+        crop_box: List[int],
+        n_grid_points: int,
+    ) -> np.ndarray:
+        """
+        Returns which points (in crop coordinates) lie, together with their 8
+        neighbors at half the grid spacing, inside a single accepted mask.
+        Points near mask boundaries are ambiguous and are not covered.
+        """
+        x0, y0, x1, y1 = crop_box
+        radius = max(1, int(0.5 * math.sqrt((x1 - x0) * (y1 - y0) / n_grid_points)))
+        offsets = np.array(
+            [(dx, dy) for dx in (-radius, 0, radius) for dy in (-radius, 0, radius)]
+        )
+        coords = np.round(points).astype(np.int64)[:, None, :] + offsets[None]
+        coords[..., 0] = np.clip(coords[..., 0], 0, x1 - x0 - 1) + x0
+        coords[..., 1] = np.clip(coords[..., 1], 0, y1 - y0 - 1) + y0
+        inside = rles.contains(coords.reshape(-1, 2))
+        inside = inside.reshape(len(rles), len(points), -1)
+        return inside.all(axis=-1).any(axis=0)
+
     def _process_batch(
         self,
         points: np.ndarray,
@@ -298,6 +722,7 @@ class SAM2AutomaticMaskGenerator:
         crop_box: List[int],
         orig_size: Tuple[int, ...],
         normalize=False,
+        img_idx: int = -1,
     ) -> MaskData:
         orig_h, orig_w = orig_size
 
@@ -311,13 +736,49 @@ class SAM2AutomaticMaskGenerator:
         in_labels = torch.ones(
             in_points.shape[0], dtype=torch.int, device=in_points.device
         )
+        filter_low_res = self.filter_low_res_masks and not self.use_m2m
         masks, iou_preds, low_res_masks = self.predictor._predict(
             in_points[:, None, :],
             in_labels[:, None],
             multimask_output=self.multimask_output,
             return_logits=True,
+            img_idx=img_idx,
+            upscale_masks=not filter_low_res,
+        )
+        return self._postprocess_batch(
+            points,
+            masks,
+            iou_preds,
+            low_res_masks,
+            im_size,
+            crop_box,
+            orig_size,
+            normalize=normalize,
+            img_idx=img_idx,
+            upscaled=not filter_low_res,
         )
 
+    def _postprocess_batch(
+        self,
+        points: torch.Tensor,
+        masks: torch.Tensor,
+        iou_preds: torch.Tensor,
+        low_res_masks: torch.Tensor,
+        im_size: Tuple[int, ...],
+        crop_box: List[int],
+        orig_size: Tuple[int, ...],
+        normalize=False,
+        img_idx: int = -1,
+        upscaled: bool = True,
+    ) -> MaskData:
+        """
+        Filters the decoder outputs for a batch of points of a crop and
+        compresses the kept masks to RLE. If upscaled is False, masks are the
+        low res logits and are upscaled here (after filtering, if
+        filter_low_res_masks is set).
+        """
+        orig_h, orig_w = orig_size
+
         # Serialize predictions and store in MaskData
         data = MaskData(
             masks=masks.flatten(0, 1),
@@ -327,6 +788,22 @@ class SAM2AutomaticMaskGenerator:
         )
         del masks
 
+        if not upscaled:
+            if self.filter_low_res_masks and not self.use_m2m:
+                # Filter on the low res logits and only upscale the survivors
+                if self.pred_iou_thresh > 0.0:
+                    keep_mask = data["iou_preds"] > self.pred_iou_thresh
+                    data.filter(keep_mask)
+                if self.stability_score_thresh > 0.0:
+                    low_res_stability_score = calculate_stability_score(
+                        data["masks"], self.mask_threshold, self.stability_score_offset
+                    )
+                    keep_mask = low_res_stability_score >= self.stability_score_thresh
+                    data.filter(keep_mask)
+            data["masks"] = self.predictor._transforms.postprocess_masks(
+                data["masks"].unsqueeze(1), im_size
+            ).squeeze(1)
+
         if not self.use_m2m:
             # Filter by predicted IoU
             if self.pred_iou_thresh > 0.0:
@@ -349,7 +826,11 @@ class SAM2AutomaticMaskGenerator:
                 in_points.shape[0], dtype=torch.int, device=in_points.device
             )
             masks, ious = self.refine_with_m2m(
-                in_points, labels, data["low_res_masks"], self.points_per_batch
+                in_points,
+                labels,
+                data["low_res_masks"],
+                self.points_per_batch,
+                img_idx=img_idx,
             )
             data["masks"] = masks.squeeze(1)
             data["iou_preds"] = ious.squeeze(1)
@@ -378,18 +859,22 @@ class SAM2AutomaticMaskGenerator:
 
         # Compress to RLE
         data["masks"] = uncrop_masks(data["masks"], crop_box, orig_h, orig_w)
-        data["rles"] = mask_to_rle_pytorch(data["masks"])
+        data["rles"] = mask_to_rle_compact(data["masks"])
         del data["masks"]
 
         return data
 
     @staticmethod
     def postprocess_small_regions(
-        mask_data: MaskData, min_area: int, nms_thresh: float
+        mask_data: MaskData,
+        min_area: int,
+        nms_thresh: float,
+        num_workers: Optional[int] = None,
     ) -> MaskData:
         """
         Removes small disconnected regions and holes in masks, then reruns
-        box NMS to remove any new duplicates.
+        box NMS to remove any new duplicates. The masks are processed in
+        parallel on `num_workers` threads (defaults to the number of CPUs).
 
         Edits mask_data in place.
 
@@ -399,42 +884,50 @@ class SAM2AutomaticMaskGenerator:
             return mask_data
 
         # Filter small disconnected regions and holes
-        new_masks = []
-        scores = []
-        for rle in mask_data["rles"]:
-            mask = rle_to_mask(rle)
-
-            mask, changed = remove_small_regions(mask, min_area, mode="holes")
-            unchanged = not changed
-            mask, changed = remove_small_regions(mask, min_area, mode="islands")
-            unchanged = unchanged and not changed
-
-            new_masks.append(torch.as_tensor(mask).unsqueeze(0))
-            # Give score=0 to changed masks and score=1 to unchanged masks
-            # so NMS will prefer ones that didn't need postprocessing
-            scores.append(float(unchanged))
+        masks, changed = remove_small_regions_batch(
+            rles_to_masks(mask_data["rles"]), min_area, num_workers=num_workers
+        )
+        masks = torch.as_tensor(masks)
+        # Give score=0 to changed masks and score=1 to unchanged masks
+        # so NMS will prefer ones that didn't need postprocessing
+        scores = torch.as_tensor(~changed, dtype=torch.float)
 
         # Recalculate boxes and remove any new duplicates
-        masks = torch.cat(new_masks, dim=0)
         boxes = batched_mask_to_box(masks)
         keep_by_nms = batched_nms(
             boxes.float(),
-            torch.as_tensor(scores),
+            scores,
             torch.zeros_like(boxes[:, 0]),  # categories
             iou_threshold=nms_thresh,
         )
 
         # Only recalculate RLEs for masks that have changed
-        for i_mask in keep_by_nms:
-            if scores[i_mask] == 0.0:
-                mask_torch = masks[i_mask].unsqueeze(0)
-                mask_data["rles"][i_mask] = mask_to_rle_pytorch(mask_torch)[0]
-                mask_data["boxes"][i_mask] = boxes[i_mask]  # update res directly
+        changed_idxs = keep_by_nms[torch.as_tensor(changed)[keep_by_nms]]
+        if len(changed_idxs) > 0:
+            new_rles = mask_to_rle_compact(masks[changed_idxs])
+            rles = mask_data["rles"]
+            if isinstance(rles, CompactRLE):
+                n_rles = len(rles)
+                rle_idxs = np.arange(n_rles)
+                rle_idxs[changed_idxs.numpy()] = n_rles + np.arange(len(new_rles))
+                mask_data["rles"] = CompactRLE.cat([rles, new_rles]).select(rle_idxs)
+            else:
+                for i_mask, rle in zip(changed_idxs.tolist(), new_rles.to_list()):
+                    rles[i_mask] = rle
+            # Update res directly
+            if isinstance(mask_data["boxes"], np.ndarray):
+                mask_data["boxes"][changed_idxs.numpy()] = boxes[changed_idxs].numpy()
+            else:
+                mask_data["boxes"][changed_idxs] = boxes[changed_idxs].to(
+                    mask_data["boxes"]
+                )
         mask_data.filter(keep_by_nms)
 
         return mask_data
 
-    def refine_with_m2m(self, points, point_labels, low_res_masks, points_per_batch):
+    def refine_with_m2m(
+        self, points, point_labels, low_res_masks, points_per_batch, img_idx=-1
+    ):
         new_masks = []
         new_iou_preds = []
 
@@ -447,6 +940,7 @@ class SAM2AutomaticMaskGenerator:
                 mask_input=low_res_mask[:, None, :],
                 multimask_output=False,
                 return_logits=True,
+                img_idx=img_idx,
             )
             new_masks.append(best_masks)
             new_iou_preds.append(best_iou_preds)
@@ -8,12 +8,16 @@ import logging
 import os
 
 import torch
-from hydra import compose
+from hydra import compose, initialize_config_module
+from hydra.core.global_hydra import GlobalHydra
 from hydra.utils import instantiate
 from omegaconf import OmegaConf
 
 import sam2
 
+if not GlobalHydra.instance().is_initialized():
+    initialize_config_module("sam2", version_base="1.2")
+
 # Check if the user is running Python from the parent directory of the sam2 repo
 # (i.e. the directory where this repo is cloned into) -- this is not supported since
 # it could shadow the sam2 package and cause issues.
@@ -572,7 +572,13 @@ class SAM2Base(torch.nn.Module):
                     continue  # skip padding frames
                 # "maskmem_features" might have been offloaded to CPU in demo use cases,
                 # so we load it back to GPU (it's a no-op if it's already on GPU).
-                feats = prev["maskmem_features"].to(device, non_blocking=True)
+                # It is also stored in bfloat16, so cast it back to the dtype of the
+                # current features (without autocast, e.g. on CPU, the memory attention
+                # would otherwise get bfloat16 inputs when no object pointers are
+                # concatenated, such as when re-propagating in reverse).
+                feats = prev["maskmem_features"].to(
+                    device, dtype=current_vision_feats[-1].dtype, non_blocking=True
+                )
                 to_cat_memory.append(feats.flatten(2).permute(2, 0, 1))
                 # Spatial positional encoding (it might have been offloaded to CPU in eval)
                 maskmem_enc = prev["maskmem_pos_enc"][-1].to(device)
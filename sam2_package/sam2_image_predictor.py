@@ -5,15 +5,18 @@
 # LICENSE file in the root directory of this source tree.
 
 import logging
+import os
 
-from typing import List, Optional, Tuple, Union
+from typing import Any, BinaryIO, Dict, List, Optional, Tuple, Union
 
 import numpy as np
 import torch
+import torch.nn.functional as F
 from PIL.Image import Image
 
 from sam2.modeling.sam2_base import SAM2Base
 
+from sam2.utils.embedding_cache import EmbeddingCache
 from sam2.utils.transforms import SAM2Transforms
 
 
@@ -24,6 +27,7 @@ class SAM2ImagePredictor:
         mask_threshold=0.0,
         max_hole_area=0.0,
         max_sprinkle_area=0.0,
+        embedding_cache: Optional[EmbeddingCache] = None,
         **kwargs,
     ) -> None:
         """
@@ -38,9 +42,13 @@ class SAM2ImagePredictor:
             the maximum area of max_hole_area in low_res_masks.
           max_sprinkle_area (int): If max_sprinkle_area > 0, we remove small sprinkles up to
             the maximum area of max_sprinkle_area in low_res_masks.
+          embedding_cache (EmbeddingCache or None): If set, `set_image` looks up the
+            image features by image content in this cache and only runs the image
+            encoder on a miss.
         """
         super().__init__()
         self.model = sam_model
+        self.embedding_cache = embedding_cache
         self._transforms = SAM2Transforms(
             resolution=self.model.image_size,
             mask_threshold=mask_threshold,
@@ -107,6 +115,17 @@ class SAM2ImagePredictor:
         else:
             raise NotImplementedError("Image format not supported")
 
+        cache_key = None
+        if self.embedding_cache is not None:
+            cache_key = self.embedding_cache.key_for_image(image)
+            cached = self.embedding_cache.get(cache_key)
+            if cached is not None:
+                logging.info("Using cached image embeddings for the provided image.")
+                self.set_features(
+                    cached["image_embed"], cached["high_res_feats"], cached["orig_hw"][0]
+                )
+                return
+
         input_image = self._transforms(image)
         input_image = input_image[None, ...].to(self.device)
 
@@ -127,6 +146,8 @@ class SAM2ImagePredictor:
         self._features = {"image_embed": feats[-1], "high_res_feats": feats[:-1]}
         self._is_image_set = True
         logging.info("Image embeddings computed.")
+        if cache_key is not None:
+            self.embedding_cache.put(cache_key, self.get_features())
 
     @torch.no_grad()
     def set_image_batch(
@@ -181,9 +202,22 @@ class SAM2ImagePredictor:
         multimask_output: bool = True,
         return_logits: bool = False,
         normalize_coords=True,
+        batched_decoding: Optional[bool] = None,
     ) -> Tuple[List[np.ndarray], List[np.ndarray], List[np.ndarray]]:
         """This function is very similar to predict(...), however it is used for batched mode, when the model is expected to generate predictions on multiple images.
         It returns a tuple of lists of masks, ious, and low_res_masks_logits.
+
+        If batched_decoding is True, the prompts of all images are run through the
+        prompt encoder and mask decoder in a single call (each prompt attending to
+        the embedding of its own image), and the masks of all images with the same
+        original size are upscaled together. Point prompts with different numbers of
+        points are padded to a common length with "not a point" (label -1) entries,
+        as done for the padding point that SAM appends to point-only prompts.
+        Images without any point or box prompt fall back to per-image decoding.
+        If None (default), batched decoding is used on GPU. On CPU the per-image
+        loop is used, since there the batched decoder is memory-bandwidth bound
+        and slower than decoding one image at a time (about 1.5x for 8 images
+        with 3 boxes each with sam2.1_hiera_tiny on a single core).
         """
         assert self._is_batch, "This function should only be used when in batched mode"
         if not self._is_image_set:
@@ -191,9 +225,7 @@ class SAM2ImagePredictor:
                 "An image must be set with .set_image_batch(...) before mask prediction."
             )
         num_images = len(self._features["image_embed"])
-        all_masks = []
-        all_ious = []
-        all_low_res_masks = []
+        prompts = []
         for img_idx in range(num_images):
             # Transform input prompts
             point_coords = (
@@ -206,14 +238,31 @@ class SAM2ImagePredictor:
             mask_input = (
                 mask_input_batch[img_idx] if mask_input_batch is not None else None
             )
-            mask_input, unnorm_coords, labels, unnorm_box = self._prep_prompts(
-                point_coords,
-                point_labels,
-                box,
-                mask_input,
-                normalize_coords,
-                img_idx=img_idx,
+            prompts.append(
+                self._prep_prompts(
+                    point_coords,
+                    point_labels,
+                    box,
+                    mask_input,
+                    normalize_coords,
+                    img_idx=img_idx,
+                )
             )
+
+        if batched_decoding is None:
+            batched_decoding = self.device.type != "cpu"
+        if batched_decoding and all(
+            unnorm_coords is not None or unnorm_box is not None
+            for _, unnorm_coords, _, unnorm_box in prompts
+        ):
+            return self._predict_batched(prompts, multimask_output, return_logits)
+
+        all_masks = []
+        all_ious = []
+        all_low_res_masks = []
+        for img_idx, (mask_input, unnorm_coords, labels, unnorm_box) in enumerate(
+            prompts
+        ):
             masks, iou_predictions, low_res_masks = self._predict(
                 unnorm_coords,
                 labels,
@@ -234,6 +283,151 @@ class SAM2ImagePredictor:
 
         return all_masks, all_ious, all_low_res_masks
 
+    @torch.no_grad()
+    def _predict_batched(
+        self,
+        prompts: List[Tuple[Optional[torch.Tensor], ...]],
+        multimask_output: bool = True,
+        return_logits: bool = False,
+    ) -> Tuple[List[np.ndarray], List[np.ndarray], List[np.ndarray]]:
+        """
+        Decodes the prompts of all images in the current batch at once.
+
+        Arguments:
+          prompts (list(tuple)): For each image, the (mask_input, unnorm_coords,
+            labels, unnorm_box) tuple returned by `_prep_prompts`. Every image must
+            have point or box prompts.
+          multimask_output (bool): See `predict`.
+          return_logits (bool): See `predict`.
+
+        Returns:
+          The same per-image lists of masks, ious and low res mask logits as
+          `predict_batch`.
+        """
+        # Merge boxes and points into a single "concat_points" input per image (boxes
+        # first, as in `_predict`), then pad all images to a common number of points.
+        coords_list, labels_list, masks_list, img_ids = [], [], [], []
+        for img_idx, (mask_input, unnorm_coords, labels, unnorm_box) in enumerate(
+            prompts
+        ):
+            coords, point_labels = [], []
+            if unnorm_box is not None:
+                box_coords = unnorm_box.reshape(-1, 2, 2)
+                box_labels = torch.tensor(
+                    [[2, 3]], dtype=torch.int, device=box_coords.device
+                )
+                coords.append(box_coords)
+                point_labels.append(box_labels.repeat(box_coords.size(0), 1))
+            if unnorm_coords is not None:
+                coords.append(unnorm_coords)
+                point_labels.append(labels.to(torch.int))
+            coords = torch.cat(coords, dim=1)
+            point_labels = torch.cat(point_labels, dim=1)
+            coords_list.append(coords)
+            labels_list.append(point_labels)
+            masks_list.append(mask_input)
+            img_ids.extend([img_idx] * coords.shape[0])
+
+        max_points = max(c.shape[1] for c in coords_list)
+        for i, (coords, point_labels) in enumerate(zip(coords_list, labels_list)):
+            n_pad = max_points - coords.shape[1]
+            if n_pad > 0:
+                coords_list[i] = F.pad(coords, (0, 0, 0, n_pad), value=0.0)
+                labels_list[i] = F.pad(point_labels, (0, n_pad), value=-1)
+        concat_points = (torch.cat(coords_list, dim=0), torch.cat(labels_list, dim=0))
+        img_ids = torch.as_tensor(img_ids, dtype=torch.long, device=self.device)
+
+        # Embed prompts. Mask inputs are optional per image and, as in `_predict`, a
+        # single mask input is shared by all prompts of its image. Each image's mask
+        # is embedded once and repeated over that image's prompt rows.
+        rows_per_image = [c.shape[0] for c in coords_list]
+        row_starts = np.cumsum([0] + rows_per_image)
+        prompt_encoder = self.model.sam_prompt_encoder
+        sparse_embeddings, dense_embeddings = prompt_encoder(
+            points=concat_points, boxes=None, masks=None
+        )
+        mask_rows, mask_inputs, mask_repeats = [], [], []
+        for i, mask_input in enumerate(masks_list):
+            if mask_input is None:
+                continue
+            if mask_input.shape[0] not in (1, rows_per_image[i]):
+                raise ValueError(
+                    f"Got {mask_input.shape[0]} mask inputs for "
+                    f"{rows_per_image[i]} prompts of image {i}."
+                )
+            mask_rows.append(
+                torch.arange(row_starts[i], row_starts[i + 1], device=self.device)
+            )
+            mask_inputs.append(mask_input)
+            num_masks = mask_input.shape[0]
+            mask_repeats.extend([rows_per_image[i] // num_masks] * num_masks)
+        if mask_inputs:
+            mask_embeddings = prompt_encoder._embed_masks(torch.cat(mask_inputs, dim=0))
+            mask_embeddings = mask_embeddings.repeat_interleave(
+                torch.tensor(mask_repeats, device=self.device), dim=0
+            )
+            dense_embeddings = dense_embeddings.clone()
+            dense_embeddings[torch.cat(mask_rows)] = mask_embeddings
+
+        # Predict masks, with each prompt attending to its own image's features
+        high_res_features = [
+            feat_level[img_ids] for feat_level in self._features["high_res_feats"]
+        ]
+        low_res_masks, iou_predictions, _, _ = self.model.sam_mask_decoder(
+            image_embeddings=self._features["image_embed"][img_ids],
+            image_pe=prompt_encoder.get_dense_pe(),
+            sparse_prompt_embeddings=sparse_embeddings,
+            dense_prompt_embeddings=dense_embeddings,
+            multimask_output=multimask_output,
+            repeat_image=False,
+            high_res_features=high_res_features,
+        )
+
+        # Upscale the masks of all images sharing an original resolution together
+        orig_hws = [tuple(hw) for hw in self._orig_hw]
+        masks_by_hw = {}
+        for hw in dict.fromkeys(orig_hws):
+            image_idxs = [i for i, img_hw in enumerate(orig_hws) if img_hw == hw]
+            rows = torch.cat(
+                [
+                    torch.arange(row_starts[i], row_starts[i + 1], device=self.device)
+                    for i in image_idxs
+                ]
+            )
+            masks = self._transforms.postprocess_masks(low_res_masks[rows], hw)
+            if not return_logits:
+                masks = masks > self.mask_threshold
+            masks_by_hw[hw] = (image_idxs, masks.float().detach().cpu().numpy())
+        low_res_masks = torch.clamp(low_res_masks, -32.0, 32.0)
+
+        # Single device-to-host copy per output, then split per image
+        iou_predictions_np = iou_predictions.float().detach().cpu().numpy()
+        low_res_masks_np = low_res_masks.float().detach().cpu().numpy()
+        all_masks = [None] * len(prompts)
+        for image_idxs, masks_np in masks_by_hw.values():
+            offset = 0
+            for i in image_idxs:
+                all_masks[i] = masks_np[offset : offset + rows_per_image[i]]
+                offset += rows_per_image[i]
+        all_ious = [
+            iou_predictions_np[row_starts[i] : row_starts[i + 1]]
+            for i in range(len(prompts))
+        ]
+        all_low_res_masks = [
+            low_res_masks_np[row_starts[i] : row_starts[i + 1]]
+            for i in range(len(prompts))
+        ]
+
+        # Match `predict`, which drops the prompt batch dim for a single prompt
+        def _squeeze(x):
+            return x[0] if x.shape[0] == 1 else x
+
+        return (
+            [_squeeze(x) for x in all_masks],
+            [_squeeze(x) for x in all_ious],
+            [_squeeze(x) for x in all_low_res_masks],
+        )
+
     def predict(
         self,
         point_coords: Optional[np.ndarray] = None,
@@ -342,7 +536,8 @@ class SAM2ImagePredictor:
         mask_input: Optional[torch.Tensor] = None,
         multimask_output: bool = True,
         return_logits: bool = False,
-        img_idx: int = -1,
+        img_idx: Union[int, torch.Tensor] = -1,
+        upscale_masks: bool = True,
     ) -> Tuple[torch.Tensor, torch.Tensor, torch.Tensor]:
         """
         Predict masks for the given input prompts, using the currently set image.
@@ -369,6 +564,14 @@ class SAM2ImagePredictor:
             input prompts, multimask_output=False can give better results.
           return_logits (bool): If true, returns un-thresholded masks logits
             instead of a binary mask.
+          img_idx (int or torch.Tensor): The index of the image to predict on in
+            batch mode, or a tensor of length B with the image index of every
+            prompt, to decode prompts of several images of the batch at once
+            (this requires upscale_masks=False).
+          upscale_masks (bool): If false, the output masks are not upscaled nor
+            postprocessed, and are returned as raw low res logits. This lets
+            callers filter masks first and upscale only the ones they keep with
+            `self._transforms.postprocess_masks`.
 
         Returns:
           (torch.Tensor): The output masks in BxCxHxW format, where C is the
@@ -410,15 +613,26 @@ class SAM2ImagePredictor:
         )
 
         # Predict masks
-        batched_mode = (
-            concat_points is not None and concat_points[0].shape[0] > 1
-        )  # multi object prediction
-        high_res_features = [
-            feat_level[img_idx].unsqueeze(0)
-            for feat_level in self._features["high_res_feats"]
-        ]
+        if isinstance(img_idx, torch.Tensor):
+            # Each prompt attends to the features of its own image
+            assert not upscale_masks, "Per-prompt images require upscale_masks=False"
+            img_idx = img_idx.to(self.device)
+            batched_mode = False
+            image_embed = self._features["image_embed"][img_idx]
+            high_res_features = [
+                feat_level[img_idx] for feat_level in self._features["high_res_feats"]
+            ]
+        else:
+            batched_mode = (
+                concat_points is not None and concat_points[0].shape[0] > 1
+            )  # multi object prediction
+            image_embed = self._features["image_embed"][img_idx].unsqueeze(0)
+            high_res_features = [
+                feat_level[img_idx].unsqueeze(0)
+                for feat_level in self._features["high_res_feats"]
+            ]
         low_res_masks, iou_predictions, _, _ = self.model.sam_mask_decoder(
-            image_embeddings=self._features["image_embed"][img_idx].unsqueeze(0),
+            image_embeddings=image_embed,
             image_pe=self.model.sam_prompt_encoder.get_dense_pe(),
             sparse_prompt_embeddings=sparse_embeddings,
             dense_prompt_embeddings=dense_embeddings,
@@ -427,6 +641,9 @@ class SAM2ImagePredictor:
             high_res_features=high_res_features,
         )
 
+        if not upscale_masks:
+            return low_res_masks, iou_predictions, torch.clamp(low_res_masks, -32.0, 32.0)
+
         # Upscale the masks to the original image resolution
         masks = self._transforms.postprocess_masks(
             low_res_masks, self._orig_hw[img_idx]
@@ -452,6 +669,123 @@ class SAM2ImagePredictor:
         ), "Features must exist if an image has been set."
         return self._features["image_embed"]
 
+    def get_features(self) -> Dict[str, Any]:
+        """
+        Returns all the features computed by `set_image` or `set_image_batch`, i.e.
+        everything needed to predict masks without running the image encoder again.
+
+        Returns:
+          (dict): A dict with keys
+            image_embed (torch.Tensor): The BxCxHxW image embeddings.
+            high_res_feats (list(torch.Tensor)): The high resolution backbone
+              features used by the mask decoder.
+            orig_hw (list(tuple(int, int))): The original size of each image.
+            is_batch (bool): Whether the features were set for a batch of images.
+        """
+        if not self._is_image_set:
+            raise RuntimeError(
+                "An image must be set with .set_image(...) to get its features."
+            )
+        return {
+            "image_embed": self._features["image_embed"],
+            "high_res_feats": list(self._features["high_res_feats"]),
+            "orig_hw": [tuple(int(v) for v in hw) for hw in self._orig_hw],
+            "is_batch": self._is_batch,
+        }
+
+    @torch.no_grad()
+    def set_features(
+        self,
+        image_embed: torch.Tensor,
+        high_res_feats: List[torch.Tensor],
+        orig_hw: Union[Tuple[int, int], List[Tuple[int, int]]],
+    ) -> None:
+        """
+        Sets precomputed image features (e.g. from `get_features` or an embedding
+        worker), allowing masks to be predicted with 'predict' or 'predict_batch'
+        without running the image encoder.
+
+        Arguments:
+          image_embed (torch.Tensor): The BxCxHxW image embeddings, as returned by
+            `get_image_embedding`.
+          high_res_feats (list(torch.Tensor)): The high resolution backbone
+            features, as returned by `get_features`.
+          orig_hw (tuple(int, int) or list(tuple(int, int))): The original (H, W)
+            size of the image. Pass a list with one size per image to set the
+            predictor in batched mode (for 'predict_batch').
+        """
+        self.reset_predictor()
+        is_batch = len(orig_hw) > 0 and isinstance(orig_hw[0], (list, tuple))
+        orig_hw = [tuple(hw) for hw in orig_hw] if is_batch else [tuple(orig_hw)]
+        batch_size = image_embed.shape[0]
+        if len(orig_hw) != batch_size:
+            raise ValueError(
+                f"Got {len(orig_hw)} image sizes for {batch_size} image embeddings."
+            )
+        if not is_batch and batch_size != 1:
+            raise ValueError(
+                "A list of image sizes is required to set a batch of image embeddings."
+            )
+        feat_sizes = [tuple(feat.shape[-2:]) for feat in high_res_feats]
+        feat_sizes.append(tuple(image_embed.shape[-2:]))
+        if feat_sizes != self._bb_feat_sizes or any(
+            feat.shape[0] != batch_size for feat in high_res_feats
+        ):
+            raise ValueError(
+                f"Features of spatial sizes {feat_sizes} do not match the expected "
+                f"sizes {self._bb_feat_sizes} for a batch of {batch_size} images."
+            )
+
+        self._features = {
+            "image_embed": image_embed.to(self.device),
+            "high_res_feats": [feat.to(self.device) for feat in high_res_feats],
+        }
+        self._orig_hw = orig_hw
+        self._is_batch = is_batch
+        self._is_image_set = True
+
+    def save_features(self, f: Union[str, os.PathLike, BinaryIO]) -> None:
+        """
+        Saves the features of the currently set image(s) with torch.save, so they
+        can be restored with `load_features` (possibly in another process).
+
+        Arguments:
+          f (str, os.PathLike or file-like object): Where to save the features.
+        """
+        features = self.get_features()
+        torch.save(
+            {
+                "image_embed": features["image_embed"].detach().cpu(),
+                "high_res_feats": [
+                    feat.detach().cpu() for feat in features["high_res_feats"]
+                ],
+                "orig_hw": [list(hw) for hw in features["orig_hw"]],
+                "is_batch": features["is_batch"],
+                "image_size": self.model.image_size,
+            },
+            f,
+        )
+
+    def load_features(self, f: Union[str, os.PathLike, BinaryIO]) -> None:
+        """
+        Loads features saved with `save_features` and sets them on the predictor.
+
+        Arguments:
+          f (str, os.PathLike or file-like object): Where to load the features from.
+        """
+        state = torch.load(f, map_location="cpu", weights_only=True)
+        if state["image_size"] != self.model.image_size:
+            raise ValueError(
+                f"Features were computed for image size {state['image_size']}, "
+                f"but the model uses image size {self.model.image_size}."
+            )
+        orig_hw = [tuple(hw) for hw in state["orig_hw"]]
+        self.set_features(
+            state["image_embed"],
+            state["high_res_feats"],
+            orig_hw if state["is_batch"] else orig_hw[0],
+        )
+
     @property
     def device(self) -> torch.device:
         return self.model.device
@@ -0,0 +1,355 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+# All rights reserved.
+
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+
+import logging
+import math
+from typing import List, Optional, Tuple, Union
+
+import numpy as np
+import torch
+from PIL.Image import Image
+
+from sam2.modeling.sam2_base import SAM2Base
+from sam2.sam2_image_predictor import SAM2ImagePredictor
+from sam2.utils.embedding_cache import EmbeddingCache
+
+
+def generate_tile_boxes(
+    im_size: Tuple[int, ...], tile_size: int, overlap: int
+) -> List[List[int]]:
+    """
+    Generates XYXY boxes of overlapping tiles of (at most) tile_size x tile_size
+    covering an image. Tiles are spread evenly so that neighbouring tiles overlap
+    by at least `overlap` pixels.
+    """
+    assert 0 <= overlap < tile_size, "overlap must be in [0, tile_size)"
+    im_h, im_w = im_size
+
+    def tile_starts(orig_len):
+        if orig_len <= tile_size:
+            return [0]
+        n_tiles = math.ceil((orig_len - tile_size) / (tile_size - overlap)) + 1
+        step = (orig_len - tile_size) / (n_tiles - 1)
+        return [int(round(i * step)) for i in range(n_tiles)]
+
+    return [
+        [x0, y0, min(x0 + tile_size, im_w), min(y0 + tile_size, im_h)]
+        for y0 in tile_starts(im_h)
+        for x0 in tile_starts(im_w)
+    ]
+
+
+class SAM2TiledImagePredictor:
+    def __init__(
+        self,
+        sam_model: SAM2Base,
+        tile_size: int = 1024,
+        tile_overlap: int = 256,
+        tile_batch_size: int = 4,
+        max_cache_bytes: int = 1 << 30,
+        mask_threshold: float = 0.0,
+        **kwargs,
+    ) -> None:
+        """
+        Predicts masks on very high resolution images by embedding overlapping
+        tiles instead of resizing the whole image to the model resolution, so
+        that small objects don't fall below the feature stride.
+
+        Tiles are embedded lazily, in batches, when a prompt needs them, and their
+        features are kept in a byte-bounded LRU cache, so peak memory does not
+        grow with the image size. Each prompt is routed to the tile that contains
+        it with the largest margin; prompts that don't fit in any single tile are
+        decoded on every tile they overlap and the logits are merged (max). The
+        masks only cover the bounding box of the tiles used, not the whole image.
+
+        Arguments:
+          sam_model (Sam-2): The model to use for mask prediction.
+          tile_size (int): The side of the square tiles, in original image pixels.
+            Each tile is resized to the model resolution, so tile_size equal to
+            the model image size keeps the native image resolution.
+          tile_overlap (int): The minimum overlap between neighbouring tiles, in
+            original image pixels. Objects smaller than this are always fully
+            contained in some tile.
+          tile_batch_size (int): The number of tiles embedded per image encoder call.
+          max_cache_bytes (int): The memory budget for the cached tile features.
+          mask_threshold (float): The threshold to use when converting mask logits
+            to binary masks.
+        """
+        self.predictor = SAM2ImagePredictor(
+            sam_model, mask_threshold=mask_threshold, **kwargs
+        )
+        self.tile_size = tile_size
+        self.tile_overlap = tile_overlap
+        self.tile_batch_size = tile_batch_size
+        self.mask_threshold = mask_threshold
+        self._tile_cache = EmbeddingCache(max_bytes=max_cache_bytes)
+
+        self._image = None
+        self._orig_hw = None
+        self.tile_boxes = []
+
+    def set_image(self, image: Union[np.ndarray, Image]) -> None:
+        """
+        Sets the image to predict masks on. Tiles are only embedded when a
+        prompt needs them, or with `embed_all_tiles`.
+
+        Arguments:
+          image (np.ndarray or PIL Image): The input image in RGB format, in HWC
+            format if np.ndarray, with pixel values in [0, 255].
+        """
+        self.reset_predictor()
+        if isinstance(image, Image):
+            image = np.asarray(image.convert("RGB"))
+        elif not isinstance(image, np.ndarray):
+            raise NotImplementedError("Image format not supported")
+        self._image = image
+        self._orig_hw = tuple(image.shape[:2])
+        self.tile_boxes = generate_tile_boxes(
+            self._orig_hw, self.tile_size, self.tile_overlap
+        )
+
+    def embed_all_tiles(self) -> None:
+        """
+        Embeds every tile of the current image ahead of the first prompt. Only
+        tiles within the cache budget are kept.
+        """
+        self._embed_tiles(list(range(len(self.tile_boxes))))
+
+    @torch.no_grad()
+    def predict(
+        self,
+        point_coords: Optional[np.ndarray] = None,
+        point_labels: Optional[np.ndarray] = None,
+        box: Optional[np.ndarray] = None,
+        multimask_output: bool = True,
+        return_logits: bool = False,
+    ) -> Tuple[np.ndarray, np.ndarray, List[int]]:
+        """
+        Predict masks for the given input prompts on the current image.
+
+        Arguments:
+          point_coords (np.ndarray or None): A Nx2 array of point prompts to the
+            model. Each point is in (X,Y) in pixels of the original image.
+          point_labels (np.ndarray or None): A length N array of labels for the
+            point prompts. 1 indicates a foreground point and 0 indicates a
+            background point.
+          box (np.ndarray or None): A length 4 array given a box prompt to the
+            model, in XYXY format.
+          multimask_output (bool): If true, the model will return three masks.
+            Only used for prompts routed to a single tile; prompts spanning
+            several tiles are decoded with a single mask per tile.
+          return_logits (bool): If true, returns un-thresholded masks logits
+            instead of a binary mask. Logits outside the decoded tiles are -32.
+
+        Returns:
+          (np.ndarray): The output masks in CxHxW format, where (H, W) is the
+            size of the returned box. Pixels outside it are background.
+          (np.ndarray): An array of length C containing the model's
+            predictions for the quality of each mask (averaged over tiles).
+          (list(int)): The XYXY box, in original image pixels, covered by the
+            masks: the bounding box of the tiles used for the prompt.
+        """
+        if self._image is None:
+            raise RuntimeError(
+                "An image must be set with .set_image(...) before mask prediction."
+            )
+        if point_coords is None and box is None:
+            raise ValueError("At least one point or box prompt is required.")
+        if point_coords is not None:
+            assert (
+                point_labels is not None
+            ), "point_labels must be supplied if point_coords is supplied."
+            point_coords = np.asarray(point_coords, dtype=np.float32).reshape(-1, 2)
+            point_labels = np.asarray(point_labels).reshape(-1)
+        if box is not None:
+            box = np.asarray(box, dtype=np.float32).reshape(4)
+
+        tile_idxs = self._route_prompt(point_coords, point_labels, box)
+        multimask_output = multimask_output and len(tile_idxs) == 1
+
+        # Convert the prompt to the coordinates of each tile
+        tile_points, tile_labels, tile_boxes = [], [], []
+        for tile_idx in tile_idxs:
+            x0, y0, x1, y1 = self.tile_boxes[tile_idx]
+            if point_coords is not None:
+                inside = (
+                    (point_coords[:, 0] >= x0)
+                    & (point_coords[:, 0] < x1)
+                    & (point_coords[:, 1] >= y0)
+                    & (point_coords[:, 1] < y1)
+                )
+                # Keep outside background points if the whole prompt fits in the tile
+                if len(tile_idxs) == 1:
+                    inside[:] = True
+                tile_points.append(point_coords[inside] - np.array([x0, y0]))
+                tile_labels.append(point_labels[inside])
+            if box is not None:
+                tile_box = np.array(
+                    [
+                        max(box[0], x0) - x0,
+                        max(box[1], y0) - y0,
+                        min(box[2], x1) - x0,
+                        min(box[3], y1) - y0,
+                    ],
+                    dtype=np.float32,
+                )
+                tile_boxes.append(tile_box)
+
+        features = self._embed_tiles(tile_idxs)
+        self.predictor.set_features(
+            torch.cat([f["image_embed"] for f in features], dim=0),
+            [
+                torch.cat([f["high_res_feats"][i] for f in features], dim=0)
+                for i in range(len(features[0]["high_res_feats"]))
+            ],
+            [f["orig_hw"][0] for f in features],
+        )
+        tile_masks, tile_ious, _ = self.predictor.predict_batch(
+            point_coords_batch=tile_points if point_coords is not None else None,
+            point_labels_batch=tile_labels if point_coords is not None else None,
+            box_batch=tile_boxes if box is not None else None,
+            multimask_output=multimask_output,
+            return_logits=True,
+        )
+        self.predictor.reset_predictor()
+
+        # Merge the tile masks within the bounding box of the tiles used, so the
+        # output size is bounded by the prompt, not by the image size
+        used_boxes = np.array([self.tile_boxes[i] for i in tile_idxs])
+        crop_box = [
+            int(used_boxes[:, 0].min()),
+            int(used_boxes[:, 1].min()),
+            int(used_boxes[:, 2].max()),
+            int(used_boxes[:, 3].max()),
+        ]
+        num_masks = tile_masks[0].shape[0]
+        crop_hw = (crop_box[3] - crop_box[1], crop_box[2] - crop_box[0])
+        if return_logits:
+            merged = np.full((num_masks, *crop_hw), -32.0, dtype=np.float32)
+        else:
+            # max(logits) > threshold is the union of the thresholded tile masks
+            merged = np.zeros((num_masks, *crop_hw), dtype=bool)
+        for tile_idx, masks in zip(tile_idxs, tile_masks):
+            x0, y0, x1, y1 = self.tile_boxes[tile_idx]
+            region = merged[
+                :, y0 - crop_box[1] : y1 - crop_box[1], x0 - crop_box[0] : x1 - crop_box[0]
+            ]
+            if return_logits:
+                np.maximum(region, masks, out=region)
+            else:
+                region |= masks > self.mask_threshold
+        ious = np.mean(np.stack(tile_ious, axis=0), axis=0)
+        return merged, ious, crop_box
+
+    def _route_prompt(
+        self,
+        point_coords: Optional[np.ndarray],
+        point_labels: Optional[np.ndarray],
+        box: Optional[np.ndarray],
+    ) -> List[int]:
+        # The region a prompt refers to is the box and its foreground points
+        # (background points only restrict the mask, they don't need to be covered).
+        region = []
+        if box is not None:
+            region.append(box.reshape(2, 2))
+        if point_coords is not None:
+            fg_points = point_coords[point_labels == 1]
+            region.append(fg_points if len(fg_points) > 0 else point_coords)
+        region = np.concatenate(region, axis=0)
+        rx0, ry0 = region.min(axis=0)
+        rx1, ry1 = region.max(axis=0)
+
+        tiles = np.array(self.tile_boxes, dtype=np.float32)
+        margins = np.stack(
+            [rx0 - tiles[:, 0], ry0 - tiles[:, 1], tiles[:, 2] - rx1, tiles[:, 3] - ry1],
+            axis=1,
+        ).min(axis=1)
+        if margins.max() >= 0:
+            # The prompt fits in a tile: use the one where it is the most centered
+            return [int(np.argmax(margins))]
+
+        # Otherwise use every tile the prompt region overlaps
+        overlaps = (
+            (tiles[:, 0] <= rx1)
+            & (tiles[:, 2] > rx0)
+            & (tiles[:, 1] <= ry1)
+            & (tiles[:, 3] > ry0)
+        )
+        tile_idxs = np.nonzero(overlaps)[0].tolist()
+        if box is None:
+            # Point prompts only need the tiles that contain a foreground point
+            fg_points = point_coords[point_labels == 1]
+            if len(fg_points) == 0:
+                raise ValueError(
+                    "Background-only point prompts must fit in a single tile; "
+                    "add a foreground point or a box."
+                )
+            tile_idxs = [
+                i
+                for i in tile_idxs
+                if np.any(
+                    (fg_points[:, 0] >= tiles[i, 0])
+                    & (fg_points[:, 0] < tiles[i, 2])
+                    & (fg_points[:, 1] >= tiles[i, 1])
+                    & (fg_points[:, 1] < tiles[i, 3])
+                )
+            ]
+        return tile_idxs
+
+    def _embed_tiles(self, tile_idxs: List[int]) -> List[dict]:
+        features = {}
+        missing = []
+        for tile_idx in tile_idxs:
+            cached = self._tile_cache.get(str(tile_idx))
+            if cached is not None:
+                features[tile_idx] = cached
+            else:
+                missing.append(tile_idx)
+
+        for start in range(0, len(missing), self.tile_batch_size):
+            batch_idxs = missing[start : start + self.tile_batch_size]
+            logging.info(f"Computing image embeddings for tiles {batch_idxs}...")
+            tiles = []
+            for tile_idx in batch_idxs:
+                x0, y0, x1, y1 = self.tile_boxes[tile_idx]
+                tiles.append(np.ascontiguousarray(self._image[y0:y1, x0:x1]))
+            self.predictor.set_image_batch(tiles)
+            batch_features = self.predictor.get_features()
+            self.predictor.reset_predictor()
+            for i, tile_idx in enumerate(batch_idxs):
+                # Clone so that evicting a tile actually frees its memory (a view
+                # would keep the features of the whole batch alive)
+                tile_features = {
+                    "image_embed": batch_features["image_embed"][i : i + 1].clone(),
+                    "high_res_feats": [
+                        feat[i : i + 1].clone()
+                        for feat in batch_features["high_res_feats"]
+                    ],
+                    "orig_hw": [batch_features["orig_hw"][i]],
+                }
+                self._tile_cache.put(str(tile_idx), tile_features)
+                features[tile_idx] = tile_features
+        return [features[tile_idx] for tile_idx in tile_idxs]
+
+    def cache_stats(self) -> dict:
+        """
+        Returns the hit/miss/eviction counters of the tile feature cache.
+        """
+        return self._tile_cache.stats()
+
+    @property
+    def device(self) -> torch.device:
+        return self.predictor.device
+
+    def reset_predictor(self) -> None:
+        """
+        Resets the current image and drops the cached tile features.
+        """
+        self.predictor.reset_predictor()
+        self._tile_cache.clear()
+        self._image = None
+        self._orig_hw = None
+        self.tile_boxes = []
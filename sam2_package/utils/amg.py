@@ -5,9 +5,11 @@
 # LICENSE file in the root directory of this source tree.
 
 import math
+import os
+from concurrent.futures import ThreadPoolExecutor
 from copy import deepcopy
 from itertools import product
-from typing import Any, Dict, Generator, ItemsView, List, Tuple
+from typing import Any, Dict, Generator, ItemsView, List, Optional, Tuple, Union
 
 import numpy as np
 import torch
@@ -15,6 +17,115 @@ import torch
 # Very lightly adapted from https://github.com/facebookresearch/segment-anything/blob/main/segment_anything/utils/amg.py
 
 
+class CompactRLE:
+    """
+    A batch of uncompressed RLEs (in the format returned by `mask_to_rle_pytorch`)
+    stored as a single counts buffer plus per-mask offsets: the counts of mask i
+    are counts[offsets[i] : offsets[i + 1]]. All masks share the same size.
+    Unlike a list of RLE dicts, this needs no Python object per mask and can be
+    filtered and concatenated with vectorized numpy operations.
+    """
+
+    def __init__(self, size: List[int], counts: np.ndarray, offsets: np.ndarray) -> None:
+        self.size = [int(size[0]), int(size[1])]
+        self.counts = np.asarray(counts, dtype=np.int64)
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+
+    @classmethod
+    def from_list(cls, rles: List[Dict[str, Any]], size=None) -> "CompactRLE":
+        if len(rles) > 0:
+            size = rles[0]["size"]
+        assert size is not None, "size is required for an empty list of RLEs."
+        lengths = [len(rle["counts"]) for rle in rles]
+        counts = np.fromiter(
+            (c for rle in rles for c in rle["counts"]), dtype=np.int64, count=sum(lengths)
+        )
+        offsets = np.concatenate([[0], np.cumsum(lengths, dtype=np.int64)])
+        return cls(size, counts, offsets)
+
+    @classmethod
+    def cat(cls, rles_list: List["CompactRLE"]) -> "CompactRLE":
+        size = rles_list[0].size
+        assert all(
+            r.size == size for r in rles_list
+        ), "Can only concatenate RLEs of masks with the same size."
+        counts = np.concatenate([r.counts for r in rles_list])
+        starts = np.cumsum([0] + [len(r.counts) for r in rles_list[:-1]])
+        offsets = np.concatenate(
+            [[0]] + [r.offsets[1:] + start for r, start in zip(rles_list, starts)]
+        )
+        return cls(size, counts, offsets)
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def lengths(self) -> np.ndarray:
+        return np.diff(self.offsets)
+
+    def __getitem__(self, idx: int) -> Dict[str, Any]:
+        counts = self.counts[self.offsets[idx] : self.offsets[idx + 1]]
+        return {"size": list(self.size), "counts": counts.tolist()}
+
+    def __iter__(self) -> Generator[Dict[str, Any], None, None]:
+        yield from self.to_list()
+
+    def to_list(self) -> List[Dict[str, Any]]:
+        """Returns the RLEs as a list of uncompressed RLE dicts."""
+        counts = self.counts.tolist()
+        offsets = self.offsets.tolist()
+        return [
+            {"size": list(self.size), "counts": counts[offsets[i] : offsets[i + 1]]}
+            for i in range(len(self))
+        ]
+
+    def select(self, keep: Any) -> "CompactRLE":
+        """Returns the RLEs selected by a boolean mask or an index array."""
+        if isinstance(keep, torch.Tensor):
+            keep = keep.detach().cpu().numpy()
+        keep = np.asarray(keep)
+        if keep.dtype == bool:
+            keep = np.nonzero(keep)[0]
+        keep = keep.astype(np.int64).reshape(-1)
+        lengths = self.lengths()[keep]
+        offsets = np.concatenate([[0], np.cumsum(lengths)])
+        # Gather counts[offsets[k] : offsets[k + 1]] for every kept mask k at once
+        src_idxs = np.repeat(self.offsets[:-1][keep] - offsets[:-1], lengths)
+        src_idxs += np.arange(offsets[-1], dtype=np.int64)
+        return CompactRLE(self.size, self.counts[src_idxs], offsets)
+
+    def contains(self, coords: np.ndarray, max_queries: int = 1 << 20) -> np.ndarray:
+        """
+        Returns a NxP boolean array indicating whether each of the P integer pixel
+        coordinates (in XY format) is inside each of the N masks. Masks are
+        processed in chunks of at most max_queries lookups, which bounds the size
+        of the int64 temporaries.
+        """
+        h, w = self.size
+        coords = np.asarray(coords, dtype=np.int64).reshape(-1, 2)
+        pixel_idxs = coords[:, 0] * h + coords[:, 1]  # Fortran order
+        # Every mask's counts sum to h*w, so the runs of mask i cover the range
+        # [i*h*w, (i+1)*h*w) of the cumulative counts of the whole buffer
+        run_ends = np.cumsum(self.counts)
+        out = np.empty((len(self), len(pixel_idxs)), dtype=bool)
+        chunk = max(1, max_queries // max(len(pixel_idxs), 1))
+        for start in range(0, len(self), chunk):
+            end = min(start + chunk, len(self))
+            queries = np.arange(start, end)[:, None] * (h * w) + pixel_idxs[None, :]
+            run_idxs = np.searchsorted(run_ends, queries, side="right")
+            out[start:end] = (run_idxs - self.offsets[start:end, None]) % 2 == 1
+        return out
+
+    def areas(self) -> np.ndarray:
+        """Returns the foreground area of every mask (the sum of its odd runs)."""
+        lengths = self.lengths()
+        mask_idxs = np.repeat(np.arange(len(self)), lengths)
+        pos_in_mask = np.arange(len(self.counts)) - np.repeat(self.offsets[:-1], lengths)
+        fg_counts = np.where(pos_in_mask % 2 == 1, self.counts, 0)
+        return np.bincount(mask_idxs, weights=fg_counts, minlength=len(self)).astype(
+            np.int64
+        )
+
+
 class MaskData:
     """
     A structure for storing masks and their related data in batched format.
@@ -24,14 +135,14 @@ class MaskData:
     def __init__(self, **kwargs) -> None:
         for v in kwargs.values():
             assert isinstance(
-                v, (list, np.ndarray, torch.Tensor)
-            ), "MaskData only supports list, numpy arrays, and torch tensors."
+                v, (list, np.ndarray, torch.Tensor, CompactRLE)
+            ), "MaskData only supports list, numpy arrays, torch tensors and CompactRLE."
         self._stats = dict(**kwargs)
 
     def __setitem__(self, key: str, item: Any) -> None:
         assert isinstance(
-            item, (list, np.ndarray, torch.Tensor)
-        ), "MaskData only supports list, numpy arrays, and torch tensors."
+            item, (list, np.ndarray, torch.Tensor, CompactRLE)
+        ), "MaskData only supports list, numpy arrays, torch tensors and CompactRLE."
         self._stats[key] = item
 
     def __delitem__(self, key: str) -> None:
@@ -51,6 +162,8 @@ class MaskData:
                 self._stats[k] = v[torch.as_tensor(keep, device=v.device)]
             elif isinstance(v, np.ndarray):
                 self._stats[k] = v[keep.detach().cpu().numpy()]
+            elif isinstance(v, CompactRLE):
+                self._stats[k] = v.select(keep)
             elif isinstance(v, list) and keep.dtype == torch.bool:
                 self._stats[k] = [a for i, a in enumerate(v) if keep[i]]
             elif isinstance(v, list):
@@ -66,6 +179,8 @@ class MaskData:
                 self._stats[k] = torch.cat([self._stats[k], v], dim=0)
             elif isinstance(v, np.ndarray):
                 self._stats[k] = np.concatenate([self._stats[k], v], axis=0)
+            elif isinstance(v, CompactRLE):
+                self._stats[k] = CompactRLE.cat([self._stats[k], v])
             elif isinstance(v, list):
                 self._stats[k] = self._stats[k] + deepcopy(v)
             else:
@@ -111,46 +226,93 @@ def mask_to_rle_pytorch(tensor: torch.Tensor) -> List[Dict[str, Any]]:
     Encodes masks to an uncompressed RLE, in the format expected by
     pycoco tools.
     """
+    return mask_to_rle_compact(tensor).to_list()
+
+
+def mask_to_rle_compact(tensor: torch.Tensor) -> CompactRLE:
+    """
+    Encodes a BxHxW batch of binary masks to uncompressed RLEs (same counts as
+    `mask_to_rle_pytorch`), stored as a `CompactRLE`. The run lengths of all
+    masks are computed on the masks' device with a single device-to-host copy.
+    """
     # Put in fortran order and flatten h,w
     b, h, w = tensor.shape
     tensor = tensor.permute(0, 2, 1).flatten(1)
+    device = tensor.device
+    if b == 0:
+        return CompactRLE([h, w], np.zeros(0, np.int64), np.zeros(1, np.int64))
 
-    # Compute change indices
+    # Compute change indices, i.e. where each run (but the first) of a mask starts
     diff = tensor[:, 1:] ^ tensor[:, :-1]
     change_indices = diff.nonzero()
+    rows, run_starts = change_indices[:, 0], change_indices[:, 1] + 1
+    n_changes = torch.bincount(rows, minlength=b)
+
+    # Lay out the run boundaries [0, run_starts..., h*w] of every mask back to back
+    # (nonzero returns the change indices sorted by mask) and take their differences
+    bounds_offsets = torch.cumsum(n_changes + 2, dim=0) - (n_changes + 2)
+    change_offsets = torch.cumsum(n_changes, dim=0) - n_changes
+    bounds = torch.empty(
+        int(change_indices.shape[0]) + 2 * b, dtype=torch.int64, device=device
+    )
+    bounds[bounds_offsets] = 0
+    bounds[bounds_offsets + n_changes + 1] = h * w
+    rank_in_mask = torch.arange(rows.shape[0], device=device) - change_offsets[rows]
+    bounds[bounds_offsets[rows] + 1 + rank_in_mask] = run_starts
+    is_run = torch.ones(bounds.shape[0] - 1, dtype=torch.bool, device=device)
+    is_run[(bounds_offsets + n_changes + 1)[:-1]] = False  # across two masks
+    runs = (bounds[1:] - bounds[:-1])[is_run]
+
+    # Counts start with a background run, so prepend 0 to masks starting with 1
+    starts_with_fg = tensor[:, 0].to(torch.int64)
+    n_counts = n_changes + 1 + starts_with_fg
+    offsets = torch.cat(
+        [torch.zeros(1, dtype=torch.int64, device=device), torch.cumsum(n_counts, 0)]
+    )
+    counts = torch.zeros(int(runs.shape[0]) + b, dtype=torch.int64, device=device)
+    counts_mask_idxs = torch.repeat_interleave(
+        torch.arange(b, device=device), n_changes + 1
+    )
+    run_offsets = torch.cumsum(n_changes + 1, dim=0) - (n_changes + 1)
+    rank_in_mask = torch.arange(runs.shape[0], device=device) - run_offsets[
+        counts_mask_idxs
+    ]
+    dst_idxs = offsets[:-1][counts_mask_idxs] + starts_with_fg[counts_mask_idxs]
+    counts[dst_idxs + rank_in_mask] = runs
 
-    # Encode run length
-    out = []
-    for i in range(b):
-        cur_idxs = change_indices[change_indices[:, 0] == i, 1]
-        cur_idxs = torch.cat(
-            [
-                torch.tensor([0], dtype=cur_idxs.dtype, device=cur_idxs.device),
-                cur_idxs + 1,
-                torch.tensor([h * w], dtype=cur_idxs.dtype, device=cur_idxs.device),
-            ]
-        )
-        btw_idxs = cur_idxs[1:] - cur_idxs[:-1]
-        counts = [] if tensor[i, 0] == 0 else [0]
-        counts.extend(btw_idxs.detach().cpu().tolist())
-        out.append({"size": [h, w], "counts": counts})
-    return out
+    # Single device-to-host copy for the offsets and the counts
+    out = torch.cat([offsets, counts[: int(n_counts.sum())]]).cpu().numpy()
+    return CompactRLE([h, w], out[b + 1 :], out[: b + 1])
 
 
 def rle_to_mask(rle: Dict[str, Any]) -> np.ndarray:
     """Compute a binary mask from an uncompressed RLE."""
     h, w = rle["size"]
-    mask = np.empty(h * w, dtype=bool)
-    idx = 0
-    parity = False
-    for count in rle["counts"]:
-        mask[idx : idx + count] = parity
-        idx += count
-        parity ^= True
+    counts = np.asarray(rle["counts"], dtype=np.int64)
+    # Runs alternate between background and foreground, starting with background
+    parity = np.arange(len(counts)) % 2 == 1
+    mask = np.repeat(parity, counts)
     mask = mask.reshape(w, h)
     return mask.transpose()  # Put in C order
 
 
+def rles_to_masks(rles: Union[CompactRLE, List[Dict[str, Any]]]) -> np.ndarray:
+    """
+    Compute a NxHxW array of binary masks from N uncompressed RLEs of masks of
+    the same size, given as a list or a CompactRLE, in one shot.
+    """
+    if not isinstance(rles, CompactRLE):
+        if len(rles) == 0:
+            raise ValueError("Cannot infer the mask size from an empty list of RLEs.")
+        rles = CompactRLE.from_list(rles)
+    h, w = rles.size
+    lengths = rles.lengths()
+    pos_in_mask = np.arange(len(rles.counts)) - np.repeat(rles.offsets[:-1], lengths)
+    masks = np.repeat(pos_in_mask % 2 == 1, rles.counts)
+    masks = masks.reshape(len(rles), w, h)
+    return masks.transpose(0, 2, 1)  # Put in C order
+
+
 def area_from_rle(rle: Dict[str, Any]) -> int:
     return sum(rle["counts"][1::2])
 
@@ -178,6 +340,83 @@ def calculate_stability_score(
     return intersections / unions
 
 
+def sample_rles(rles: CompactRLE, max_side: int = 128) -> torch.Tensor:
+    """
+    Samples N masks given as a CompactRLE on a regular grid of at most max_side
+    points per side, without decoding them. Returns a NxP boolean tensor of the
+    sampled pixels, suitable as input to `mask_iou_matrix`.
+    """
+    h, w = rles.size
+    stride = max(1, math.ceil(max(h, w) / max_side))
+    ys = np.arange(stride // 2, h, stride)
+    xs = np.arange(stride // 2, w, stride)
+    grid_x, grid_y = np.meshgrid(xs, ys)
+    coords = np.stack([grid_x.ravel(), grid_y.ravel()], axis=1)
+    return torch.from_numpy(rles.contains(coords))
+
+
+def sampled_mask_iou_matrix(
+    rles: CompactRLE, boxes: torch.Tensor, max_side: int = 128
+) -> torch.Tensor:
+    """
+    Approximates the NxN pairwise mask IoU of N masks given as a CompactRLE by
+    sampling them with `sample_rles`. Masks smaller than the sampling stride
+    may have no sampled pixel, so pairs involving such a mask use the IoU of
+    their XYXY boxes (in pixel coordinates, inclusive) instead.
+    """
+    samples = sample_rles(rles, max_side)
+    ious = mask_iou_matrix(samples)
+    unsampled = ~samples.any(dim=1)
+    if unsampled.any():
+        boxes = boxes.detach().float().cpu()
+        top_left = torch.max(boxes[:, None, :2], boxes[None, :, :2])
+        bottom_right = torch.min(boxes[:, None, 2:], boxes[None, :, 2:])
+        intersections = (bottom_right - top_left + 1).clamp(min=0).prod(dim=-1)
+        areas = (boxes[:, 2:] - boxes[:, :2] + 1).prod(dim=-1)
+        box_ious = intersections / (areas[:, None] + areas[None, :] - intersections)
+        ious = torch.where(unsampled[:, None] | unsampled[None, :], box_ious, ious)
+    return ious
+
+
+def mask_iou_matrix(masks: torch.Tensor) -> torch.Tensor:
+    """
+    Computes the NxN pairwise IoU of N binary masks of shape NxHxW (or NxP
+    flattened), e.g. low res masks or masks sampled with `sample_rles`.
+    """
+    masks = masks.flatten(1).float()
+    intersections = masks @ masks.T
+    areas = masks.sum(dim=1)
+    unions = areas[:, None] + areas[None, :] - intersections
+    return intersections / unions.clamp(min=1)
+
+
+def mask_nms(
+    ious: torch.Tensor,
+    scores: torch.Tensor,
+    iou_threshold: Union[float, torch.Tensor],
+) -> torch.Tensor:
+    """
+    Greedy non-maximal suppression given the pairwise IoU matrix of N masks
+    (see `mask_iou_matrix`). iou_threshold is either a float or an NxN tensor
+    of per-pair thresholds. Returns the indices of the kept masks sorted in
+    decreasing order of scores, like torchvision's nms.
+    """
+    order = torch.argsort(scores.detach().cpu(), descending=True, stable=True).numpy()
+    ious = ious.detach().cpu().numpy()[order][:, order]
+    if isinstance(iou_threshold, torch.Tensor):
+        iou_threshold = iou_threshold.detach().cpu().numpy()[order][:, order]
+    else:
+        iou_threshold = np.full_like(ious, iou_threshold)
+    suppressed = np.zeros(len(order), dtype=bool)
+    keep = []
+    for i in range(len(order)):
+        if suppressed[i]:
+            continue
+        keep.append(i)
+        suppressed |= ious[i] > iou_threshold[i]
+    return torch.as_tensor(order[keep], dtype=torch.int64)
+
+
 def build_point_grid(n_per_side: int) -> np.ndarray:
     """Generates a 2D grid of points evenly spaced in [0,1]x[0,1]."""
     offset = 1 / (2 * n_per_side)
@@ -280,19 +519,56 @@ def remove_small_regions(
     working_mask = (correct_holes ^ mask).astype(np.uint8)
     n_labels, regions, stats, _ = cv2.connectedComponentsWithStats(working_mask, 8)
     sizes = stats[:, -1][1:]  # Row 0 is background label
-    small_regions = [i + 1 for i, s in enumerate(sizes) if s < area_thresh]
-    if len(small_regions) == 0:
+    small_regions = sizes < area_thresh
+    if not small_regions.any():
         return mask, False
-    fill_labels = [0] + small_regions
-    if not correct_holes:
-        fill_labels = [i for i in range(n_labels) if i not in fill_labels]
+    # Lookup table from region label to output value, label 0 is the background
+    # of the working mask (i.e. the mask itself when correcting holes)
+    fill_labels = np.empty(n_labels, dtype=bool)
+    if correct_holes:
+        fill_labels[0] = True
+        fill_labels[1:] = small_regions
+    else:
+        fill_labels[0] = False
+        fill_labels[1:] = ~small_regions
         # If every region is below threshold, keep largest
-        if len(fill_labels) == 0:
-            fill_labels = [int(np.argmax(sizes)) + 1]
-    mask = np.isin(regions, fill_labels)
+        if not fill_labels.any():
+            fill_labels[int(np.argmax(sizes)) + 1] = True
+    mask = fill_labels[regions]
     return mask, True
 
 
+def remove_small_regions_batch(
+    masks: np.ndarray, area_thresh: float, num_workers: Optional[int] = None
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Removes small holes and then small disconnected regions in a NxHxW batch
+    of masks, processing the masks in parallel on a thread pool (opencv
+    releases the GIL). Returns the new masks and a boolean array of length N
+    indicating which masks have been modified.
+    """
+
+    def _process(mask):
+        mask, changed_holes = remove_small_regions(mask, area_thresh, mode="holes")
+        mask, changed_islands = remove_small_regions(mask, area_thresh, mode="islands")
+        return mask, changed_holes or changed_islands
+
+    if num_workers is None:
+        num_workers = min(32, os.cpu_count() or 1)
+    if num_workers <= 1 or len(masks) <= 1:
+        results = [_process(mask) for mask in masks]
+    else:
+        with ThreadPoolExecutor(max_workers=num_workers) as executor:
+            results = list(executor.map(_process, masks))
+
+    new_masks = np.empty((len(masks),) + masks.shape[1:], dtype=bool)
+    changed = np.zeros(len(masks), dtype=bool)
+    for i, (mask, mask_changed) in enumerate(results):
+        new_masks[i] = mask
+        changed[i] = mask_changed
+    return new_masks, changed
+
+
 def coco_encode_rle(uncompressed_rle: Dict[str, Any]) -> Dict[str, Any]:
     from pycocotools import mask as mask_utils  # type: ignore
 
@@ -0,0 +1,231 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+# All rights reserved.
+
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+
+import hashlib
+import logging
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+import numpy as np
+import torch
+
+
+def _features_nbytes(features: Dict[str, Any]) -> int:
+    tensors = [features["image_embed"], *features["high_res_feats"]]
+    return sum(t.numel() * t.element_size() for t in tensors)
+
+
+class EmbeddingCache:
+    """
+    A cache of image features (as returned by `SAM2ImagePredictor.get_features`)
+    keyed by a hash of the image content, so that repeated `set_image` calls on the
+    same image (e.g. a user clicking repeatedly across requests) skip the image
+    encoder.
+
+    Entries are kept in an in-memory LRU bounded by `max_bytes`. If `disk_dir` is
+    set, entries are also written there and looked up on a memory miss, which lets
+    the cache survive memory evictions and process restarts.
+
+    The cache is thread-safe. Hit, miss and eviction counters are available
+    through `stats()`.
+    """
+
+    def __init__(
+        self,
+        max_bytes: int = 1 << 30,
+        disk_dir: Optional[str] = None,
+        disk_max_bytes: Optional[int] = None,
+        namespace: str = "",
+    ) -> None:
+        """
+        Arguments:
+          max_bytes (int): The memory budget for cached features, in bytes.
+          disk_dir (str or None): If set, a directory where entries are also
+            stored on disk.
+          disk_max_bytes (int or None): If set, the least recently used files in
+            disk_dir are removed to keep its size under this budget.
+          namespace (str): Mixed into every key. Use a different namespace (e.g.
+            the model config name) for caches shared between different models.
+        """
+        self.max_bytes = max_bytes
+        self.disk_dir = disk_dir
+        self.disk_max_bytes = disk_max_bytes
+        self.namespace = namespace
+        if disk_dir is not None:
+            os.makedirs(disk_dir, exist_ok=True)
+
+        self._entries = OrderedDict()
+        self._entry_bytes = {}
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._counters = {
+            "hits": 0,
+            "disk_hits": 0,
+            "misses": 0,
+            "evictions": 0,
+            "disk_writes": 0,
+            "disk_evictions": 0,
+        }
+
+    def key_for_image(self, image: Any) -> str:
+        """
+        Returns the cache key of an image (np.ndarray or PIL Image), a hash of its
+        pixel content, shape and dtype.
+        """
+        arr = np.ascontiguousarray(np.asarray(image))
+        h = hashlib.blake2b(digest_size=20)
+        h.update(self.namespace.encode("utf-8"))
+        h.update(str(arr.shape).encode("utf-8"))
+        h.update(arr.dtype.str.encode("utf-8"))
+        h.update(memoryview(arr).cast("B"))
+        return h.hexdigest()
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """
+        Returns the cached features for `key`, or None on a miss.
+        """
+        with self._lock:
+            features = self._entries.get(key)
+            if features is not None:
+                self._entries.move_to_end(key)
+                self._counters["hits"] += 1
+                return features
+
+        features = self._read_from_disk(key)
+        with self._lock:
+            if features is None:
+                self._counters["misses"] += 1
+                return None
+            self._counters["disk_hits"] += 1
+            self._insert(key, features)
+        return features
+
+    def put(self, key: str, features: Dict[str, Any]) -> None:
+        """
+        Caches the features (image_embed, high_res_feats and orig_hw) for `key`.
+        """
+        features = {
+            "image_embed": features["image_embed"],
+            "high_res_feats": list(features["high_res_feats"]),
+            "orig_hw": [tuple(int(v) for v in hw) for hw in features["orig_hw"]],
+        }
+        with self._lock:
+            self._insert(key, features)
+        if self.disk_dir is not None:
+            self._write_to_disk(key, features)
+
+    def __contains__(self, key: str) -> bool:
+        with self._lock:
+            if key in self._entries:
+                return True
+        return self.disk_dir is not None and os.path.exists(self._disk_path(key))
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def clear(self) -> None:
+        """
+        Drops all in-memory entries (files in disk_dir are kept).
+        """
+        with self._lock:
+            self._entries.clear()
+            self._entry_bytes.clear()
+            self._bytes = 0
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Returns the cache counters (hits, disk_hits, misses, evictions,
+        disk_writes, disk_evictions) and the current number of entries and bytes.
+        """
+        with self._lock:
+            return {
+                **self._counters,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+            }
+
+    def _insert(self, key: str, features: Dict[str, Any]) -> None:
+        # Must be called with self._lock held
+        nbytes = _features_nbytes(features)
+        if key in self._entries:
+            self._bytes -= self._entry_bytes.pop(key)
+            del self._entries[key]
+        if nbytes > self.max_bytes:
+            return
+        self._entries[key] = features
+        self._entry_bytes[key] = nbytes
+        self._bytes += nbytes
+        while self._bytes > self.max_bytes:
+            old_key, _ = self._entries.popitem(last=False)
+            self._bytes -= self._entry_bytes.pop(old_key)
+            self._counters["evictions"] += 1
+
+    def _disk_path(self, key: str) -> str:
+        return os.path.join(self.disk_dir, f"{key}.pt")
+
+    def _read_from_disk(self, key: str) -> Optional[Dict[str, Any]]:
+        if self.disk_dir is None:
+            return None
+        path = self._disk_path(key)
+        try:
+            state = torch.load(path, map_location="cpu", weights_only=True)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logging.warning(f"Ignoring unreadable embedding cache file {path}: {e}")
+            return None
+        # Refresh the access time used for disk LRU eviction
+        os.utime(path)
+        return {
+            "image_embed": state["image_embed"],
+            "high_res_feats": state["high_res_feats"],
+            "orig_hw": [tuple(hw) for hw in state["orig_hw"]],
+        }
+
+    def _write_to_disk(self, key: str, features: Dict[str, Any]) -> None:
+        path = self._disk_path(key)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        torch.save(
+            {
+                "image_embed": features["image_embed"].detach().cpu(),
+                "high_res_feats": [
+                    feat.detach().cpu() for feat in features["high_res_feats"]
+                ],
+                "orig_hw": [list(hw) for hw in features["orig_hw"]],
+            },
+            tmp_path,
+        )
+        # Atomic rename so concurrent readers never see a partially written file
+        os.replace(tmp_path, path)
+        with self._lock:
+            self._counters["disk_writes"] += 1
+        if self.disk_max_bytes is not None:
+            self._evict_disk()
+
+    def _evict_disk(self) -> None:
+        files = []
+        for name in os.listdir(self.disk_dir):
+            if not name.endswith(".pt"):
+                continue
+            path = os.path.join(self.disk_dir, name)
+            try:
+                st = os.stat(path)
+            except FileNotFoundError:
+                continue
+            files.append((st.st_mtime, st.st_size, path))
+        total = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if total <= self.disk_max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                continue
+            total -= size
+            with self._lock:
+                self._counters["disk_evictions"] += 1
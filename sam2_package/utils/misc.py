@@ -6,6 +6,7 @@
 
 import os
 import warnings
+from concurrent.futures import ThreadPoolExecutor
 from threading import Thread
 
 import numpy as np
@@ -47,6 +48,8 @@ def get_sdpa_settings():
 def get_connected_components(mask):
     """
     Get the connected components (8-connectivity) of binary masks of shape (N, 1, H, W).
+    Uses the compiled CUDA extension for CUDA tensors when it is available, and an
+    opencv implementation on CPU otherwise.
 
     Inputs:
     - mask: A binary mask tensor of shape (N, 1, H, W), where 1 is foreground and 0 is
@@ -58,9 +61,53 @@ def get_connected_components(mask):
     - counts: A tensor of shape (N, 1, H, W) containing the area of the connected
               components for foreground pixels and 0 for background pixels.
     """
-    from sam2 import _C
+    if mask.is_cuda:
+        try:
+            from sam2 import _C
+        except ImportError:
+            _C = None
+        if _C is not None:
+            return _C.get_connected_componnets(mask.to(torch.uint8).contiguous())
+    # Fall back to opencv on CPU (e.g. CPU-only workers or the CUDA extension
+    # not being built), with the same labels/counts contract
+    labels, counts = _get_connected_components_cpu(mask)
+    return labels.to(mask.device), counts.to(mask.device)
+
+
+def _get_connected_components_cpu(mask, num_workers=None):
+    """
+    CPU implementation of `get_connected_components` with opencv. The N*C
+    masks are labeled in parallel on a thread pool (opencv releases the GIL).
+    Labels are unique positive ids per component (not necessarily the same
+    ids as the CUDA kernel), and 0 for background pixels.
+    """
+    import cv2  # type: ignore
+
+    N, C, H, W = mask.shape
+    mask_np = mask.to(torch.uint8).reshape(N * C, H, W).cpu().numpy()
+    labels = np.zeros((N * C, H, W), dtype=np.int32)
+    counts = np.zeros((N * C, H, W), dtype=np.int32)
+
+    def _label(i):
+        _, labels[i], stats, _ = cv2.connectedComponentsWithStats(
+            mask_np[i], connectivity=8, ltype=cv2.CV_32S
+        )
+        areas = stats[:, cv2.CC_STAT_AREA].astype(np.int32)
+        areas[0] = 0  # background
+        counts[i] = areas[labels[i]]
+
+    if num_workers is None:
+        num_workers = min(32, os.cpu_count() or 1)
+    if num_workers <= 1 or N * C <= 1:
+        for i in range(N * C):
+            _label(i)
+    else:
+        with ThreadPoolExecutor(max_workers=num_workers) as executor:
+            list(executor.map(_label, range(N * C)))
 
-    return _C.get_connected_componnets(mask.to(torch.uint8).contiguous())
+    labels = torch.from_numpy(labels).reshape(N, C, H, W)
+    counts = torch.from_numpy(counts).reshape(N, C, H, W)
+    return labels, counts
 
 
 def mask_to_box(masks: torch.Tensor):
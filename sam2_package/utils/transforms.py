@@ -9,7 +9,6 @@ import warnings
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
-from torchvision.transforms import Normalize, Resize, ToTensor
 
 
 class SAM2Transforms(nn.Module):
@@ -26,13 +25,32 @@ class SAM2Transforms(nn.Module):
         self.max_sprinkle_area = max_sprinkle_area
         self.mean = [0.485, 0.456, 0.406]
         self.std = [0.229, 0.224, 0.225]
-        self.to_tensor = ToTensor()
-        self.transforms = torch.jit.script(
-            nn.Sequential(
-                Resize((self.resolution, self.resolution)),
-                Normalize(self.mean, self.std),
+        # torchvision and the scripted Resize/Normalize pipeline are built on first
+        # use, so constructing a predictor (e.g. to only decode from precomputed
+        # embeddings) doesn't pay for the torchvision import and torch.jit.script.
+        self._to_tensor = None
+        self._transforms = None
+
+    @property
+    def to_tensor(self):
+        if self._to_tensor is None:
+            from torchvision.transforms import ToTensor
+
+            self._to_tensor = ToTensor()
+        return self._to_tensor
+
+    @property
+    def transforms(self):
+        if self._transforms is None:
+            from torchvision.transforms import Normalize, Resize
+
+            self._transforms = torch.jit.script(
+                nn.Sequential(
+                    Resize((self.resolution, self.resolution)),
+                    Normalize(self.mean, self.std),
+                )
             )
-        )
+        return self._transforms
 
     def __call__(self, x):
         x = self.to_tensor(x)
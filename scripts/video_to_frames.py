@@ -6,11 +6,16 @@ Usage: python video_to_frames.py <input_video> <output_dir>
 
 import os
 import sys
-import cv2
 import argparse
+import json
+import time
 from pathlib import Path
 from tqdm import tqdm
 
+# フレームと一緒に保存する元動画の情報（結果を動画に書き出す時にFPSを使う）
+VIDEO_INFO_FILENAME = "video_info.json"
+DEFAULT_FPS = 30.0
+
 
 def video_to_frames(video_path, output_dir, quality=2):
     """
@@ -24,6 +29,8 @@ def video_to_frames(video_path, output_dir, quality=2):
     Returns:
         int: 変換されたフレーム数
     """
+    # cv2 は import が重いため、実際に動画を読むときだけ読み込む
+    import cv2
     
     # 出力ディレクトリを作成
     os.makedirs(output_dir, exist_ok=True)
@@ -46,6 +53,8 @@ def video_to_frames(video_path, output_dir, quality=2):
     print(f"  解像度: {width}x{height}")
     print(f"  出力ディレクトリ: {output_dir}")
     
+    write_video_info(output_dir, fps, width, height)
+    
     frame_count = 0
     
     # プログレスバー付きでフレームを抽出
@@ -71,6 +80,193 @@ def video_to_frames(video_path, output_dir, quality=2):
     return frame_count
 
 
+def video_to_frames_streaming(video_path, output_dir, is_complete, quality=95,
+                              poll_interval=0.5, stall_timeout=60, growth=1.5,
+                              frame_callback=None):
+    """
+    アップロード中（書き込み途中）の動画をJPEGフレームに変換する
+
+    ファイルが growth 倍に伸びるたびに開き直し、書き出し済みのフレームを読み飛ばして
+    新しいフレームだけを書き出す。書き込み途中のファイルでは末尾のフレームが欠けている
+    可能性があるため、最後に読めたフレームは完了するまで書き出さない。
+    MKV・AVIなどは途中からでも読めるが、インデックスが末尾にあるMP4は
+    アップロードが完了するまで読めない（完了後にまとめて変換する）。
+    読めるかどうかは can_decode_partial で事前に判定できる。
+
+    Args:
+        video_path (str): 書き込み中の動画ファイルのパス
+        output_dir (str): 出力ディレクトリのパス
+        is_complete (callable): 書き込みが完了していればTrueを返す関数
+        quality (int): JPEG品質 (1-100)
+        poll_interval (float): ファイルサイズを確認する間隔（秒）
+        stall_timeout (float): ファイルがこの秒数伸びなければ中断とみなす
+        growth (float): 開き直すまでにファイルが伸びる倍率
+        frame_callback (callable): フレームを書き出すたびに書き出し済みフレーム数で呼ばれる関数
+
+    Returns:
+        int: 変換されたフレーム数
+
+    Raises:
+        TimeoutError: 書き込みが stall_timeout 秒以上止まった場合
+        ValueError: 完了後の動画ファイルを開けない場合
+    """
+    import cv2
+
+    os.makedirs(output_dir, exist_ok=True)
+
+    frame_count = 0
+    decoded_size = 0
+    last_size = -1
+    last_growth = time.monotonic()
+
+    while True:
+        complete = is_complete()
+        size = os.path.getsize(video_path) if os.path.exists(video_path) else 0
+        if size != last_size:
+            last_size = size
+            last_growth = time.monotonic()
+        elif not complete and time.monotonic() - last_growth > stall_timeout:
+            raise TimeoutError(f"動画の書き込みが{stall_timeout:.0f}秒以上止まっています: {video_path}")
+
+        if complete or (size > 0 and size >= decoded_size * growth):
+            decoded_size = size
+            frame_count = _write_new_frames(cv2, video_path, output_dir, frame_count,
+                                            complete, quality, frame_callback)
+            if complete:
+                if frame_count == 0:
+                    raise ValueError(f"動画ファイルを開けません: {video_path}")
+                print(f"変換完了: {frame_count}フレーム")
+                return frame_count
+
+        time.sleep(poll_interval)
+
+
+def can_decode_partial(video_path):
+    """
+    書き込み途中の動画を先頭から読める状態かどうかを判定する
+
+    MP4・MOV（ISO BMFF）は、インデックス（moov ボックス）が mdat より前にあり、
+    かつ最後まで届いている場合だけ読める。インデックスが末尾にある場合は
+    書き込みが完了するまで読めないため False を返す。MKV・AVIなどの
+    その他の形式は、データが届いていれば True を返す。
+
+    Args:
+        video_path (str): 書き込み中の動画ファイルのパス
+
+    Returns:
+        bool: 届いた分からフレームを読めるかどうか
+    """
+    if not os.path.exists(video_path):
+        return False
+    size = os.path.getsize(video_path)
+    with open(video_path, "rb") as f:
+        header = f.read(8)
+        if len(header) < 8:
+            return False
+        if header[4:8] != b"ftyp":
+            return True
+
+        # トップレベルのボックスを順にたどる
+        offset = 0
+        while offset + 8 <= size:
+            f.seek(offset)
+            header = f.read(16)
+            box_size = int.from_bytes(header[:4], "big")
+            box_type = header[4:8]
+            if box_size == 1:
+                if len(header) < 16:
+                    return False
+                box_size = int.from_bytes(header[8:16], "big")
+            elif box_size == 0:
+                box_size = size - offset  # ファイル末尾まで
+            if box_type == b"moov":
+                return offset + box_size <= size
+            if box_type == b"mdat" or box_size < 8:
+                return False
+            offset += box_size
+    return False
+
+
+def _write_new_frames(cv2, video_path, output_dir, start, complete, quality, frame_callback):
+    """
+    動画を先頭から読み、start 番目以降のフレームを書き出す
+
+    Returns:
+        int: 書き出し済みのフレーム数
+    """
+    cap = cv2.VideoCapture(video_path)
+    if not cap.isOpened():
+        return start
+    if start == 0 or complete:
+        write_video_info(output_dir, cap.get(cv2.CAP_PROP_FPS),
+                         int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)), int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)))
+
+    frame_count = start
+    pending = None  # 読めたが、まだ書き出していないフレーム
+    try:
+        # 書き出し済みのフレームはデコード後の画素を取り出さずに読み飛ばす
+        for _ in range(start):
+            if not cap.grab():
+                return start
+
+        while True:
+            ret, frame = cap.read()
+            if not ret:
+                break
+            if pending is not None:
+                frame_count = _write_frame(cv2, output_dir, frame_count, pending, quality, frame_callback)
+            pending = frame
+
+        if pending is not None and complete:
+            frame_count = _write_frame(cv2, output_dir, frame_count, pending, quality, frame_callback)
+    finally:
+        cap.release()
+    return frame_count
+
+
+def _write_frame(cv2, output_dir, index, frame, quality, frame_callback):
+    """1フレームを書き出し、書き出し済みのフレーム数を返す"""
+    filepath = os.path.join(output_dir, f"{index:05d}.jpg")
+    cv2.imwrite(filepath, frame, [cv2.IMWRITE_JPEG_QUALITY, quality])
+    if frame_callback is not None:
+        frame_callback(index + 1)
+    return index + 1
+
+
+def write_video_info(output_dir, fps, width, height):
+    """
+    元動画の情報をフレームと同じディレクトリに保存する
+
+    Args:
+        output_dir (str): フレームの出力ディレクトリ
+        fps (float): フレームレート（取得できなかった場合は0）
+        width (int): 幅
+        height (int): 高さ
+    """
+    info = {"fps": float(fps) if fps and fps > 0 else None, "width": width, "height": height}
+    with open(os.path.join(output_dir, VIDEO_INFO_FILENAME), "w", encoding="utf-8") as f:
+        json.dump(info, f)
+
+
+def read_video_fps(frames_dir, default=DEFAULT_FPS):
+    """
+    フレーム分割時に保存した元動画のフレームレートを取得する
+
+    Args:
+        frames_dir (str): フレームディレクトリ
+        default (float): 記録がない場合（画像から作ったフレームなど）の値
+
+    Returns:
+        float: フレームレート
+    """
+    try:
+        with open(os.path.join(frames_dir, VIDEO_INFO_FILENAME), encoding="utf-8") as f:
+            fps = json.load(f).get("fps")
+    except (OSError, ValueError):
+        return default
+    return fps or default
+
+
 def main():
     parser = argparse.ArgumentParser(
         description="動画をJPEGフレームに変換します",
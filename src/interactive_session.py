@@ -0,0 +1,486 @@
+#!/usr/bin/env python3
+"""
+予測器と inference_state を保持し続ける対話的な追跡セッション
+
+通常の追跡ジョブは、座標を修正するたびにモデルの読み込み・全フレームの読み込み
+（init_state）・全座標の追加をやり直す。InteractiveSession は1つのWebセッション専用の
+ワーカープロセスに SAM2VideoTracker を保持し、クリックの追加（マスクのプレビュー）・
+物体の削除・途中のフレームからの再伝播をその場で実行する。
+InteractiveSessionPool はアイドル時間とメモリ予算に応じて使われていないセッションを破棄する。
+"""
+
+import multiprocessing
+import threading
+import time
+import traceback
+from collections import OrderedDict
+
+# メモリ量の概算に使う値
+# 1フレーム = 3 x 1024 x 1024 の float32 画像（init_state で全フレームを保持する）
+FRAME_BYTES = 3 * 1024 * 1024 * 4
+# モデル = チェックポイントのサイズ相当
+MODEL_BYTES = {
+    "tiny": 160 * 1024 ** 2,
+    "small": 190 * 1024 ** 2,
+    "base_plus": 330 * 1024 ** 2,
+    "large": 900 * 1024 ** 2,
+}
+
+
+class InteractiveSessionError(RuntimeError):
+    """ワーカーでのコマンド実行に失敗した場合の例外"""
+
+
+class SessionBusyError(InteractiveSessionError):
+    """別のコマンド（伝播など）を実行中の場合の例外"""
+
+
+class MemoryBudgetError(InteractiveSessionError):
+    """メモリ予算内にセッションを収められない場合の例外"""
+
+
+class SessionLimitError(InteractiveSessionError):
+    """同時に起動できるセッション数の上限に達した場合の例外"""
+
+
+def estimate_session_bytes(num_frames, model_size="tiny"):
+    """
+    セッションが使うメモリ量を起動前に見積もる
+
+    Args:
+        num_frames (int): フレーム数
+        model_size (str): モデルサイズ
+
+    Returns:
+        int: バイト数
+    """
+    return MODEL_BYTES.get(model_size, MODEL_BYTES["large"]) + num_frames * FRAME_BYTES
+
+
+def _encode_frame(frame_idx, frame_masks):
+    """フレームのマスクを {"frame_idx", "objects": [{"id", "rle"}]} に変換する"""
+    from src.sam2_utils import mask_to_rle
+
+    return {
+        "frame_idx": int(frame_idx),
+        "objects": [
+            {"id": int(obj_id), "rle": mask_to_rle(mask)}
+            for obj_id, mask in frame_masks.items()
+        ],
+    }
+
+
+def _session_worker(conn, video_dir, model_size, device):
+    """ワーカープロセス: トラッカーを保持し、届いたコマンドを順に実行する"""
+    from src.sam2_video_tracker import SAM2VideoTracker
+
+    try:
+        tracker = SAM2VideoTracker(model_size=model_size, device=device)
+        frame_names = tracker.initialize_video(video_dir)
+    except Exception as e:
+        traceback.print_exc()
+        conn.send(("error", f"{type(e).__name__}: {e}"))
+        return
+    conn.send(("result", {"frame_names": frame_names, "memory_bytes": tracker.memory_bytes()}))
+
+    def add_points(frame_idx, obj_id, points, labels, clear_old_points=True):
+        out_frame_idx, out_obj_ids, out_mask_logits = tracker.add_object_points(
+            frame_idx, obj_id, points, labels, clear_old_points=clear_old_points
+        )
+        return _encode_frame(out_frame_idx, {
+            out_obj_id: (out_mask_logits[i] > 0.0).cpu().numpy()
+            for i, out_obj_id in enumerate(out_obj_ids)
+        })
+
+    def propagate(start_frame_idx=None, max_frames=None, reverse=False):
+        count = 0
+        for frame_idx, frame_masks in tracker.iter_propagation(start_frame_idx, max_frames, reverse):
+            conn.send(("frame", _encode_frame(frame_idx, frame_masks)))
+            count += 1
+            # 伝播中に届いた停止要求を確認
+            if conn.poll():
+                command = conn.recv()[0]
+                if command == "close":
+                    raise SystemExit(0)
+                if command == "stop":
+                    return {"frames": count, "stopped": True}
+        return {"frames": count, "stopped": False}
+
+    commands = {
+        "add_points": add_points,
+        "remove_object": tracker.remove_object,
+        "reset": tracker.reset,
+        "propagate": propagate,
+    }
+    while True:
+        try:
+            command, args, kwargs = conn.recv()
+        except EOFError:
+            return
+        if command == "close":
+            return
+        if command == "stop":
+            # 伝播が終わった後に届いた停止要求
+            continue
+        try:
+            result = commands[command](*args, **kwargs)
+        except Exception as e:
+            traceback.print_exc()
+            conn.send(("error", f"{type(e).__name__}: {e}"))
+        else:
+            conn.send(("result", result))
+
+
+class InteractiveSession:
+    """1つのWebセッション専用のワーカープロセス"""
+
+    def __init__(self, video_dir, model_size="tiny", device="cpu", estimated_bytes=0, start_method="spawn"):
+        """
+        初期化（ワーカープロセスを起動し、モデルとフレームの読み込みを開始する）
+
+        Args:
+            video_dir (str): JPEGフレームディレクトリ（絶対パス）
+            model_size (str): モデルサイズ
+            device (str): 使用デバイス
+            estimated_bytes (int): 読み込み完了までに使うメモリ量の見積もり
+            start_method (str): multiprocessing の開始方式
+        """
+        context = multiprocessing.get_context(start_method)
+        self._conn, child_conn = context.Pipe()
+        self._process = context.Process(
+            target=_session_worker,
+            args=(child_conn, video_dir, model_size, device),
+            daemon=True,
+        )
+        self._process.start()
+        # 子プロセスが終了したら recv が EOFError になるよう、親側の子の端は閉じる
+        child_conn.close()
+
+        self._lock = threading.Lock()  # コマンドは1つずつ実行する
+        self._send_lock = threading.Lock()
+        self.model_size = model_size
+        self.memory_bytes = estimated_bytes
+        self.frame_names = None
+        self.last_used = time.monotonic()
+        self.closed = False
+
+    @property
+    def busy(self):
+        """コマンドを実行中かどうか"""
+        return self._lock.locked()
+
+    def start(self, timeout=None):
+        """
+        ワーカーでモデルとフレームの読み込みが終わるのを待つ
+
+        Args:
+            timeout (float): 最大待ち時間（秒）
+
+        Returns:
+            dict: frame_names, memory_bytes
+        """
+        with self._lock:
+            info = self._receive(None, timeout)
+        self.frame_names = info["frame_names"]
+        self.memory_bytes = info["memory_bytes"]
+        self.last_used = time.monotonic()
+        return info
+
+    def reserve(self):
+        """
+        次のコマンドのためにセッションを確保する
+
+        別スレッドでコマンドを実行する場合に、受け付けられたかどうかを先に確定させるために使う。
+        確保した後は call(..., reserved=True) で実行し、最後に release() で解放する。
+
+        Raises:
+            SessionBusyError: 別のコマンドを実行中・確保済みの場合
+        """
+        if not self._lock.acquire(blocking=False):
+            raise SessionBusyError("他の処理を実行中です")
+
+    def release(self):
+        """reserve() で確保したセッションを解放する"""
+        self.last_used = time.monotonic()
+        self._lock.release()
+
+    def call(self, command, *args, on_frame=None, timeout=None, reserved=False, **kwargs):
+        """
+        ワーカーでコマンドを実行する
+
+        Args:
+            command (str): "add_points", "remove_object", "reset", "propagate" のいずれか
+            on_frame (callable): 伝播中のフレームごとの結果を受け取る関数
+            timeout (float): 最大待ち時間（秒）
+            reserved (bool): reserve() で確保済みの場合True（解放は呼び出し元が行う）
+
+        Returns:
+            コマンドの戻り値
+
+        Raises:
+            SessionBusyError: 別のコマンドを実行中の場合
+            InteractiveSessionError: ワーカーでエラーが発生した場合
+        """
+        if not reserved:
+            self.reserve()
+        try:
+            self._send((command, args, kwargs))
+            return self._receive(on_frame, timeout)
+        finally:
+            if reserved:
+                self.last_used = time.monotonic()
+            else:
+                self.release()
+
+    def stop(self):
+        """実行中の伝播を現在のフレームで止める"""
+        self._send(("stop", (), {}))
+
+    def close(self):
+        """ワーカープロセスを終了する"""
+        if self.closed:
+            return
+        self.closed = True
+        try:
+            self._send(("close", (), {}))
+        except InteractiveSessionError:
+            pass
+        self._process.join(5)
+        if self._process.is_alive():
+            self._process.terminate()
+            self._process.join(5)
+        if self._process.is_alive():
+            self._process.kill()
+            self._process.join()
+        self._conn.close()
+
+    def _send(self, message):
+        """ワーカーへメッセージを送る"""
+        with self._send_lock:
+            try:
+                self._conn.send(message)
+            except (OSError, ValueError) as e:
+                raise InteractiveSessionError("ワーカープロセスが終了しています") from e
+
+    def _receive(self, on_frame, timeout):
+        """コマンドの結果を受け取るまでワーカーからのメッセージを読む"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            remaining = None if deadline is None else max(deadline - time.monotonic(), 0)
+            try:
+                if not self._conn.poll(remaining):
+                    self.close()
+                    raise InteractiveSessionError("ワーカーの応答がタイムアウトしました")
+                kind, value = self._conn.recv()
+            except (EOFError, OSError) as e:
+                raise InteractiveSessionError(
+                    f"ワーカープロセスが終了しました（終了コード {self._process.exitcode}）"
+                ) from e
+            if kind == "frame":
+                if on_frame is not None:
+                    on_frame(value)
+            elif kind == "result":
+                return value
+            else:
+                raise InteractiveSessionError(value)
+
+
+class InteractiveSessionPool:
+    """対話的なセッションをメモリ予算とアイドル時間に応じて管理するプール"""
+
+    def __init__(self, memory_budget, idle_timeout=600, sweep_interval=30, start_method="spawn",
+                 max_sessions=None):
+        """
+        初期化
+
+        Args:
+            memory_budget (int): 全セッションで使ってよいメモリ量（バイト）
+            idle_timeout (float): この秒数使われなかったセッションを破棄する
+            sweep_interval (float): アイドルなセッションを確認する間隔（秒）
+            start_method (str): multiprocessing の開始方式
+            max_sessions (int): 同時に起動しておくセッション（ワーカープロセス）数の上限（Noneで無制限）
+        """
+        self.memory_budget = memory_budget
+        self.max_sessions = max_sessions
+        self.idle_timeout = idle_timeout
+        self.start_method = start_method
+        self._sessions = OrderedDict()  # 最近使われた順（末尾が最新）
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._sweeper = threading.Thread(
+            target=self._sweep_loop, args=(sweep_interval,), name="InteractiveSessionSweeper", daemon=True
+        )
+        self._sweeper.start()
+
+    def open(self, key, video_dir, model_size="tiny", device="cpu", num_frames=0, timeout=None):
+        """
+        セッションを起動する（同じキーの既存セッションは閉じる）
+
+        メモリ予算・セッション数の上限に収まらない場合は、実行中でないセッションを最後に使われた時刻が
+        古い順に破棄する。
+
+        Args:
+            key (str): セッションのキー（WebのセッションID）
+            video_dir (str): JPEGフレームディレクトリ（絶対パス）
+            model_size (str): モデルサイズ
+            device (str): 使用デバイス
+            num_frames (int): フレーム数（メモリ量の見積もり用）
+            timeout (float): 読み込み完了までの最大待ち時間（秒）
+
+        Returns:
+            InteractiveSession: 読み込みが完了したセッション
+
+        Raises:
+            MemoryBudgetError: 他のセッションを破棄してもメモリ予算に収まらない場合
+            SessionLimitError: 他のセッションがすべて実行中で、セッション数の上限に達している場合
+        """
+        self.close(key)
+        estimated = estimate_session_bytes(num_frames, model_size)
+        with self._lock:
+            evicted = self._make_room(estimated)
+            session = InteractiveSession(video_dir, model_size, device, estimated, self.start_method)
+            self._sessions[key] = session
+        self._close_all(evicted)
+
+        try:
+            session.start(timeout)
+        except Exception:
+            self._discard(key, session)
+            raise
+
+        # 実際の使用量で予算を確認し直す（収まらなくても起動したセッションは残す）
+        with self._lock:
+            evicted = self._make_room(0, exclude=key, strict=False, new_sessions=0)
+        self._close_all(evicted)
+        return session
+
+    def get(self, key):
+        """
+        セッションを取得する
+
+        Args:
+            key (str): セッションのキー
+
+        Returns:
+            InteractiveSession: セッション（破棄済み・未起動の場合はNone）
+        """
+        with self._lock:
+            session = self._sessions.get(key)
+            if session is not None:
+                self._sessions.move_to_end(key)
+                session.last_used = time.monotonic()
+            return session
+
+    def close(self, key):
+        """
+        セッションを閉じる
+
+        Args:
+            key (str): セッションのキー
+
+        Returns:
+            bool: セッションがあった場合True
+        """
+        with self._lock:
+            session = self._sessions.pop(key, None)
+        if session is None:
+            return False
+        session.close()
+        return True
+
+    def evict_idle(self):
+        """
+        idle_timeout 以上使われていないセッションを破棄する
+
+        Returns:
+            list: 破棄したセッションのキー
+        """
+        now = time.monotonic()
+        with self._lock:
+            keys = [
+                key for key, session in self._sessions.items()
+                if not session.busy and now - session.last_used > self.idle_timeout
+            ]
+            evicted = [self._sessions.pop(key) for key in keys]
+        self._close_all(evicted)
+        return keys
+
+    def stats(self):
+        """
+        セッション数とメモリ使用量を取得する
+
+        Returns:
+            dict: sessions, memory_bytes, memory_budget, max_sessions
+        """
+        with self._lock:
+            return {
+                "sessions": len(self._sessions),
+                "memory_bytes": sum(s.memory_bytes for s in self._sessions.values()),
+                "memory_budget": self.memory_budget,
+                "max_sessions": self.max_sessions,
+            }
+
+    def shutdown(self):
+        """すべてのセッションを閉じ、アイドル確認を停止する"""
+        self._stop_event.set()
+        with self._lock:
+            sessions = list(self._sessions.values())
+            self._sessions.clear()
+        self._close_all(sessions)
+        self._sweeper.join()
+
+    def _make_room(self, needed, exclude=None, strict=True, new_sessions=1):
+        """
+        needed バイトと new_sessions 個のセッションが予算・上限に収まるように破棄するセッションを選ぶ
+        （ロック取得済みで呼ぶ）
+
+        Args:
+            needed (int): 追加で必要なバイト数
+            exclude (str): 破棄しないセッションのキー
+            strict (bool): 収まらない場合に例外を送出するかどうか（Falseなら破棄できる分だけ破棄する）
+            new_sessions (int): 追加するセッション数
+
+        Returns:
+            list: プールから取り除いたセッション（呼び出し側がロック外で閉じる）
+        """
+        max_sessions = self.max_sessions if self.max_sessions is not None else float("inf")
+        used = sum(s.memory_bytes for s in self._sessions.values())
+        count = len(self._sessions) + new_sessions
+        victims = []
+        for key, session in self._sessions.items():
+            if used + needed <= self.memory_budget and count <= max_sessions:
+                break
+            if key == exclude or session.busy:
+                continue
+            victims.append(key)
+            used -= session.memory_bytes
+            count -= 1
+        if strict and used + needed > self.memory_budget:
+            raise MemoryBudgetError(
+                f"メモリ予算（{self.memory_budget / 1024 ** 2:.0f}MB）を超えるため"
+                f"セッションを開始できません"
+            )
+        if strict and count > max_sessions:
+            raise SessionLimitError(
+                f"同時に使えるセッション数（{self.max_sessions}）の上限に達しているため"
+                f"セッションを開始できません"
+            )
+        return [self._sessions.pop(key) for key in victims]
+
+    def _discard(self, key, session):
+        """起動に失敗したセッションを取り除く"""
+        with self._lock:
+            if self._sessions.get(key) is session:
+                del self._sessions[key]
+        session.close()
+
+    @staticmethod
+    def _close_all(sessions):
+        """ロック外でセッションを閉じる"""
+        for session in sessions:
+            session.close()
+
+    def _sweep_loop(self, interval):
+        """アイドルなセッションを定期的に破棄する"""
+        while not self._stop_event.wait(interval):
+            self.evict_idle()
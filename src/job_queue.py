@@ -0,0 +1,367 @@
+#!/usr/bin/env python3
+"""
+重い処理（フレーム分割・SAM2追跡）を順番に実行するジョブスケジューラ
+
+リクエストごとにスレッドを立ち上げると、同時アクセス数だけSAM2モデルが
+並列に動いてCPUとメモリを奪い合う。JobScheduler は同時に実行するジョブ数を
+max_workers に制限し、残りを上限付きの優先度付きキュー（同じ優先度ならFIFO）で
+待たせる。各ジョブは専用のワーカープロセスで実行するため、GILの影響を受けず、
+キャンセルやタイムアウト時にはプロセスごと確実に停止できる。
+"""
+
+import heapq
+import itertools
+import multiprocessing
+import queue
+import threading
+import time
+import traceback
+
+# ジョブの状態
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+TIMEOUT = "timeout"
+
+FINISHED_STATES = (DONE, FAILED, CANCELLED, TIMEOUT)
+
+
+class QueueFullError(RuntimeError):
+    """待ちキューが満杯でジョブを受け付けられない場合の例外"""
+
+
+class Job:
+    """スケジューラに投入された1件のジョブ"""
+
+    def __init__(self, func, args, kwargs, priority, timeout, on_start, on_progress, on_finish):
+        """
+        初期化
+
+        Args:
+            func (callable): ワーカープロセスで実行する関数（pickle可能なトップレベル関数）
+            args (tuple): 位置引数
+            kwargs (dict): キーワード引数
+            priority (int): 優先度（小さいほど先に実行）
+            timeout (float): 実行開始からのタイムアウト秒数（Noneで無制限）
+            on_start (callable): 実行開始時に job を引数に呼ばれるコールバック
+            on_progress (callable): ワーカーが progress_callback に渡した値で呼ばれるコールバック
+            on_finish (callable): 終了時（完了・失敗・キャンセル・タイムアウト）に job を引数に呼ばれるコールバック
+        """
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.priority = priority
+        self.timeout = timeout
+        self.on_start = on_start
+        self.on_progress = on_progress
+        self.on_finish = on_finish
+
+        self.state = QUEUED
+        self.result = None
+        self.error = None
+        self.submitted_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+
+        self._seq = None
+        self._process = None
+        self._channel = None
+        self._deadline = None
+        self._finished = threading.Event()
+        # on_start / on_progress を on_finish の後に呼ばないよう、コールバックを排他する
+        self._callback_lock = threading.RLock()
+
+    @property
+    def finished(self):
+        """ジョブが終了しているかどうか"""
+        return self.state in FINISHED_STATES
+
+    def wait(self, timeout=None):
+        """
+        ジョブの終了（コールバック呼び出しを含む）を待つ
+
+        Args:
+            timeout (float): 最大待ち時間（秒）
+
+        Returns:
+            bool: 終了していればTrue
+        """
+        return self._finished.wait(timeout)
+
+
+def _run_job(func, args, kwargs, channel):
+    """ワーカープロセス側でジョブを実行し、進捗と結果を親プロセスへ送る"""
+
+    def progress_callback(*values):
+        channel.put(("progress", values))
+
+    try:
+        result = func(*args, progress_callback=progress_callback, **kwargs)
+    except Exception as e:
+        traceback.print_exc()
+        channel.put(("error", f"{type(e).__name__}: {e}"))
+    else:
+        channel.put(("result", result))
+
+
+class JobScheduler:
+    """同時実行数と待ち行列の長さを制限するジョブスケジューラ"""
+
+    def __init__(self, max_workers=1, max_queue_size=8, default_timeout=None,
+                 poll_interval=0.2, start_method="spawn"):
+        """
+        初期化
+
+        Args:
+            max_workers (int): 同時に実行するワーカープロセス数
+            max_queue_size (int): 実行待ちにできるジョブ数の上限
+            default_timeout (float): submit で timeout を省略した場合のタイムアウト秒数
+            poll_interval (float): 実行中ジョブの進捗・終了を確認する間隔（秒）
+            start_method (str): multiprocessing の開始方式。torch やFlaskのスレッドを
+                引き継がないよう既定は "spawn"
+        """
+        if max_workers < 1:
+            raise ValueError("max_workers は1以上を指定してください")
+        self.max_workers = max_workers
+        self.max_queue_size = max_queue_size
+        self.default_timeout = default_timeout
+        self.poll_interval = poll_interval
+        self._context = multiprocessing.get_context(start_method)
+
+        self._cond = threading.Condition()
+        self._queue = []  # (priority, 投入順, job) のヒープ
+        self._running = []
+        self._counter = itertools.count()
+        self._closed = False
+
+        self._thread = threading.Thread(target=self._dispatch_loop, name="JobScheduler", daemon=True)
+        self._thread.start()
+
+    def submit(self, func, *args, priority=0, timeout=None, on_start=None,
+               on_progress=None, on_finish=None, **kwargs):
+        """
+        ジョブを待ちキューに追加する
+
+        func はワーカープロセスで func(*args, progress_callback=..., **kwargs) として
+        呼ばれる。progress_callback に渡した値はそのまま on_progress に渡される。
+        コールバックはスケジューラのスレッドから呼ばれる。
+
+        Args:
+            func (callable): 実行する関数（pickle可能なトップレベル関数）
+            priority (int): 優先度（小さいほど先に実行、同じなら投入順）
+            timeout (float): 実行開始からのタイムアウト秒数
+
+        Returns:
+            Job: 投入したジョブ
+
+        Raises:
+            QueueFullError: 待ちキューが満杯の場合
+        """
+        if timeout is None:
+            timeout = self.default_timeout
+        job = Job(func, args, kwargs, priority, timeout, on_start, on_progress, on_finish)
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("スケジューラは停止しています")
+            if len(self._queue) >= self.max_queue_size:
+                raise QueueFullError(f"待ちキューが満杯です（{self.max_queue_size}件）")
+            job._seq = next(self._counter)
+            heapq.heappush(self._queue, (priority, job._seq, job))
+            self._cond.notify_all()
+        return job
+
+    def position(self, job):
+        """
+        待ちキュー内の順番を取得する
+
+        Args:
+            job (Job): 対象のジョブ
+
+        Returns:
+            int: 1始まりの順番（実行中・終了済みの場合はNone）
+        """
+        with self._cond:
+            if job.state != QUEUED:
+                return None
+            return 1 + sum(1 for entry in self._queue if entry[:2] < (job.priority, job._seq))
+
+    def cancel(self, job):
+        """
+        ジョブをキャンセルする（実行中ならワーカープロセスを停止する）
+
+        Args:
+            job (Job): 対象のジョブ
+
+        Returns:
+            bool: キャンセルできた場合True（既に終了していた場合False）
+        """
+        with self._cond:
+            if job.state == QUEUED:
+                self._queue = [entry for entry in self._queue if entry[2] is not job]
+                heapq.heapify(self._queue)
+        return self._finish(job, CANCELLED, error="キャンセルされました")
+
+    def stats(self):
+        """
+        待ち・実行中のジョブ数を取得する
+
+        Returns:
+            dict: queued, running, max_workers, max_queue_size
+        """
+        with self._cond:
+            return {
+                "queued": len(self._queue),
+                "running": len(self._running),
+                "max_workers": self.max_workers,
+                "max_queue_size": self.max_queue_size,
+            }
+
+    def shutdown(self, wait=True):
+        """
+        待ちジョブと実行中のジョブをすべてキャンセルし、スケジューラを停止する
+
+        Args:
+            wait (bool): スケジューラのスレッドの終了を待つかどうか
+        """
+        with self._cond:
+            self._closed = True
+            jobs = [entry[2] for entry in self._queue] + list(self._running)
+            self._queue = []
+        for job in jobs:
+            self._finish(job, CANCELLED, error="スケジューラが停止しました")
+        with self._cond:
+            self._cond.notify_all()
+        if wait:
+            self._thread.join()
+
+    def _dispatch_loop(self):
+        """空きワーカーにジョブを割り当て、実行中ジョブの進捗と終了を監視する"""
+        while True:
+            started = []
+            with self._cond:
+                while self._queue and len(self._running) < self.max_workers:
+                    job = heapq.heappop(self._queue)[2]
+                    self._start(job)
+                    started.append(job)
+                running = list(self._running)
+                if self._closed and not running:
+                    return
+
+            for job in started:
+                # ロックを外した直後にキャンセルされた場合は on_start を呼ばない
+                self._call_unless_finished(job, job.on_start, job)
+            for job in running:
+                self._poll(job)
+
+            with self._cond:
+                if not self._running and not self._queue and not self._closed:
+                    self._cond.wait()
+                elif self._running:
+                    self._cond.wait(self.poll_interval)
+
+    def _start(self, job):
+        """ジョブのワーカープロセスを起動する（ロック取得済みで呼ぶ）"""
+        job._channel = self._context.Queue()
+        job._process = self._context.Process(
+            target=_run_job,
+            args=(job.func, job.args, job.kwargs, job._channel),
+            daemon=True,
+        )
+        job._process.start()
+        job.state = RUNNING
+        job.started_at = time.time()
+        if job.timeout is not None:
+            job._deadline = time.monotonic() + job.timeout
+        self._running.append(job)
+
+    def _poll(self, job):
+        """ワーカーからのメッセージを処理し、タイムアウトと異常終了を検出する"""
+        if self._drain(job, block=False) or job.finished:
+            return
+        if job._deadline is not None and time.monotonic() > job._deadline:
+            self._finish(job, TIMEOUT, error=f"タイムアウトしました（{job.timeout:.0f}秒）")
+        elif not job._process.is_alive():
+            # 終了直後は結果がまだパイプに残っている場合がある
+            if not self._drain(job, block=True):
+                self._finish(
+                    job, FAILED,
+                    error=f"ワーカープロセスが異常終了しました（終了コード {job._process.exitcode}）",
+                )
+
+    def _drain(self, job, block):
+        """
+        ワーカーからのメッセージを読み出す
+
+        Returns:
+            bool: 結果（成功・失敗）を受け取ってジョブを終了させた場合True
+        """
+        while not job.finished:
+            try:
+                if block:
+                    kind, value = job._channel.get(timeout=1.0)
+                else:
+                    kind, value = job._channel.get_nowait()
+            except (queue.Empty, EOFError, OSError, ValueError):
+                return False
+            if kind == "progress":
+                self._call_unless_finished(job, job.on_progress, *value)
+            elif kind == "result":
+                self._finish(job, DONE, result=value)
+                return True
+            else:
+                self._finish(job, FAILED, error=value)
+                return True
+        return True
+
+    def _finish(self, job, state, result=None, error=None):
+        """
+        ジョブを終了状態にし、ワーカープロセスを片付けてコールバックを呼ぶ
+
+        Returns:
+            bool: この呼び出しでジョブを終了させた場合True
+        """
+        with self._cond:
+            if job.finished:
+                return False
+            job.state = state
+            job.result = result
+            job.error = error
+            job.finished_at = time.time()
+            if job in self._running:
+                self._running.remove(job)
+            self._cond.notify_all()
+
+        process = job._process
+        if process is not None:
+            if state in (DONE, FAILED):
+                # 結果を送った後のプロセス終了を待つ
+                process.join(5)
+            if process.is_alive():
+                process.terminate()
+            process.join(5)
+            if process.is_alive():
+                process.kill()
+                process.join()
+            job._channel.close()
+        with job._callback_lock:
+            self._call(job.on_finish, job)
+        job._finished.set()
+        return True
+
+    def _call_unless_finished(self, job, callback, *args):
+        """ジョブが終了していなければコールバックを呼ぶ（on_finish と同時・その後には呼ばない）"""
+        with job._callback_lock:
+            if not job.finished:
+                self._call(callback, *args)
+
+    @staticmethod
+    def _call(callback, *args):
+        """コールバックを呼ぶ（例外でスケジューラを止めない）"""
+        if callback is None:
+            return
+        try:
+            callback(*args)
+        except Exception:
+            traceback.print_exc()
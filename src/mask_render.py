@@ -0,0 +1,326 @@
+#!/usr/bin/env python3
+"""
+フレームにマスクと座標点を重ねた結果画像の描画
+
+matplotlib でフレームごとに図を作って savefig すると、追跡そのものより時間がかかる。
+ここでは NumPy で tab10 の色をアルファブレンドし、座標点の星形を cv2 でまとめて塗り、
+cv2 でJPEGにエンコードする。見た目は show_mask / show_points と同じ
+（マスクは不透明度0.6、座標点は白枠付きの緑/赤の星）で、出力は元フレームと同じ解像度になる。
+複数フレームはプロセスプールで並列に描画する。
+VideoResultWriter を使うと、フレームごとの画像の代わりに1本のMP4へ順に書き込める。
+"""
+
+import collections
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+from src.mask_store import MaskStore
+from src.sam2_utils import rle_to_mask
+
+# matplotlib の tab10 カラーマップ（RGB）
+TAB10_COLORS = np.array([
+    (31, 119, 180), (255, 127, 14), (44, 160, 44), (214, 39, 40), (148, 103, 189),
+    (140, 86, 75), (227, 119, 194), (127, 127, 127), (188, 189, 34), (23, 190, 207),
+], dtype=np.float32)
+
+MASK_ALPHA = 0.6
+
+# 結果動画のファイル名と、試す順のコーデック
+# （H.264 はブラウザで再生できるが、OpenCVのビルドによっては使えないため MPEG-4 に切り替える）
+RESULT_VIDEO_FILENAME = "tracked.mp4"
+VIDEO_FOURCCS = ("avc1", "mp4v")
+
+# 座標点の色（BGR）。matplotlib の 'green' / 'red'
+POSITIVE_COLOR = (0, 128, 0)
+NEGATIVE_COLOR = (0, 0, 255)
+EDGE_COLOR = (255, 255, 255)
+
+# 半径1の五芒星の頂点（外側と内側を交互に、上向き）。内径比は matplotlib の '*' と同じ
+_STAR_ANGLES = -np.pi / 2 + np.arange(10) * np.pi / 5
+_STAR_RADII = np.where(np.arange(10) % 2 == 0, 1.0, 0.381966)
+STAR_VERTICES = np.stack([np.cos(_STAR_ANGLES), np.sin(_STAR_ANGLES)], axis=1) * _STAR_RADII[:, None]
+
+
+def mask_color(obj_id):
+    """
+    オブジェクトIDに対応するマスクの色を取得する
+
+    Args:
+        obj_id (int): オブジェクトID（Noneの場合は0として扱う）
+
+    Returns:
+        numpy.ndarray: BGRの色（float32）
+    """
+    # show_mask と同じく、10以上のIDは tab10 の最後の色になる
+    index = min(max(int(obj_id or 0), 0), len(TAB10_COLORS) - 1)
+    return TAB10_COLORS[index][::-1]
+
+
+def blend_masks(image, frame_masks, alpha=MASK_ALPHA):
+    """
+    マスクをオブジェクトごとの色でアルファブレンドする
+
+    Args:
+        image (numpy.ndarray): BGR画像 (H, W, 3)
+        frame_masks (dict): {obj_id: マスク (H, W) または (1, H, W)、またはRLE}。後のオブジェクトほど上に重なる
+        alpha (float): マスクの不透明度
+
+    Returns:
+        numpy.ndarray: マスクを重ねたBGR画像 (uint8)
+    """
+    height, width = image.shape[:2]
+    result = image.astype(np.float32)
+    for obj_id, mask in frame_masks.items():
+        if isinstance(mask, dict):
+            mask = rle_to_mask(mask)
+        mask = np.asarray(mask)
+        mask = mask.reshape(mask.shape[-2:]).astype(bool)
+        if mask.shape != (height, width):
+            mask = cv2.resize(mask.astype(np.uint8), (width, height), interpolation=cv2.INTER_NEAREST).astype(bool)
+        result[mask] = result[mask] * (1 - alpha) + mask_color(obj_id) * alpha
+    return np.clip(np.rint(result), 0, 255).astype(np.uint8)
+
+
+def draw_points(image, coords, labels, radius=None):
+    """
+    座標点を星形で描画する（Positiveは緑、Negativeは赤、白枠付き）
+
+    Args:
+        image (numpy.ndarray): BGR画像（直接書き換える）
+        coords (numpy.ndarray): 座標 (N, 2)
+        labels (numpy.ndarray): ラベル (N,)。1がPositive、0がNegative
+        radius (float, optional): 星の外径（ピクセル）。省略時は画像サイズから決める
+
+    Returns:
+        numpy.ndarray: 描画した画像
+    """
+    coords = np.asarray(coords, dtype=np.float32).reshape(-1, 2)
+    labels = np.asarray(labels).reshape(-1)
+    if radius is None:
+        # 従来の図（幅6インチ・150dpi）での marker_size=200 と同じ、画像の長辺の約1.6%
+        radius = max(6.0, 0.016 * max(image.shape[:2]))
+    thickness = max(1, int(round(radius * 0.09)))
+
+    # 全座標点の星形の頂点をまとめて計算する (N, 10, 2)
+    stars = np.rint(coords[:, None, :] + STAR_VERTICES[None, :, :] * radius).astype(np.int32)
+    for label, color in ((1, POSITIVE_COLOR), (0, NEGATIVE_COLOR)):
+        polygons = list(stars[labels == label])
+        if polygons:
+            cv2.fillPoly(image, polygons, color, lineType=cv2.LINE_AA)
+            cv2.polylines(image, polygons, True, EDGE_COLOR, thickness, lineType=cv2.LINE_AA)
+    return image
+
+
+def render_frame_with_mask(image, frame_masks, points=None, labels=None, alpha=MASK_ALPHA):
+    """
+    フレームにマスクと座標点を重ねた画像を作成する
+
+    Args:
+        image (numpy.ndarray): BGR画像
+        frame_masks (dict): {obj_id: マスク}（Noneまたは空の場合はマスクなし）
+        points (numpy.ndarray, optional): 表示する座標点
+        labels (numpy.ndarray, optional): 座標点のラベル
+        alpha (float): マスクの不透明度
+
+    Returns:
+        numpy.ndarray: BGR画像
+    """
+    result = blend_masks(image, frame_masks or {}, alpha)
+    if points is not None and labels is not None and len(points):
+        draw_points(result, points, labels)
+    return result
+
+
+def save_frame(image_path, output_path, frame_masks, points=None, labels=None, quality=95):
+    """
+    フレームを読み込み、マスクと座標点を重ねてJPEGで保存する
+
+    Args:
+        image_path (str): 元のフレーム画像
+        output_path (str): 出力先
+        frame_masks (dict): {obj_id: マスク}
+        points (numpy.ndarray, optional): 表示する座標点
+        labels (numpy.ndarray, optional): 座標点のラベル
+        quality (int): JPEG品質
+
+    Returns:
+        str: 出力先
+    """
+    image = cv2.imread(image_path)
+    if image is None:
+        raise IOError(f"フレームを読み込めません: {image_path}")
+    result = render_frame_with_mask(image, frame_masks, points, labels)
+    if not cv2.imwrite(output_path, result, [cv2.IMWRITE_JPEG_QUALITY, quality]):
+        raise IOError(f"結果画像を保存できません: {output_path}")
+    return output_path
+
+
+def _init_worker():
+    """プロセスごとに並列化するため、cv2内部のスレッドは使わない"""
+    cv2.setNumThreads(1)
+
+
+def _create_executor(num_workers):
+    """並列描画に使うプールを作成する"""
+    if multiprocessing.current_process().daemon:
+        # Webのジョブワーカーなどのデーモンプロセスは子プロセスを作れないため、
+        # スレッドで並列化する（cv2とNumPyの処理中はGILが解放される）
+        return ThreadPoolExecutor(num_workers)
+    return ProcessPoolExecutor(num_workers, mp_context=multiprocessing.get_context("spawn"),
+                               initializer=_init_worker)
+
+
+def save_frames_with_masks(video_dir, frame_names, video_segments, output_dir,
+                           points_by_frame=None, num_workers=None, quality=95):
+    """
+    全フレームにマスクを重ねた画像を保存する（フレームを並列に描画する）
+
+    Args:
+        video_dir (str): 元のフレームディレクトリ
+        frame_names (list): フレームファイル名のリスト
+        video_segments (MaskStore or dict): {frame_idx: {obj_id: マスク}}
+            （MaskStore の場合はRLEのままワーカーに送り、ワーカーで復元する）
+        output_dir (str): 出力ディレクトリ
+        points_by_frame (dict, optional): {frame_idx: (座標点, ラベル)}。表示する座標点
+        num_workers (int, optional): 並列数（省略時はCPUコア数、1なら並列化しない）
+        quality (int): JPEG品質
+
+    Yields:
+        int: 保存が終わったフレームのインデックス（フレーム順）
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    points_by_frame = points_by_frame or {}
+    num_workers = num_workers or os.cpu_count() or 1
+
+    def task(frame_idx):
+        points, labels = points_by_frame.get(frame_idx, (None, None))
+        if isinstance(video_segments, MaskStore):
+            frame_masks = video_segments.encoded_frame(frame_idx)
+        else:
+            frame_masks = video_segments.get(frame_idx)
+        return (
+            os.path.join(video_dir, frame_names[frame_idx]),
+            os.path.join(output_dir, os.path.basename(frame_names[frame_idx])),
+            frame_masks,
+            points,
+            labels,
+            quality,
+        )
+
+    if num_workers <= 1 or len(frame_names) <= 1:
+        for frame_idx in range(len(frame_names)):
+            save_frame(*task(frame_idx))
+            yield frame_idx
+        return
+
+    # マスクをまとめて送るとメモリを使うため、送信中のフレーム数を並列数の数倍までに抑える
+    with _create_executor(num_workers) as executor:
+        pending = collections.deque()
+        for frame_idx in range(len(frame_names)):
+            pending.append((frame_idx, executor.submit(save_frame, *task(frame_idx))))
+            if len(pending) >= num_workers * 4:
+                done_idx, future = pending.popleft()
+                future.result()
+                yield done_idx
+        while pending:
+            done_idx, future = pending.popleft()
+            future.result()
+            yield done_idx
+
+
+class VideoResultWriter:
+    """
+    マスクを重ねたフレームをMP4に順に書き込む
+
+    追跡の伝播でフレームの結果が得られるたびに write を呼ぶと、その場で描画して書き込む。
+    結果のないフレーム（追跡開始前のフレームなど）は元画像のまま書き込むため、
+    動画の長さとタイミングは元動画と同じになる。
+    """
+
+    def __init__(self, output_path, video_dir, frame_names, fps, points_by_frame=None):
+        """
+        初期化（最初のフレームの大きさで動画ファイルを作成する）
+
+        Args:
+            output_path (str): 出力する動画ファイルのパス
+            video_dir (str): 元のフレームディレクトリ
+            frame_names (list): フレームファイル名のリスト
+            fps (float): フレームレート
+            points_by_frame (dict, optional): {frame_idx: (座標点, ラベル)}。表示する座標点
+        """
+        self.output_path = output_path
+        self.video_dir = video_dir
+        self.frame_names = frame_names
+        self.points_by_frame = points_by_frame or {}
+        self.frames_written = 0
+
+        first = self._read_frame(0)
+        self.size = (first.shape[1], first.shape[0])
+        os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
+        for fourcc in VIDEO_FOURCCS:
+            self._writer = cv2.VideoWriter(output_path, cv2.VideoWriter_fourcc(*fourcc), fps, self.size)
+            if self._writer.isOpened():
+                self.fourcc = fourcc
+                break
+        else:
+            raise IOError(f"動画ファイルを作成できません: {output_path}")
+
+    def write(self, frame_idx, frame_masks):
+        """
+        フレームの結果を描画して書き込む（フレーム順に呼ぶ）
+
+        Args:
+            frame_idx (int): フレームインデックス
+            frame_masks (dict): {obj_id: マスク}
+
+        Raises:
+            ValueError: 書き込み済みのフレームが渡された場合
+        """
+        if frame_idx < self.frames_written:
+            raise ValueError(f"フレーム {frame_idx} は書き込み済みです（フレーム順に渡してください）")
+        while self.frames_written < frame_idx:
+            self._write_frame(self.frames_written, None)
+        self._write_frame(frame_idx, frame_masks)
+
+    def close(self):
+        """残りのフレームを元画像のまま書き込み、動画ファイルを閉じる"""
+        if self._writer is None:
+            return
+        while self.frames_written < len(self.frame_names):
+            self._write_frame(self.frames_written, None)
+        self._writer.release()
+        self._writer = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        elif self._writer is not None:
+            # 失敗した場合は途中までの動画を残さない
+            self._writer.release()
+            self._writer = None
+            if os.path.exists(self.output_path):
+                os.remove(self.output_path)
+
+    def _read_frame(self, frame_idx):
+        """元のフレームを読み込む"""
+        image_path = os.path.join(self.video_dir, self.frame_names[frame_idx])
+        image = cv2.imread(image_path)
+        if image is None:
+            raise IOError(f"フレームを読み込めません: {image_path}")
+        return image
+
+    def _write_frame(self, frame_idx, frame_masks):
+        """1フレームを描画して書き込む"""
+        image = self._read_frame(frame_idx)
+        if (image.shape[1], image.shape[0]) != self.size:
+            image = cv2.resize(image, self.size)
+        points, labels = self.points_by_frame.get(frame_idx, (None, None))
+        self._writer.write(render_frame_with_mask(image, frame_masks, points, labels))
+        self.frames_written = frame_idx + 1
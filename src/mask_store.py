@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+"""
+追跡結果のマスクをRLEで保持するストア
+
+propagate_in_video の結果をフレーム・オブジェクトごとの bool 配列で持つと、
+1080p・5000フレーム・5オブジェクトで約50GBになる。MaskStore はマスクを
+非圧縮RLE（mask_to_rle と同じ列優先の連続数）に変換して保持する。物体のマスクは
+列ごとに数回しか0/1が切り替わらないため、1枚あたり数KB〜数十KBで済む。
+path を指定するとRLEをファイルに追記し、メモリにはインデックスだけを持つ
+（読み出しはメモリマップで行う）。
+
+フレームインデックスから {obj_id: マスク} への読み取り専用の辞書として使えるため、
+従来の video_segments を受け取っていた関数にそのまま渡せる（マスクはアクセス時に復元する）。
+"""
+
+import os
+import tempfile
+from collections.abc import Mapping
+
+import numpy as np
+
+from src.sam2_utils import mask_to_rle_counts, rle_to_mask
+
+
+class MaskStore(Mapping):
+    """フレーム・オブジェクトごとの二値マスクをRLEで保持するストア"""
+
+    def __init__(self, path=None, memmap=False):
+        """
+        初期化
+
+        Args:
+            path (str, optional): RLEを書き込むファイル。指定するとメモリマップで読み出す
+            memmap (bool): path を省略した場合も一時ファイルに書き込む（close で削除する）
+        """
+        if path is None and memmap:
+            fd, path = tempfile.mkstemp(prefix="sam2_masks_", suffix=".rle")
+            os.close(fd)
+            self._owns_file = True
+        else:
+            self._owns_file = False
+        self.path = path
+        self.shape = None  # 全マスク共通の (H, W)
+        self.nbytes = 0  # 保持しているRLEのバイト数
+
+        # {frame_idx: {obj_id: 連続数の配列、またはファイル上の (開始位置, 個数)}}
+        self._frames = {}
+        self._file = open(path, "wb") if path is not None else None
+        self._map = None
+        self._length = 0  # ファイルに書き込んだ連続数の個数
+
+    # 追加
+    def add(self, frame_idx, obj_id, mask):
+        """
+        マスクを追加する（同じフレーム・オブジェクトは上書き）
+
+        Args:
+            frame_idx (int): フレームインデックス
+            obj_id (int): オブジェクトID
+            mask (numpy.ndarray): (H, W) または (1, H, W) の二値マスク
+
+        Raises:
+            ValueError: 既存のマスクと大きさが異なる場合
+        """
+        shape, counts = mask_to_rle_counts(mask)
+        if self.shape is None:
+            self.shape = shape
+        elif shape != self.shape:
+            raise ValueError(f"マスクの大きさが異なります: {shape}（{self.shape} を想定）")
+
+        if self._file is not None:
+            self._file.write(counts.tobytes())
+            entry = (self._length, len(counts))
+            self._length += len(counts)
+        else:
+            entry = counts
+        self._frames.setdefault(int(frame_idx), {})[int(obj_id)] = entry
+        self.nbytes += counts.nbytes
+
+    def add_frame(self, frame_idx, frame_masks):
+        """
+        1フレーム分のマスクを追加する
+
+        Args:
+            frame_idx (int): フレームインデックス
+            frame_masks (dict): {obj_id: マスク}
+        """
+        for obj_id, mask in frame_masks.items():
+            self.add(frame_idx, obj_id, mask)
+
+    @classmethod
+    def from_segments(cls, video_segments, **kwargs):
+        """
+        {frame_idx: {obj_id: マスク}} の辞書からストアを作成する
+
+        Args:
+            video_segments (dict): フレーム毎のセグメンテーション結果
+            **kwargs: MaskStore の引数
+
+        Returns:
+            MaskStore: 作成したストア
+        """
+        store = cls(**kwargs)
+        for frame_idx, frame_masks in video_segments.items():
+            store.add_frame(frame_idx, frame_masks)
+        return store
+
+    # 読み出し
+    def obj_ids(self, frame_idx):
+        """フレームに結果があるオブジェクトIDのリスト"""
+        return list(self._frames.get(frame_idx, {}))
+
+    def counts(self, frame_idx, obj_id):
+        """
+        マスクのRLEの連続数（0の連続から交互）を取得する
+
+        Returns:
+            numpy.ndarray: 連続数の配列 (uint32)
+
+        Raises:
+            KeyError: フレーム・オブジェクトの結果がない場合
+        """
+        entry = self._frames[frame_idx][obj_id]
+        if self._file is None:
+            return entry
+        start, length = entry
+        if self._map is None or len(self._map) < start + length:
+            # 追記した分が見えるよう、ファイルに書き出してからマップし直す
+            self._file.flush()
+            self._map = np.memmap(self.path, dtype=np.uint32, mode="r", shape=(self._length,))
+        return self._map[start:start + length]
+
+    def rle(self, frame_idx, obj_id):
+        """
+        マスクを非圧縮RLE（mask_to_rle と同じ形式）で取得する
+
+        Returns:
+            dict: {"size": [H, W], "counts": [連続数, ...]}
+        """
+        return {"size": list(self.shape), "counts": self.counts(frame_idx, obj_id).tolist()}
+
+    def mask(self, frame_idx, obj_id):
+        """
+        マスクを復元する
+
+        Returns:
+            numpy.ndarray: (H, W) の二値マスク
+        """
+        mask = rle_to_mask({"size": self.shape, "counts": self.counts(frame_idx, obj_id)})
+        return np.ascontiguousarray(mask)
+
+    def encoded_frame(self, frame_idx):
+        """
+        1フレーム分のマスクをRLEのまま取得する（ワーカープロセスに送る時など）
+
+        Returns:
+            dict: {obj_id: {"size": [H, W], "counts": 連続数の配列}}。結果がなければ空
+        """
+        return {
+            obj_id: {"size": list(self.shape), "counts": np.array(self.counts(frame_idx, obj_id))}
+            for obj_id in self._frames.get(frame_idx, {})
+        }
+
+    def area(self, frame_idx, obj_id):
+        """
+        マスクの画素数を求める（マスクを復元せず、1の連続数を合計する）
+
+        Returns:
+            int: マスクの画素数
+        """
+        return int(self.counts(frame_idx, obj_id)[1::2].sum(dtype=np.int64))
+
+    # 読み取り専用の辞書 {frame_idx: {obj_id: マスク}} としての操作
+    def __getitem__(self, frame_idx):
+        if frame_idx not in self._frames:
+            raise KeyError(frame_idx)
+        return {obj_id: self.mask(frame_idx, obj_id) for obj_id in self._frames[frame_idx]}
+
+    def __iter__(self):
+        return iter(self._frames)
+
+    def __len__(self):
+        return len(self._frames)
+
+    def __contains__(self, frame_idx):
+        return frame_idx in self._frames
+
+    # 後始末
+    def close(self):
+        """ファイルを閉じる（一時ファイルの場合は削除する）"""
+        self._map = None
+        if self._file is not None:
+            self._file.close()
+        if self._owns_file and os.path.exists(self.path):
+            os.remove(self.path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -4,25 +4,154 @@ SAM2ユーティリティ関数
 """
 
 import os
+import importlib.util
+import threading
 import numpy as np
-import matplotlib.pyplot as plt
-from PIL import Image
-import torch
 import sys
 
-# SAM2パッケージのパスを追加
+# matplotlib / PIL / torch / SAM2本体（hydra, omegaconf, modeling一式）は
+# import に数秒かかるため、実際に使う関数の中で遅延インポートする。
+# `app.py frames` のようにモデルを使わないコマンドではこれらを読み込まない。
+
+# 同梱のSAM2パッケージ（`sam2` としてインポートする）
 current_dir = os.path.dirname(os.path.abspath(__file__))
 sam2_package_path = os.path.join(os.path.dirname(current_dir), "sam2_package")
-sys.path.insert(0, sam2_package_path)
 
-try:
-    from build_sam import build_sam2_video_predictor
-except ImportError as e:
-    print(f"SAM2のインポートに失敗しました: {e}")
-    print(f"SAM2パッケージパス: {sam2_package_path}")
-    # エラーを無視して継続（テスト時など）
-    def build_sam2_video_predictor(*args, **kwargs):
-        raise RuntimeError("SAM2モデルが利用できません。sam2_packageをセットアップしてください。")
+_sam2_import_lock = threading.Lock()
+# Hydraの compose はグローバルな設定ローダーを使うため、モデル構築だけは排他する
+_build_lock = threading.Lock()
+
+
+def _import_sam2_package():
+    """
+    同梱の sam2_package を `sam2` パッケージとして読み込む
+
+    sam2_package 内のモジュールは互いを `sam2.*` としてインポートし、設定ファイルも
+    Hydraの設定モジュール（pkg://sam2）から探すため、作業ディレクトリや sys.path に
+    頼らず sys.modules に直接登録する。既に本物の `sam2`（pipでインストールした
+    公式版など）が読み込まれていればそれを使う。
+
+    Returns:
+        module: sam2 パッケージ
+    """
+    with _sam2_import_lock:
+        module = sys.modules.get("sam2")
+        # プロジェクト直下の空の sam2/ は名前空間パッケージになるため置き換える
+        if module is not None and getattr(module, "__file__", None):
+            return module
+        spec = importlib.util.spec_from_file_location(
+            "sam2",
+            os.path.join(sam2_package_path, "__init__.py"),
+            submodule_search_locations=[sam2_package_path],
+        )
+        module = importlib.util.module_from_spec(spec)
+        sys.modules["sam2"] = module
+        try:
+            spec.loader.exec_module(module)
+        except Exception:
+            del sys.modules["sam2"]
+            raise
+        return module
+
+
+def resolve_model_config(model_cfg):
+    """
+    モデル設定ファイルをHydraの設定名に変換する
+
+    SAM2はHydraの設定モジュール（pkg://sam2）から設定を探すため、設定は
+    "configs/sam2.1/sam2.1_hiera_t.yaml" のようなパッケージ内の名前で指定する。
+    プロジェクトの configs/ 以下の絶対パスが渡された場合も同じ名前に変換するので、
+    作業ディレクトリに依存しない。
+
+    Args:
+        model_cfg (str): 設定名、または configs/ 以下の設定ファイルのパス
+
+    Returns:
+        str: Hydraの設定名
+    """
+    parts = os.path.normpath(model_cfg).split(os.sep)
+    if os.path.isabs(model_cfg) and "configs" in parts:
+        # 最後の configs/ 以降をパッケージ内の名前とする
+        start = len(parts) - 1 - parts[::-1].index("configs")
+        parts = parts[start:]
+    config_name = "/".join(parts)
+    if not os.path.isfile(os.path.join(sam2_package_path, *parts)):
+        raise FileNotFoundError(f"SAM2の設定ファイルが見つかりません: {model_cfg}")
+    return config_name
+
+
+def _import_build_sam2_video_predictor():
+    """
+    SAM2のビルド関数を初めて必要になった時点でインポートする
+
+    Returns:
+        callable: build_sam2_video_predictor
+    """
+    try:
+        _import_sam2_package()
+        from sam2.build_sam import build_sam2_video_predictor
+    except ImportError as e:
+        print(f"SAM2のインポートに失敗しました: {e}")
+        print(f"SAM2パッケージパス: {sam2_package_path}")
+        raise RuntimeError("SAM2モデルが利用できません。sam2_packageをセットアップしてください。") from e
+    return build_sam2_video_predictor
+
+
+def mask_to_rle_counts(mask):
+    """
+    二値マスクの非圧縮RLEの連続数を配列で求める（mask_to_rle の counts と同じ値）
+
+    Args:
+        mask (numpy.ndarray): (H, W) または (1, H, W) の二値マスク
+
+    Returns:
+        tuple: ((H, W), 連続数の配列 (uint32))
+    """
+    mask = np.asarray(mask, dtype=bool)
+    h, w = mask.shape[-2:]
+    flat = mask.reshape(h, w).T.ravel()
+    if flat.size == 0:
+        return (int(h), int(w)), np.zeros(1, dtype=np.uint32)
+    change_indices = np.flatnonzero(flat[1:] != flat[:-1]) + 1
+    boundaries = np.concatenate([[0], change_indices, [flat.size]])
+    counts = np.diff(boundaries).astype(np.uint32)
+    if flat[0]:
+        counts = np.concatenate([np.zeros(1, dtype=np.uint32), counts])
+    return (int(h), int(w)), counts
+
+
+def mask_to_rle(mask):
+    """
+    二値マスクを非圧縮RLE（COCO形式）に変換する
+
+    列優先（Fortran順）で並べた画素の連続数を、0の連続から交互に並べる。
+    pycocotools の非圧縮RLEや sam2.utils.amg の RLE と同じ形式。
+
+    Args:
+        mask (numpy.ndarray): (H, W) または (1, H, W) の二値マスク
+
+    Returns:
+        dict: {"size": [H, W], "counts": [連続数, ...]}
+    """
+    (h, w), counts = mask_to_rle_counts(mask)
+    return {"size": [h, w], "counts": counts.tolist()}
+
+
+def rle_to_mask(rle):
+    """
+    非圧縮RLE（COCO形式）を二値マスクに戻す（mask_to_rle の逆変換）
+
+    Args:
+        rle (dict): {"size": [H, W], "counts": [連続数, ...]}
+
+    Returns:
+        numpy.ndarray: (H, W) の二値マスク
+    """
+    h, w = rle["size"]
+    counts = np.asarray(rle["counts"], dtype=np.int64)
+    values = np.arange(len(counts)) % 2 == 1
+    flat = np.repeat(values, counts)
+    return flat.reshape(w, h).T
 
 
 def show_mask(mask, ax, obj_id=None, random_color=False):
@@ -35,6 +164,8 @@ def show_mask(mask, ax, obj_id=None, random_color=False):
         obj_id (int): オブジェクトID
         random_color (bool): マスクの色をランダムにするかどうか
     """
+    import matplotlib.pyplot as plt
+
     if random_color:
         color = np.concatenate([np.random.random(3), np.array([0.6])], axis=0)
     else:
@@ -73,6 +204,8 @@ def show_box(box, ax):
         box (numpy.ndarray): 矩形の座標情報（x_min, y_min, x_max, y_max）
         ax (matplotlib.axes._axes.Axes): matplotlibのAxis
     """
+    import matplotlib.pyplot as plt
+
     x0, y0 = box[0], box[1]
     w, h = box[2] - box[0], box[3] - box[1]
     ax.add_patch(plt.Rectangle((x0, y0), w, h, edgecolor='green', 
@@ -102,15 +235,20 @@ def load_sam2_predictor(model_cfg, sam2_checkpoint, device="cpu"):
     SAM2予測器を読み込む
     
     Args:
-        model_cfg (str): モデル設定ファイルパス
+        model_cfg (str): モデル設定名または設定ファイルパス（resolve_model_config 参照）
         sam2_checkpoint (str): チェックポイントファイルパス
         device (str): 使用するデバイス ("cpu" または "cuda")
     
     Returns:
         SAM2VideoPredictor: SAM2予測器インスタンス
     """
+    import torch
+
+    build_sam2_video_predictor = _import_build_sam2_video_predictor()
+    config_name = resolve_model_config(model_cfg)
     device = torch.device(device)
-    predictor = build_sam2_video_predictor(model_cfg, sam2_checkpoint, device=device)
+    with _build_lock:
+        predictor = build_sam2_video_predictor(config_name, sam2_checkpoint, device=device)
     return predictor
 
 
@@ -128,6 +266,9 @@ def display_frame_with_points(video_dir, frame_names, frame_idx, points=None, la
     Returns:
         PIL.Image: 読み込まれた画像
     """
+    import matplotlib.pyplot as plt
+    from PIL import Image
+
     image_path = os.path.join(video_dir, frame_names[frame_idx])
     image = Image.open(image_path)
     
@@ -146,8 +287,11 @@ def display_frame_with_points(video_dir, frame_names, frame_idx, points=None, la
 def save_frame_with_mask(video_dir, frame_names, frame_idx, video_segments, 
                         output_dir, show_points_coords=None, show_points_labels=None):
     """
-    フレームとマスクを重ねた画像を保存する
-    
+    フレームとマスクを重ねた画像を保存する（元フレームと同じ解像度のJPEG）
+
+    描画は src.mask_render で行う。複数フレームをまとめて保存する場合は
+    並列に描画する src.mask_render.save_frames_with_masks を使う。
+
     Args:
         video_dir (str): 元のフレームディレクトリ
         frame_names (list): フレームファイル名のリスト
@@ -157,30 +301,14 @@ def save_frame_with_mask(video_dir, frame_names, frame_idx, video_segments,
         show_points_coords (numpy.ndarray, optional): 表示する座標点
         show_points_labels (numpy.ndarray, optional): 座標点のラベル
     """
-    import cv2
-    
-    plt.figure(figsize=(6, 4))
-    plt.title(f"frame {frame_idx}")
-    plt.axis('off')
-    plt.tight_layout(pad=0)
-
-    # cv2はデフォルトがBGRのため、RGBに変換してから出力する
-    image_path = os.path.join(video_dir, frame_names[frame_idx])
-    image = cv2.imread(image_path)
-    plt.imshow(cv2.cvtColor(image, cv2.COLOR_BGR2RGB))
-
-    # 座標点の表示
-    if show_points_coords is not None and show_points_labels is not None:
-        show_points(show_points_coords, show_points_labels, plt.gca())
-
-    # マスクの描画
-    if frame_idx in video_segments:
-        for out_obj_id, out_mask in video_segments[frame_idx].items():
-            show_mask(out_mask, plt.gca(), obj_id=out_obj_id)
+    from src.mask_render import save_frame
 
-    # マスク済みの画像を出力する
     os.makedirs(output_dir, exist_ok=True)
     file_name = os.path.basename(frame_names[frame_idx])
-    output_path = os.path.join(output_dir, file_name)
-    plt.savefig(output_path, bbox_inches='tight', pad_inches=0, dpi=150)
-    plt.close()
\ No newline at end of file
+    save_frame(
+        os.path.join(video_dir, frame_names[frame_idx]),
+        os.path.join(output_dir, file_name),
+        video_segments.get(frame_idx),
+        show_points_coords,
+        show_points_labels,
+    )
\ No newline at end of file
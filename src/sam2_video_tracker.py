@@ -4,11 +4,8 @@ SAM2完全動画追跡アプリケーション - 元記事の完全実装
 """
 
 import os
-import cv2
 import numpy as np
 import torch
-import matplotlib.pyplot as plt
-from PIL import Image
 import datetime
 import sys
 from tqdm import tqdm
@@ -21,9 +18,12 @@ sys.path.insert(0, project_root)
 
 from src.sam2_utils import (
     show_mask, show_points, show_box, get_frame_names, 
-    load_sam2_predictor, save_frame_with_mask
+    load_sam2_predictor
 )
 
+# 結果の出力形式（フレームごとのJPEG / マスクを重ねたMP4）
+OUTPUT_FORMATS = ("images", "video")
+
 
 class SAM2VideoTracker:
     """SAM2動画追跡クラス"""
@@ -58,8 +58,8 @@ class SAM2VideoTracker:
         
         model_cfg, sam2_checkpoint = self.model_configs[self.model_size]
         
-        # 相対パスを絶対パスに変換
-        model_cfg = os.path.join(project_root, model_cfg)
+        # 設定はHydraの設定名のまま渡し（SAM2パッケージ内から解決される）、
+        # チェックポイントは作業ディレクトリに依存しないよう絶対パスに変換
         sam2_checkpoint = os.path.join(project_root, sam2_checkpoint)
         
         if not os.path.exists(sam2_checkpoint):
@@ -96,7 +96,7 @@ class SAM2VideoTracker:
         
         return frame_names
     
-    def add_object_points(self, frame_idx, obj_id, points, labels):
+    def add_object_points(self, frame_idx, obj_id, points, labels, clear_old_points=True):
         """
         座標指定で物体を追加
         
@@ -105,6 +105,8 @@ class SAM2VideoTracker:
             obj_id (int): オブジェクトID
             points (list or np.ndarray): 座標リスト [[x, y], ...]
             labels (list or np.ndarray): ラベルリスト [1 (positive), 0 (negative), ...]
+            clear_old_points (bool): このフレームで以前に追加した座標を破棄するかどうか
+                （Falseなら既存の座標にクリックを追加する）
         
         Returns:
             tuple: (out_frame_idx, out_obj_ids, out_mask_logits)
@@ -124,6 +126,7 @@ class SAM2VideoTracker:
             obj_id=obj_id,
             points=points,
             labels=labels,
+            clear_old_points=clear_old_points,
         )
     
     def add_object_box(self, frame_idx, obj_id, box):
@@ -151,62 +154,164 @@ class SAM2VideoTracker:
             box=box,
         )
     
-    def propagate_in_video(self):
+    def remove_object(self, obj_id):
         """
-        動画全体に追跡を伝播
+        追跡対象から物体を削除
+        
+        Args:
+            obj_id (int): オブジェクトID
         
         Returns:
-            dict: フレーム毎のセグメンテーション結果
+            list: 残っているオブジェクトIDのリスト
         """
-        print("動画全体に追跡を伝播中...")
+        obj_ids, _ = self.predictor.remove_object(self.inference_state, obj_id, need_output=False)
+        return list(obj_ids)
+    
+    def reset(self):
+        """追加した座標と追跡結果を破棄する（読み込んだフレームはそのまま使う）"""
+        self.predictor.reset_state(self.inference_state)
+    
+    def memory_bytes(self):
+        """
+        モデルと読み込んだフレームが使うメモリ量の概算
         
-        video_segments = {}
+        Returns:
+            int: バイト数
+        """
+        total = sum(p.numel() * p.element_size() for p in self.predictor.parameters())
+        images = self.inference_state["images"] if self.inference_state else None
+        if isinstance(images, torch.Tensor):
+            total += images.numel() * images.element_size()
+        return total
+    
+    def iter_propagation(self, start_frame_idx=None, max_frame_num_to_track=None, reverse=False):
+        """
+        追跡を伝播し、フレームごとの結果を順に返す
         
-        # プログレスバー付きで伝播処理
-        propagation_iter = self.predictor.propagate_in_video(self.inference_state)
+        Args:
+            start_frame_idx (int, optional): 伝播を開始するフレーム（省略時は最初の入力フレーム）
+            max_frame_num_to_track (int, optional): 伝播する最大フレーム数
+            reverse (bool): 逆方向に伝播するかどうか
         
-        for out_frame_idx, out_obj_ids, out_mask_logits in tqdm(propagation_iter, 
-                                                               desc="フレーム処理", unit="frame"):
-            video_segments[out_frame_idx] = {
+        Yields:
+            tuple: (frame_idx, {obj_id: mask})
+        """
+        propagation_iter = self.predictor.propagate_in_video(
+            self.inference_state,
+            start_frame_idx=start_frame_idx,
+            max_frame_num_to_track=max_frame_num_to_track,
+            reverse=reverse,
+        )
+        for out_frame_idx, out_obj_ids, out_mask_logits in propagation_iter:
+            yield out_frame_idx, {
                 out_obj_id: (out_mask_logits[i] > 0.0).cpu().numpy()
                 for i, out_obj_id in enumerate(out_obj_ids)
             }
+    
+    def propagate_in_video(self, frame_callback=None, mask_store=None):
+        """
+        動画全体に追跡を伝播
+        
+        結果のマスクはRLEにして MaskStore に保持する（フル解像度の bool 配列は
+        フレームごとに frame_callback に渡すだけで、保持しない）。
+        
+        Args:
+            frame_callback (callable, optional): フレームの結果が得られるたびに
+                frame_callback(frame_idx, {obj_id: mask}) として呼ばれる関数
+            mask_store (MaskStore, optional): 結果を追加するストア
+                （省略時はメモリ上に作成する。長い動画では MaskStore(memmap=True) を渡す）
+        
+        Returns:
+            MaskStore: フレーム毎のセグメンテーション結果（{frame_idx: {obj_id: mask}} として読める）
+        """
+        from src.mask_store import MaskStore
+
+        print("動画全体に追跡を伝播中...")
+        
+        video_segments = mask_store if mask_store is not None else MaskStore()
+        
+        # プログレスバー付きで伝播処理
+        for out_frame_idx, frame_masks in tqdm(self.iter_propagation(),
+                                               desc="フレーム処理", unit="frame"):
+            video_segments.add_frame(out_frame_idx, frame_masks)
+            if frame_callback is not None:
+                frame_callback(out_frame_idx, frame_masks)
         
-        print(f"伝播完了: {len(video_segments)}フレーム処理")
+        print(f"伝播完了: {len(video_segments)}フレーム処理（マスク: {video_segments.nbytes / 1024 / 1024:.1f}MB）")
         return video_segments
     
+    def open_video_writer(self, video_dir, frame_names, output_dir, 
+                          show_initial_points=None, show_initial_labels=None, fps=None):
+        """
+        結果を書き込む動画ファイル（output_dir/tracked.mp4）を開く
+        
+        伝播の frame_callback に writer.write を渡すと、フレームの結果が得られるたびに
+        マスクを重ねて書き込むため、追跡の完了と同時に動画ができあがる。
+        
+        Args:
+            video_dir (str): 元フレームディレクトリ
+            frame_names (list): フレームファイル名リスト
+            output_dir (str): 出力ディレクトリ
+            show_initial_points (np.ndarray, optional): 初期座標点（最初のフレームに表示）
+            show_initial_labels (np.ndarray, optional): 初期座標ラベル
+            fps (float, optional): フレームレート（省略時はフレーム分割時に記録した元動画のFPS）
+        
+        Returns:
+            VideoResultWriter: with文で使う（終了時に残りのフレームを書き込んで閉じる）
+        """
+        from scripts.video_to_frames import read_video_fps
+        from src.mask_render import RESULT_VIDEO_FILENAME, VideoResultWriter
+
+        points_by_frame = {}
+        if show_initial_points is not None and show_initial_labels is not None:
+            points_by_frame[0] = (show_initial_points, show_initial_labels)
+        output_path = os.path.join(output_dir, RESULT_VIDEO_FILENAME)
+        return VideoResultWriter(output_path, video_dir, frame_names,
+                                 fps or read_video_fps(video_dir), points_by_frame)
+    
     def save_results(self, video_dir, frame_names, video_segments, output_dir, 
-                    show_initial_points=None, show_initial_labels=None):
+                    show_initial_points=None, show_initial_labels=None, num_workers=None,
+                    output_format="images"):
         """
         結果を保存
         
         Args:
             video_dir (str): 元フレームディレクトリ
             frame_names (list): フレームファイル名リスト
-            video_segments (dict): セグメンテーション結果
+            video_segments (MaskStore or dict): セグメンテーション結果（フレームごとに復元しながら描画する）
             output_dir (str): 出力ディレクトリ
             show_initial_points (np.ndarray, optional): 初期座標点
             show_initial_labels (np.ndarray, optional): 初期座標ラベル
+            num_workers (int, optional): 並列に描画するプロセス数（省略時はCPUコア数）
+            output_format (str): "images"（フレームごとのJPEG）または "video"（tracked.mp4）
         """
+        from src.mask_render import save_frames_with_masks
+
+        if output_format not in OUTPUT_FORMATS:
+            raise ValueError(f"不明な出力形式です: {output_format}")
+
         print(f"結果保存中: {output_dir}")
         
-        os.makedirs(output_dir, exist_ok=True)
+        if output_format == "video":
+            with self.open_video_writer(video_dir, frame_names, output_dir,
+                                        show_initial_points, show_initial_labels) as writer:
+                for frame_idx in tqdm(sorted(video_segments), desc="結果保存", unit="frame"):
+                    writer.write(frame_idx, video_segments[frame_idx])
+            print(f"保存完了: {writer.output_path}")
+            return
+        
+        # 最初のフレームのみ初期座標を表示
+        points_by_frame = {}
+        if show_initial_points is not None and show_initial_labels is not None:
+            points_by_frame[0] = (show_initial_points, show_initial_labels)
         
         # 全フレームを保存
-        for frame_idx in tqdm(range(len(frame_names)), desc="結果保存", unit="frame"):
-            # 最初のフレームのみ初期座標を表示
-            points_to_show = show_initial_points if frame_idx == 0 else None
-            labels_to_show = show_initial_labels if frame_idx == 0 else None
-            
-            save_frame_with_mask(
-                video_dir=video_dir,
-                frame_names=frame_names,
-                frame_idx=frame_idx,
-                video_segments=video_segments,
-                output_dir=output_dir,
-                show_points_coords=points_to_show,
-                show_points_labels=labels_to_show
-            )
+        saved_frames = save_frames_with_masks(
+            video_dir, frame_names, video_segments, output_dir,
+            points_by_frame=points_by_frame, num_workers=num_workers
+        )
+        for _ in tqdm(saved_frames, total=len(frame_names), desc="結果保存", unit="frame"):
+            pass
         
         print(f"保存完了: {len(frame_names)}フレーム")
     
@@ -215,12 +320,18 @@ class SAM2VideoTracker:
         結果を分析
         
         Args:
-            video_segments (dict): セグメンテーション結果
+            video_segments (MaskStore or dict): セグメンテーション結果
             frame_names (list): フレームファイル名リスト
         
         Returns:
             dict: 分析結果
         """
+        from src.mask_store import MaskStore
+
+        # 面積はRLEから求めるため、マスクを復元しない
+        if not isinstance(video_segments, MaskStore):
+            video_segments = MaskStore.from_segments(video_segments)
+        
         analysis = {
             "total_frames": len(frame_names),
             "processed_frames": len(video_segments),
@@ -228,17 +339,17 @@ class SAM2VideoTracker:
             "mask_coverage": {}
         }
         
-        for frame_idx, segments in video_segments.items():
+        for frame_idx in video_segments:
             analysis["mask_coverage"][frame_idx] = {}
             
-            for obj_id, mask in segments.items():
+            for obj_id in video_segments.obj_ids(frame_idx):
                 if obj_id not in analysis["objects_detected"]:
                     analysis["objects_detected"][obj_id] = 0
                 analysis["objects_detected"][obj_id] += 1
                 
                 # マスクのカバレッジを計算
-                mask_area = np.sum(mask)
-                total_area = mask.shape[0] * mask.shape[1]
+                mask_area = video_segments.area(frame_idx, obj_id)
+                total_area = video_segments.shape[0] * video_segments.shape[1]
                 coverage = mask_area / total_area * 100
                 
                 analysis["mask_coverage"][frame_idx][obj_id] = coverage
@@ -246,7 +357,8 @@ class SAM2VideoTracker:
         return analysis
 
 
-def run_complete_video_tracking(video_dir, output_dir, objects_to_track, model_size="tiny"):
+def run_complete_video_tracking(video_dir, output_dir, objects_to_track, model_size="tiny",
+                                output_format="images"):
     """
     完全な動画追跡を実行
     
@@ -256,6 +368,7 @@ def run_complete_video_tracking(video_dir, output_dir, objects_to_track, model_s
         objects_to_track (list): 追跡対象オブジェクトのリスト
             例: [{"frame": 0, "id": 0, "points": [[539.9, 408.1]], "labels": [1]}]
         model_size (str): モデルサイズ
+        output_format (str): "images"（フレームごとのJPEG）または "video"（伝播しながら tracked.mp4 に書き込む）
     
     Returns:
         dict: 実行結果
@@ -294,18 +407,24 @@ def run_complete_video_tracking(video_dir, output_dir, objects_to_track, model_s
             box = obj_config["box"]
             tracker.add_object_box(frame_idx, obj_id, box)
     
-    # 動画全体に追跡を伝播
-    video_segments = tracker.propagate_in_video()
-    
-    # 結果を保存
-    tracker.save_results(
-        video_dir=video_dir,
-        frame_names=frame_names,
-        video_segments=video_segments,
-        output_dir=output_dir,
-        show_initial_points=initial_points,
-        show_initial_labels=initial_labels
-    )
+    if output_format == "video":
+        # 伝播で得られたフレームから順に動画に書き込む
+        with tracker.open_video_writer(video_dir, frame_names, output_dir,
+                                       initial_points, initial_labels) as writer:
+            video_segments = tracker.propagate_in_video(frame_callback=writer.write)
+    else:
+        # 動画全体に追跡を伝播
+        video_segments = tracker.propagate_in_video()
+        
+        # 結果を保存
+        tracker.save_results(
+            video_dir=video_dir,
+            frame_names=frame_names,
+            video_segments=video_segments,
+            output_dir=output_dir,
+            show_initial_points=initial_points,
+            show_initial_labels=initial_labels
+        )
     
     # 結果を分析
     analysis = tracker.analyze_results(video_segments, frame_names)
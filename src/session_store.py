@@ -0,0 +1,350 @@
+#!/usr/bin/env python3
+"""
+Webセッションと成果物（アップロード動画・フレーム・追跡結果）の管理
+
+セッションは /cleanup を呼ばれない限り残り続け、web_results 以下のファイルも
+増え続ける。SessionStore は最後に使われてから ttl 秒経ったセッションを破棄し、
+成果物の合計サイズが disk_quota を超えたら最近使われていない順に破棄する。
+確認はバックグラウンドのスレッドで定期的に行う。セッションのメタデータは
+<root>/<session_id>/session.json に保存し、再起動後に読み込み直すため、
+再起動してもファイルが管理外に取り残されない。
+"""
+
+import json
+import os
+import shutil
+import threading
+import time
+import traceback
+
+METADATA_FILENAME = "session.json"
+
+
+def path_size(path):
+    """
+    ファイルまたはディレクトリの合計サイズを取得する
+
+    Args:
+        path (str): パス
+
+    Returns:
+        int: バイト数（存在しない場合は0）
+    """
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    total = 0
+    for root, dirs, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+
+def remove_path(path):
+    """ファイルまたはディレクトリを削除する（存在しなければ何もしない）"""
+    if os.path.isdir(path):
+        shutil.rmtree(path, ignore_errors=True)
+    elif os.path.exists(path):
+        os.remove(path)
+
+
+class SessionStore:
+    """
+    TTL・ディスク容量の上限付きでセッションを保持する辞書風のストア
+
+    セッションは session_id 属性と、以下のメソッドを持つオブジェクト:
+        to_metadata(): JSONに保存する辞書を返す
+        artifact_paths(): セッションディレクトリ以外の成果物（アップロード動画など）のパスを返す
+    """
+
+    def __init__(self, root, session_factory, ttl=86400, disk_quota=None, sweep_interval=60,
+                 upload_dir=None, is_active=None, on_evict=None):
+        """
+        初期化（メタデータの読み込みとスレッドの起動は最初に使われた時に行う）
+
+        Args:
+            root (str): セッションディレクトリを置くディレクトリ（web_results）
+            session_factory (callable): メタデータの辞書からセッションを復元する関数
+            ttl (float): 最後に使われてからこの秒数経ったセッションを破棄する
+            disk_quota (int): 成果物の合計サイズの上限（バイト、Noneで無制限）
+            sweep_interval (float): 破棄の確認とメタデータ保存の間隔（秒）
+            upload_dir (str): アップロード動画のディレクトリ（どのセッションにも属さない古いファイルを削除する）
+            is_active (callable): セッションが処理中ならTrueを返す関数（処理中は破棄しない）
+            on_evict (callable): 破棄する直前にセッションを引数に呼ばれる関数（ジョブの停止など）
+        """
+        self.root = root
+        self.session_factory = session_factory
+        self.ttl = ttl
+        self.disk_quota = disk_quota
+        self.sweep_interval = sweep_interval
+        self.upload_dir = upload_dir
+        self.is_active = is_active or (lambda session: False)
+        self.on_evict = on_evict
+
+        self._lock = threading.RLock()
+        self._sessions = {}
+        self._last_access = {}
+        self._sizes = {}
+        self._saved = {}  # 最後に保存したメタデータ（変更があった時だけ書き込む）
+        self._evictions = {"ttl": 0, "quota": 0, "removed": 0, "orphans": 0}
+        self._started = False
+        self._stop_event = threading.Event()
+        self._sweeper = None
+
+    # 辞書としての操作
+    def __contains__(self, session_id):
+        self._ensure_started()
+        with self._lock:
+            return session_id in self._sessions
+
+    def __getitem__(self, session_id):
+        """セッションを取得し、最後に使われた時刻を更新する"""
+        self._ensure_started()
+        with self._lock:
+            session = self._sessions[session_id]
+            self._last_access[session_id] = time.time()
+            return session
+
+    def __setitem__(self, session_id, session):
+        self.add(session)
+
+    def __delitem__(self, session_id):
+        if not self.remove(session_id):
+            raise KeyError(session_id)
+
+    def __len__(self):
+        self._ensure_started()
+        with self._lock:
+            return len(self._sessions)
+
+    def get(self, session_id, default=None):
+        """セッションを取得する（存在しなければ default）"""
+        try:
+            return self[session_id]
+        except KeyError:
+            return default
+
+    def values(self):
+        """全セッションのリスト"""
+        self._ensure_started()
+        with self._lock:
+            return list(self._sessions.values())
+
+    def add(self, session):
+        """
+        セッションを追加し、メタデータを保存する
+
+        Args:
+            session: 追加するセッション
+        """
+        self._ensure_started()
+        with self._lock:
+            self._sessions[session.session_id] = session
+            self._last_access[session.session_id] = time.time()
+        self.save(session)
+
+    def remove(self, session_id, reason="removed"):
+        """
+        セッションを破棄し、成果物を削除する
+
+        Args:
+            session_id (str): セッションID
+            reason (str): 統計に記録する理由（"removed", "ttl", "quota"）
+
+        Returns:
+            bool: セッションがあった場合True
+        """
+        self._ensure_started()
+        with self._lock:
+            session = self._sessions.pop(session_id, None)
+            self._last_access.pop(session_id, None)
+            self._sizes.pop(session_id, None)
+            self._saved.pop(session_id, None)
+            if session is None:
+                return False
+            self._evictions[reason] += 1
+
+        if self.on_evict is not None:
+            try:
+                self.on_evict(session)
+            except Exception:
+                traceback.print_exc()
+        for path in [self.session_dir(session_id)] + list(session.artifact_paths()):
+            try:
+                remove_path(path)
+            except OSError as e:
+                print(f"クリーンアップエラー: {e}")
+        return True
+
+    def session_dir(self, session_id):
+        """セッションの成果物を置くディレクトリ"""
+        return os.path.join(self.root, session_id)
+
+    def save(self, session):
+        """
+        セッションのメタデータを保存する（前回から変わっていなければ何もしない）
+
+        Args:
+            session: 保存するセッション
+        """
+        with self._lock:
+            if session.session_id not in self._sessions:
+                return
+            metadata = dict(session.to_metadata(), last_access=self._last_access.get(session.session_id))
+            text = json.dumps(metadata, ensure_ascii=False, indent=2, default=str)
+            if self._saved.get(session.session_id) == text:
+                return
+            session_dir = self.session_dir(session.session_id)
+            os.makedirs(session_dir, exist_ok=True)
+            # 書き込み途中で落ちても壊れないよう、一時ファイルから置き換える
+            path = os.path.join(session_dir, METADATA_FILENAME)
+            with open(path + ".tmp", "w", encoding="utf-8") as f:
+                f.write(text)
+            os.replace(path + ".tmp", path)
+            self._saved[session.session_id] = text
+
+    # 破棄
+    def sweep(self):
+        """
+        メタデータを保存し、期限切れのセッションと容量超過分のセッションを破棄する
+
+        Returns:
+            list: 破棄したセッションID
+        """
+        self._ensure_started()
+        now = time.time()
+        evicted = []
+
+        with self._lock:
+            sessions = list(self._sessions.values())
+        for session in sessions:
+            self.save(session)
+
+        # 期限切れ
+        with self._lock:
+            expired = [
+                session_id for session_id, session in self._sessions.items()
+                if now - self._last_access[session_id] > self.ttl and not self.is_active(session)
+            ]
+        for session_id in expired:
+            if self.remove(session_id, reason="ttl"):
+                evicted.append(session_id)
+
+        # 容量超過（最近使われていない順）
+        with self._lock:
+            sessions = list(self._sessions.values())
+        sizes = {session.session_id: self._session_size(session) for session in sessions}
+        with self._lock:
+            self._sizes = dict(sizes)
+            used = sum(sizes.values())
+            candidates = sorted(
+                (session_id for session_id in sizes if session_id in self._sessions),
+                key=lambda session_id: self._last_access[session_id],
+            )
+        if self.disk_quota is not None:
+            for session_id in candidates:
+                if used <= self.disk_quota:
+                    break
+                session = self._sessions.get(session_id)
+                if session is None or self.is_active(session):
+                    continue
+                if self.remove(session_id, reason="quota"):
+                    used -= sizes[session_id]
+                    evicted.append(session_id)
+        return evicted
+
+    def stats(self):
+        """
+        セッション数・使用容量・破棄数を取得する
+
+        Returns:
+            dict: sessions, by_status, bytes, disk_quota, ttl, evictions
+        """
+        self._ensure_started()
+        with self._lock:
+            by_status = {}
+            for session in self._sessions.values():
+                status = getattr(session, "status", None)
+                by_status[status] = by_status.get(status, 0) + 1
+            return {
+                "sessions": len(self._sessions),
+                "by_status": by_status,
+                "bytes": sum(self._sizes.values()),
+                "disk_quota": self.disk_quota,
+                "ttl": self.ttl,
+                "evictions": dict(self._evictions),
+            }
+
+    def shutdown(self):
+        """スレッドを停止し、メタデータを保存する"""
+        self._stop_event.set()
+        if self._sweeper is not None:
+            self._sweeper.join()
+        with self._lock:
+            sessions = list(self._sessions.values())
+        for session in sessions:
+            self.save(session)
+
+    def _session_size(self, session):
+        """セッションの成果物の合計サイズ"""
+        paths = [self.session_dir(session.session_id)] + list(session.artifact_paths())
+        return sum(path_size(path) for path in paths)
+
+    # 起動時の処理
+    def _ensure_started(self):
+        """初めて使われた時にメタデータを読み込み、スレッドを起動する"""
+        if self._started:
+            return
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+            self._load()
+            if self.sweep_interval:
+                self._sweeper = threading.Thread(target=self._sweep_loop, name="SessionSweeper", daemon=True)
+                self._sweeper.start()
+
+    def _load(self):
+        """保存されたセッションを読み込み、どのセッションにも属さない古いファイルを削除する（ロック取得済みで呼ぶ）"""
+        os.makedirs(self.root, exist_ok=True)
+        now = time.time()
+        known_paths = set()
+
+        for name in sorted(os.listdir(self.root)):
+            path = os.path.join(self.root, name)
+            metadata_path = os.path.join(path, METADATA_FILENAME)
+            try:
+                with open(metadata_path, encoding="utf-8") as f:
+                    metadata = json.load(f)
+                session = self.session_factory(metadata)
+            except (OSError, ValueError, KeyError, TypeError):
+                self._remove_orphan(path, now)
+                continue
+            self._sessions[session.session_id] = session
+            self._last_access[session.session_id] = metadata.get("last_access") or os.path.getmtime(metadata_path)
+            known_paths.update(os.path.abspath(p) for p in session.artifact_paths())
+
+        if self.upload_dir and os.path.isdir(self.upload_dir):
+            for name in os.listdir(self.upload_dir):
+                path = os.path.join(self.upload_dir, name)
+                if os.path.abspath(path) not in known_paths:
+                    self._remove_orphan(path, now)
+
+    def _remove_orphan(self, path, now):
+        """メタデータのないファイル・ディレクトリを、ttl より古ければ削除する"""
+        try:
+            if now - os.path.getmtime(path) > self.ttl:
+                remove_path(path)
+                self._evictions["orphans"] += 1
+        except OSError:
+            pass
+
+    def _sweep_loop(self):
+        """定期的に sweep を実行する"""
+        while not self._stop_event.wait(self.sweep_interval):
+            try:
+                self.sweep()
+            except Exception:
+                traceback.print_exc()
@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""
+ZIPアーカイブをディスクに書き出さずにストリーミングで生成する
+
+zipfile はシークできない出力先に対してもデータディスクリプタ付きで書き込めるため、
+書き込まれたバイト列をエントリの途中で少しずつ取り出してレスポンスとして返す。
+ZIP全体をメモリやディスクに置かないので、数千枚の結果画像でもすぐに送信を始められる。
+"""
+
+import io
+import os
+import time
+import zipfile
+
+# 既に圧縮されている形式は再圧縮しても小さくならないため、無圧縮で格納する
+STORED_EXTENSIONS = {".jpg", ".jpeg", ".png", ".gif", ".mp4", ".mov", ".avi", ".mkv", ".npz", ".gz", ".zip"}
+
+CHUNK_SIZE = 1024 * 1024
+
+
+def compression_for(arcname):
+    """
+    ファイルの種類に応じた圧縮方式を選ぶ
+
+    Args:
+        arcname (str): アーカイブ内のファイル名
+
+    Returns:
+        int: zipfile.ZIP_STORED または zipfile.ZIP_DEFLATED
+    """
+    extension = os.path.splitext(arcname)[1].lower()
+    return zipfile.ZIP_STORED if extension in STORED_EXTENSIONS else zipfile.ZIP_DEFLATED
+
+
+class _StreamBuffer(io.RawIOBase):
+    """zipfile の出力先。書き込まれたバイト列を取り出すまで保持する（シーク不可）"""
+
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def take(self):
+        """保持しているバイト列を取り出す"""
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def _iter_source(source, chunk_size):
+    """エントリの内容をバイト列のチャンクとして返す"""
+    if isinstance(source, str):
+        source = source.encode("utf-8")
+    if isinstance(source, bytes):
+        for start in range(0, len(source), chunk_size):
+            yield source[start:start + chunk_size]
+    else:
+        yield from source
+
+
+def _flush(buffer):
+    """書き込まれたバイト列があれば返す"""
+    data = buffer.take()
+    if data:
+        yield data
+
+
+def iter_zip(entries, chunk_size=CHUNK_SIZE):
+    """
+    ZIPアーカイブのバイト列を少しずつ生成する
+
+    Args:
+        entries (iterable): (アーカイブ内のファイル名, 内容) の列。内容は以下のいずれか
+            - ("file", パス): ディスク上のファイル
+            - str / bytes: そのまま格納する内容
+            - バイト列を返すイテラブル（ジェネレータなど）
+        chunk_size (int): ファイルを読み込む単位（バイト）
+
+    Yields:
+        bytes: ZIPアーカイブの断片（順に連結すると完全なZIPになる）
+    """
+    buffer = _StreamBuffer()
+    with zipfile.ZipFile(buffer, "w") as zip_file:
+        for arcname, source in entries:
+            if isinstance(source, tuple) and source[0] == "file":
+                path = source[1]
+                info = zipfile.ZipInfo.from_file(path, arcname)
+                info.compress_type = compression_for(arcname)
+                with zip_file.open(info, "w") as dest, open(path, "rb") as src:
+                    while True:
+                        data = src.read(chunk_size)
+                        if not data:
+                            break
+                        dest.write(data)
+                        yield from _flush(buffer)
+            else:
+                info = zipfile.ZipInfo(arcname, date_time=time.localtime()[:6])
+                info.compress_type = compression_for(arcname)
+                info.external_attr = 0o644 << 16
+                # ジェネレータの内容は大きさが分からないため、2GBを超えても書けるようZIP64で書き込む
+                with zip_file.open(info, "w", force_zip64=not isinstance(source, (str, bytes))) as dest:
+                    for data in _iter_source(source, chunk_size):
+                        dest.write(data)
+                        yield from _flush(buffer)
+            yield from _flush(buffer)
+    yield from _flush(buffer)
@@ -10,6 +10,16 @@ class SAM2WebApp {
         this.frameCanvas = null;
         this.frameContext = null;
         this.statusCheckInterval = null;
+        this.eventSource = null;
+        this.liveCanvas = null;
+        this.liveContext = null;
+        this.liveImage = null;
+        this.pendingLiveFrame = null;
+        this.interactive = false;   // 対話モード（クリックごとのマスクプレビュー）
+        this.previewMasks = {};     // オブジェクトID -> RLE
+        this.nextObjId = 0;
+        this.previewLoaded = false; // 最初のフレームを表示したか（フレーム分割中でも表示する）
+        this.framesReady = false;   // フレーム分割が完了したか
         
         this.init();
     }
@@ -41,9 +51,11 @@ class SAM2WebApp {
         document.getElementById('add-negative-btn').addEventListener('click', () => this.setPointMode('negative'));
         document.getElementById('clear-points-btn').addEventListener('click', this.clearPoints.bind(this));
         document.getElementById('confirm-points-btn').addEventListener('click', this.confirmPoints.bind(this));
+        document.getElementById('interactive-preview').addEventListener('change', (e) => this.toggleInteractive(e.target.checked));
         
         // 追跡開始
         document.getElementById('start-tracking-btn').addEventListener('click', this.startTracking.bind(this));
+        document.getElementById('cancel-tracking-btn').addEventListener('click', this.cancelTracking.bind(this));
         
         // 結果ダウンロード
         document.getElementById('download-results-btn').addEventListener('click', this.downloadResults.bind(this));
@@ -56,6 +68,11 @@ class SAM2WebApp {
             this.frameContext = this.frameCanvas.getContext('2d');
             this.frameCanvas.addEventListener('click', this.handleCanvasClick.bind(this));
         }
+        
+        this.liveCanvas = document.getElementById('live-canvas');
+        if (this.liveCanvas) {
+            this.liveContext = this.liveCanvas.getContext('2d');
+        }
     }
     
     // ファイル処理
@@ -85,26 +102,53 @@ class SAM2WebApp {
     }
     
     async uploadFile(file) {
-        const formData = new FormData();
-        formData.append('video', file);
-        
+        // チャンクに分けて送り、通信が切れても受信済みの位置から再開する
         this.showUploadProgress(true);
         
         try {
-            const response = await fetch('/upload', {
-                method: 'POST',
-                body: formData
-            });
+            const upload = await this.initUpload(file);
+            this.sessionId = upload.session_id;
             
-            const data = await response.json();
+            let offset = upload.received;
+            let retries = 0;
+            let started = false;
             
-            if (response.ok) {
-                this.sessionId = data.session_id;
-                this.showMessage('アップロード完了: ' + data.filename, 'success');
-                this.nextStep();
-            } else {
-                throw new Error(data.error || 'アップロードに失敗しました');
+            while (offset < file.size) {
+                const chunk = file.slice(offset, offset + upload.chunk_size);
+                let response;
+                try {
+                    response = await fetch('/upload/' + this.sessionId + '?offset=' + offset, {
+                        method: 'PUT',
+                        body: chunk
+                    });
+                } catch (error) {
+                    // 通信エラー: 待ってから受信済みの位置を確認して再送
+                    if (++retries > SAM2WebApp.UPLOAD_MAX_RETRIES) throw error;
+                    await new Promise(resolve => setTimeout(resolve, 1000 * retries));
+                    offset = await this.getUploadOffset(offset);
+                    continue;
+                }
+                
+                const data = await response.json();
+                
+                // 409 はオフセットのずれ（受信済みの位置から送り直す）
+                if (!response.ok && response.status !== 409) {
+                    throw new Error(data.error || 'アップロードに失敗しました');
+                }
+                offset = data.received;
+                retries = 0;
+                this.setUploadProgress(offset / file.size);
+                
+                // 最初のチャンクが届いた時点でサーバー側のフレーム分割が始まる
+                if (!started) {
+                    started = true;
+                    this.nextStep();
+                    this.startStatusCheck();
+                }
             }
+            
+            localStorage.removeItem('sam2-upload');
+            this.showMessage('アップロード完了: ' + upload.filename, 'success');
         } catch (error) {
             this.showMessage('エラー: ' + error.message, 'error');
         } finally {
@@ -112,6 +156,62 @@ class SAM2WebApp {
         }
     }
     
+    async initUpload(file) {
+        // 同じファイルの未完了のアップロードがあれば再開する
+        const key = [file.name, file.size, file.lastModified].join(':');
+        const saved = JSON.parse(localStorage.getItem('sam2-upload') || 'null');
+        
+        if (saved && saved.key === key) {
+            const response = await fetch('/upload/' + saved.session_id);
+            if (response.ok) {
+                const data = await response.json();
+                if (!data.complete) {
+                    return Object.assign({}, saved, { received: data.received });
+                }
+            }
+        }
+        
+        const response = await fetch('/upload/init', {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'application/json'
+            },
+            body: JSON.stringify({ filename: file.name, size: file.size })
+        });
+        
+        const data = await response.json();
+        
+        if (!response.ok) {
+            throw new Error(data.error || 'アップロードに失敗しました');
+        }
+        
+        localStorage.setItem('sam2-upload', JSON.stringify({
+            key: key,
+            session_id: data.session_id,
+            filename: data.filename,
+            chunk_size: data.chunk_size
+        }));
+        return data;
+    }
+    
+    async getUploadOffset(offset) {
+        try {
+            const response = await fetch('/upload/' + this.sessionId);
+            if (response.ok) {
+                return (await response.json()).received;
+            }
+        } catch (error) {
+            console.error('Upload status error:', error);
+        }
+        return offset;
+    }
+    
+    setUploadProgress(ratio) {
+        const percent = Math.round(ratio * 100);
+        document.querySelector('#upload-progress .progress-bar').style.width = percent + '%';
+        document.getElementById('upload-status').textContent = 'アップロード中... ' + percent + '%';
+    }
+    
     async extractFrames() {
         if (!this.sessionId) {
             this.showMessage('先に動画をアップロードしてください', 'error');
@@ -137,6 +237,7 @@ class SAM2WebApp {
     }
     
     async startStatusCheck() {
+        clearInterval(this.statusCheckInterval);
         this.statusCheckInterval = setInterval(async () => {
             try {
                 const response = await fetch('/status/' + this.sessionId);
@@ -146,6 +247,16 @@ class SAM2WebApp {
                 
                 if (data.status === 'frames_ready') {
                     clearInterval(this.statusCheckInterval);
+                    this.framesReady = true;
+                    if (this.previewLoaded) {
+                        document.getElementById('total-frames').textContent = data.frame_count;
+                        this.updateConfirmButton();
+                    } else {
+                        await this.loadFramePreview();
+                        this.nextStep();
+                    }
+                } else if (data.status === 'extracting' && data.frame_count > 0 && !this.previewLoaded) {
+                    // 最初のフレームが書き出されたら、分割の完了を待たずに座標選択へ進む
                     await this.loadFramePreview();
                     this.nextStep();
                 } else if (data.status === 'completed') {
@@ -163,6 +274,7 @@ class SAM2WebApp {
     }
     
     async loadFramePreview() {
+        this.previewLoaded = true;
         try {
             const response = await fetch('/get_frames/' + this.sessionId);
             const data = await response.json();
@@ -229,31 +341,50 @@ class SAM2WebApp {
             x: Math.round(x),
             y: Math.round(y),
             type: type, // 'positive' or 'negative'
-            id: Date.now() // 簡単なID
+            id: Date.now(), // 簡単なID
+            objId: this.nextObjId++ // 対話モードでのオブジェクトID
         };
         
         this.selectedPoints.push(point);
         this.updatePointsList();
         this.redrawPoints();
         
+        if (this.interactive) {
+            this.previewPoint(point);
+        }
+        
         // 確定ボタンを有効化
-        document.getElementById('confirm-points-btn').disabled = this.selectedPoints.length === 0;
+        this.updateConfirmButton();
     }
     
     removePoint(pointId) {
+        const point = this.selectedPoints.find(p => p.id === pointId);
+        if (point && this.interactive) {
+            delete this.previewMasks[point.objId];
+            this.interactiveRequest('remove_object', { obj_id: point.objId });
+        }
         this.selectedPoints = this.selectedPoints.filter(p => p.id !== pointId);
         this.updatePointsList();
         this.redrawPoints();
         
         // 確定ボタンの状態更新
-        document.getElementById('confirm-points-btn').disabled = this.selectedPoints.length === 0;
+        this.updateConfirmButton();
     }
     
     clearPoints() {
+        if (this.interactive) {
+            this.interactiveRequest('reset', {});
+        }
+        this.previewMasks = {};
         this.selectedPoints = [];
         this.updatePointsList();
         this.redrawPoints();
-        document.getElementById('confirm-points-btn').disabled = true;
+        this.updateConfirmButton();
+    }
+    
+    updateConfirmButton() {
+        // 座標の確定はフレーム分割の完了後
+        document.getElementById('confirm-points-btn').disabled = this.selectedPoints.length === 0 || !this.framesReady;
     }
     
     updatePointsList() {
@@ -284,6 +415,12 @@ class SAM2WebApp {
         this.frameContext.clearRect(0, 0, this.frameCanvas.width, this.frameCanvas.height);
         this.frameContext.drawImage(this.currentFrame, 0, 0, this.frameCanvas.width, this.frameCanvas.height);
         
+        // 対話モードのプレビューマスクを描画
+        Object.keys(this.previewMasks).forEach(objId => {
+            const overlay = this.rleToCanvas(this.previewMasks[objId], SAM2WebApp.COLORS[objId % SAM2WebApp.COLORS.length]);
+            this.frameContext.drawImage(overlay, 0, 0, this.frameCanvas.width, this.frameCanvas.height);
+        });
+        
         // 座標点を描画
         this.selectedPoints.forEach(point => {
             this.frameContext.beginPath();
@@ -296,6 +433,105 @@ class SAM2WebApp {
         });
     }
     
+    // 対話モード
+    async toggleInteractive(enabled) {
+        const checkbox = document.getElementById('interactive-preview');
+        
+        if (!enabled) {
+            this.interactive = false;
+            this.previewMasks = {};
+            this.redrawPoints();
+            fetch('/interactive/' + this.sessionId + '/close', { method: 'POST' });
+            return;
+        }
+        
+        if (!this.framesReady) {
+            checkbox.checked = false;
+            this.showMessage('フレーム分割の完了を待ってください', 'info');
+            return;
+        }
+        
+        checkbox.disabled = true;
+        this.showMessage('モデルとフレームを読み込んでいます...', 'info');
+        
+        try {
+            const response = await fetch('/interactive/' + this.sessionId + '/start', {
+                method: 'POST',
+                headers: {
+                    'Content-Type': 'application/json'
+                },
+                body: JSON.stringify({ model_size: document.getElementById('model-size').value })
+            });
+            
+            const data = await response.json();
+            
+            if (!response.ok) {
+                throw new Error(data.error || '対話モードを開始できませんでした');
+            }
+            
+            this.interactive = true;
+            this.showMessage(data.message, 'success');
+            
+            // 既に選択済みの座標もプレビュー
+            for (const point of this.selectedPoints) {
+                await this.previewPoint(point);
+            }
+        } catch (error) {
+            checkbox.checked = false;
+            this.showMessage('エラー: ' + error.message, 'error');
+        } finally {
+            checkbox.disabled = false;
+        }
+    }
+    
+    async previewPoint(point) {
+        // キャンバス座標を元画像の座標に変換
+        const scale = this.currentFrame.width / this.frameCanvas.width;
+        const data = await this.interactiveRequest('click', {
+            frame_idx: 0,
+            obj_id: point.objId,
+            points: [[point.x * scale, point.y * scale]],
+            labels: [point.type === 'positive' ? 1 : 0],
+            clear_old_points: true
+        });
+        
+        if (data && this.selectedPoints.includes(point)) {
+            data.objects.forEach(obj => {
+                this.previewMasks[obj.id] = obj.rle;
+            });
+            this.redrawPoints();
+        }
+    }
+    
+    async interactiveRequest(action, body) {
+        try {
+            const response = await fetch('/interactive/' + this.sessionId + '/' + action, {
+                method: 'POST',
+                headers: {
+                    'Content-Type': 'application/json'
+                },
+                body: JSON.stringify(body)
+            });
+            
+            const data = await response.json();
+            
+            if (response.status === 410) {
+                // アイドル時間・メモリ予算により破棄された
+                this.interactive = false;
+                this.previewMasks = {};
+                document.getElementById('interactive-preview').checked = false;
+                this.redrawPoints();
+            }
+            if (!response.ok) {
+                throw new Error(data.error || 'プレビューに失敗しました');
+            }
+            return data;
+        } catch (error) {
+            this.showMessage('エラー: ' + error.message, 'error');
+            return null;
+        }
+    }
+    
     async confirmPoints() {
         if (this.selectedPoints.length === 0) return;
         
@@ -343,6 +579,7 @@ class SAM2WebApp {
         if (!this.sessionId) return;
         
         const modelSize = document.getElementById('model-size').value;
+        const outputFormat = document.getElementById('output-format').value;
         
         try {
             const response = await fetch('/start_tracking/' + this.sessionId, {
@@ -350,13 +587,15 @@ class SAM2WebApp {
                 headers: {
                     'Content-Type': 'application/json'
                 },
-                body: JSON.stringify({ model_size: modelSize })
+                body: JSON.stringify({ model_size: modelSize, output_format: outputFormat })
             });
             
             const data = await response.json();
             
             if (response.ok) {
                 this.showMessage(data.message, 'info');
+                document.getElementById('tracking-progress').style.display = 'block';
+                this.startLiveStream();
                 this.startStatusCheck();
             } else {
                 throw new Error(data.error || '追跡開始に失敗しました');
@@ -366,9 +605,113 @@ class SAM2WebApp {
         }
     }
     
+    async cancelTracking() {
+        if (!this.sessionId) return;
+        
+        try {
+            const response = await fetch('/cancel/' + this.sessionId, { method: 'POST' });
+            const data = await response.json();
+            
+            if (response.ok) {
+                clearInterval(this.statusCheckInterval);
+                this.stopLiveStream();
+                this.showMessage(data.message, 'info');
+            } else {
+                throw new Error(data.error || '中止に失敗しました');
+            }
+        } catch (error) {
+            this.showMessage('エラー: ' + error.message, 'error');
+        }
+    }
+    
+    // ライブ表示（Server-Sent Eventsでフレームごとのマスクを受信）
+    startLiveStream() {
+        this.stopLiveStream();
+        this.eventSource = new EventSource('/stream/' + this.sessionId);
+        
+        this.eventSource.addEventListener('frame', (e) => {
+            const frame = JSON.parse(e.data);
+            this.updateProgress({ progress: frame.progress, message: 'フレーム ' + (frame.frame_idx + 1) + ' を追跡中...' });
+            this.renderLiveFrame(frame);
+        });
+        this.eventSource.addEventListener('end', () => this.stopLiveStream());
+    }
+    
+    stopLiveStream() {
+        if (this.eventSource) {
+            this.eventSource.close();
+            this.eventSource = null;
+        }
+    }
+    
+    renderLiveFrame(frame) {
+        if (!this.liveCanvas || !frame.frame_name) return;
+        
+        // 画像の読み込み中に届いたフレームは最新のものだけを描画する
+        const loading = this.pendingLiveFrame !== null;
+        this.pendingLiveFrame = frame;
+        if (loading) return;
+        
+        const img = new Image();
+        img.onload = () => {
+            const latest = this.pendingLiveFrame;
+            this.pendingLiveFrame = null;
+            if (latest.frame_name !== frame.frame_name) {
+                this.renderLiveFrame(latest);
+                return;
+            }
+            this.drawLiveFrame(img, latest.objects);
+        };
+        img.onerror = () => { this.pendingLiveFrame = null; };
+        img.src = '/frame_image/' + this.sessionId + '/' + frame.frame_name;
+    }
+    
+    drawLiveFrame(img, objects) {
+        const scale = Math.min(800 / img.width, 600 / img.height, 1);
+        this.liveCanvas.width = img.width * scale;
+        this.liveCanvas.height = img.height * scale;
+        this.liveCanvas.style.display = 'inline-block';
+        this.liveContext.drawImage(img, 0, 0, this.liveCanvas.width, this.liveCanvas.height);
+        
+        objects.forEach((obj) => {
+            const overlay = this.rleToCanvas(obj.rle, SAM2WebApp.COLORS[obj.id % SAM2WebApp.COLORS.length]);
+            this.liveContext.drawImage(overlay, 0, 0, this.liveCanvas.width, this.liveCanvas.height);
+        });
+    }
+    
+    rleToCanvas(rle, color) {
+        // 非圧縮RLE（列優先、0の連続から開始）を半透明の色付き画像に変換
+        const [h, w] = rle.size;
+        const canvas = document.createElement('canvas');
+        canvas.width = w;
+        canvas.height = h;
+        const ctx = canvas.getContext('2d');
+        const image = ctx.createImageData(w, h);
+        
+        let idx = 0;
+        rle.counts.forEach((count, i) => {
+            if (i % 2 === 1) {
+                for (let k = idx; k < idx + count; k++) {
+                    const p = ((k % h) * w + Math.floor(k / h)) * 4;
+                    image.data[p] = color[0];
+                    image.data[p + 1] = color[1];
+                    image.data[p + 2] = color[2];
+                    image.data[p + 3] = 153;  // alpha 0.6
+                }
+            }
+            idx += count;
+        });
+        
+        ctx.putImageData(image, 0, 0);
+        return canvas;
+    }
+    
     showResults(results) {
         const container = document.getElementById('results-summary');
         
+        // 動画で出力した場合は結果動画をダウンロードの既定にする
+        document.getElementById('download-format').value = results.output_format === 'video' ? 'video' : 'full';
+        
         container.innerHTML = 
             '<div class="row">' +
                 '<div class="col-md-3">' +
@@ -416,7 +759,8 @@ class SAM2WebApp {
     downloadResults() {
         if (!this.sessionId) return;
         
-        window.location.href = '/download_results/' + this.sessionId;
+        const format = document.getElementById('download-format').value;
+        window.location.href = '/download_results/' + this.sessionId + '?format=' + format;
     }
     
     newSession() {
@@ -428,6 +772,8 @@ class SAM2WebApp {
         this.sessionId = null;
         this.selectedPoints = [];
         this.currentStep = 1;
+        this.previewLoaded = false;
+        this.framesReady = false;
         
         // UI リセット
         this.resetUI();
@@ -511,6 +857,8 @@ class SAM2WebApp {
         }
         
         // 座標リストクリア
+        this.interactive = false;
+        document.getElementById('interactive-preview').checked = false;
         this.clearPoints();
         
         // アラート非表示
@@ -518,6 +866,15 @@ class SAM2WebApp {
     }
 }
 
+// 分割アップロードの通信エラー時の再試行回数
+SAM2WebApp.UPLOAD_MAX_RETRIES = 5;
+
+// オブジェクトごとのマスク色（matplotlib tab10 と同じ）
+SAM2WebApp.COLORS = [
+    [31, 119, 180], [255, 127, 14], [44, 160, 44], [214, 39, 40], [148, 103, 189],
+    [140, 86, 75], [227, 119, 194], [127, 127, 127], [188, 189, 34], [23, 190, 207]
+];
+
 // アプリケーション初期化
 let app;
 document.addEventListener('DOMContentLoaded', () => {
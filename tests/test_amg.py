@@ -0,0 +1,245 @@
+#!/usr/bin/env python3
+"""
+自動マスク生成ユーティリティ（sam2_package.utils.amg）のテスト
+"""
+
+import unittest
+import os
+import sys
+import numpy as np
+import torch
+
+# プロジェクトルートを追加
+current_dir = os.path.dirname(os.path.abspath(__file__))
+project_root = os.path.dirname(current_dir)
+sys.path.insert(0, project_root)
+
+from sam2_package.utils.amg import (
+    CompactRLE,
+    MaskData,
+    area_from_rle,
+    mask_iou_matrix,
+    mask_nms,
+    mask_to_rle_compact,
+    mask_to_rle_pytorch,
+    remove_small_regions,
+    remove_small_regions_batch,
+    rle_to_mask,
+    rles_to_masks,
+    sample_rles,
+    sampled_mask_iou_matrix,
+)
+
+
+def reference_rle(mask):
+    """1枚のマスクをPythonループで素朴にRLE化（比較用）"""
+    h, w = mask.shape
+    flat = mask.T.reshape(-1).tolist()
+    counts = []
+    current, run = False, 0
+    for value in flat:
+        if value == current:
+            run += 1
+        else:
+            counts.append(run)
+            current, run = value, 1
+    counts.append(run)
+    return {"size": [h, w], "counts": counts}
+
+
+def make_masks(b=6, h=13, w=9, seed=0):
+    """全0・全1・先頭画素が1のマスクを含むテスト用マスクを作成"""
+    generator = torch.Generator().manual_seed(seed)
+    masks = torch.rand(b, h, w, generator=generator) > 0.5
+    masks[0] = False
+    masks[1] = True
+    masks[2] = False
+    masks[2, 0, 0] = True
+    return masks
+
+
+class TestMaskToRLE(unittest.TestCase):
+    """ベクトル化RLEエンコーダのテストクラス"""
+
+    def test_matches_reference(self):
+        """素朴な実装と同じRLEになることのテスト"""
+        masks = make_masks()
+        expected = [reference_rle(m.numpy()) for m in masks]
+        self.assertEqual(mask_to_rle_pytorch(masks), expected)
+        self.assertEqual(mask_to_rle_compact(masks).to_list(), expected)
+
+    def test_empty_batch(self):
+        """マスクが0枚の場合のテスト"""
+        rles = mask_to_rle_compact(torch.zeros(0, 4, 5, dtype=torch.bool))
+        self.assertEqual(len(rles), 0)
+        self.assertEqual(rles.size, [4, 5])
+        self.assertEqual(mask_to_rle_pytorch(torch.zeros(0, 4, 5, dtype=torch.bool)), [])
+
+
+class TestRLEToMask(unittest.TestCase):
+    """ベクトル化RLEデコーダのテストクラス"""
+
+    def test_roundtrip(self):
+        """エンコードしたマスクが元に戻ることのテスト"""
+        masks = make_masks()
+        rles = mask_to_rle_pytorch(masks)
+        for rle, mask in zip(rles, masks):
+            np.testing.assert_array_equal(rle_to_mask(rle), mask.numpy())
+
+    def test_batched(self):
+        """リストとCompactRLEから一括で (N, H, W) に復元できることのテスト"""
+        masks = make_masks()
+        expected = masks.numpy()
+        np.testing.assert_array_equal(rles_to_masks(mask_to_rle_pytorch(masks)), expected)
+        np.testing.assert_array_equal(rles_to_masks(mask_to_rle_compact(masks)), expected)
+        self.assertEqual(rles_to_masks(mask_to_rle_compact(masks[:0])).shape, (0, 13, 9))
+
+
+class TestCompactRLE(unittest.TestCase):
+    """CompactRLEのテストクラス"""
+
+    def setUp(self):
+        """テスト前の準備"""
+        self.masks = make_masks()
+        self.rles = mask_to_rle_pytorch(self.masks)
+        self.compact = mask_to_rle_compact(self.masks)
+
+    def test_indexing_and_areas(self):
+        """要素アクセスと面積計算のテスト"""
+        self.assertEqual(self.compact[3], self.rles[3])
+        self.assertEqual(list(self.compact), self.rles)
+        self.assertEqual(
+            self.compact.areas().tolist(), [area_from_rle(rle) for rle in self.rles]
+        )
+        self.assertEqual(CompactRLE.from_list(self.rles).to_list(), self.rles)
+
+    def test_select_and_cat(self):
+        """選択と連結のテスト"""
+        keep = torch.tensor([True, False, True, False, True, True])
+        selected = self.compact.select(keep)
+        self.assertEqual(selected.to_list(), [r for r, k in zip(self.rles, keep) if k])
+        self.assertEqual(self.compact.select(np.array([4, 0])).to_list(), [self.rles[4], self.rles[0]])
+
+        joined = CompactRLE.cat([self.compact, selected])
+        self.assertEqual(joined.to_list(), self.rles + selected.to_list())
+
+    def test_contains(self):
+        """画素座標がどのマスクに含まれるかを判定できることのテスト"""
+        ys, xs = np.meshgrid(np.arange(13), np.arange(9), indexing="ij")
+        coords = np.stack([xs.ravel(), ys.ravel()], axis=1)
+        inside = self.compact.contains(coords)
+        np.testing.assert_array_equal(inside, self.masks.reshape(6, -1).numpy())
+
+        # マスクを分割して判定しても同じ結果になる（1回に 117 画素 = 1マスク分ずつ）
+        np.testing.assert_array_equal(self.compact.contains(coords, max_queries=117), inside)
+        np.testing.assert_array_equal(self.compact.contains(coords, max_queries=250), inside)
+
+    def test_mask_data(self):
+        """MaskDataでCompactRLEを保持・フィルタ・連結できることのテスト"""
+        data = MaskData(rles=self.compact, iou_preds=torch.arange(6).float())
+        data.cat(MaskData(rles=self.compact.select([1]), iou_preds=torch.tensor([9.0])))
+        data.filter(data["iou_preds"] > 3)
+
+        self.assertIsInstance(data["rles"], CompactRLE)
+        self.assertEqual(data["rles"].to_list(), [self.rles[4], self.rles[5], self.rles[1]])
+
+
+class TestMaskNMS(unittest.TestCase):
+    """マスクIoUによるNMSのテストクラス"""
+
+    def setUp(self):
+        """テスト前の準備（外枠の輪と内側の円盤、輪とほぼ同じマスク）"""
+        masks = torch.zeros(3, 40, 40, dtype=torch.bool)
+        masks[0, 5:35, 5:35] = True
+        masks[0, 7:33, 7:33] = False  # 輪
+        masks[1, 7:33, 7:33] = True  # 内側（ボックスIoUは高いがマスクIoUは0）
+        masks[2] = masks[0]
+        masks[2, 5, 5:10] = False  # 輪とほぼ同じ
+        self.masks = masks
+
+    def test_iou_matrix(self):
+        """IoU行列のテスト"""
+        ious = mask_iou_matrix(self.masks)
+        self.assertAlmostEqual(ious[0, 0].item(), 1.0)
+        self.assertEqual(ious[0, 1].item(), 0.0)
+        self.assertGreater(ious[0, 2].item(), 0.9)
+        self.assertTrue(torch.allclose(ious, ious.T))
+
+    def test_nested_masks_are_kept(self):
+        """入れ子のマスクは残り、重複だけが除去されることのテスト"""
+        ious = mask_iou_matrix(self.masks)
+        keep = mask_nms(ious, torch.tensor([0.9, 0.8, 0.95]), 0.7)
+        self.assertEqual(keep.tolist(), [2, 1])
+
+        # ペアごとの閾値
+        thresholds = torch.full((3, 3), 0.99)
+        keep = mask_nms(ious, torch.tensor([0.9, 0.8, 0.95]), thresholds)
+        self.assertEqual(keep.tolist(), [2, 0, 1])
+
+    def test_sampled_rles(self):
+        """RLEを間引いてサンプリングしても同じIoUになることのテスト"""
+        sampled = sample_rles(mask_to_rle_compact(self.masks), max_side=40)
+        self.assertEqual(sampled.shape, (3, 1600))
+        self.assertTrue(torch.allclose(mask_iou_matrix(sampled), mask_iou_matrix(self.masks)))
+        self.assertEqual(sample_rles(mask_to_rle_compact(self.masks), max_side=20).shape, (3, 400))
+
+    def test_small_masks_use_box_iou(self):
+        """サンプリング点に掛からない小さなマスクはボックスIoUで比較されることのテスト"""
+        masks = torch.zeros(4, 40, 40, dtype=torch.bool)
+        masks[0, 1:4, 1:4] = True  # 3x3
+        masks[1, 1:4, 1:5] = True  # 3x4（マスク0とほぼ同じ）
+        masks[2, 30:33, 30:33] = True  # 離れた小さなマスク
+        masks[3, 5:35, 5:35] = True  # サンプリングされる大きなマスク
+        boxes = torch.tensor([[1, 1, 3, 3], [1, 1, 4, 3], [30, 30, 32, 32], [5, 5, 34, 34]])
+        rles = mask_to_rle_compact(masks)
+
+        # 間隔10のサンプリングでは小さなマスクの面積が0になる
+        self.assertEqual(sample_rles(rles, max_side=4).sum(dim=1).tolist(), [0, 0, 0, 9])
+        ious = sampled_mask_iou_matrix(rles, boxes, max_side=4)
+        self.assertAlmostEqual(ious[0, 1].item(), 9 / 12)
+        self.assertEqual(ious[0, 2].item(), 0.0)
+        self.assertAlmostEqual(ious[0, 0].item(), 1.0)
+        self.assertAlmostEqual(ious[3, 3].item(), 1.0)
+        self.assertEqual(mask_nms(ious, torch.tensor([0.9, 0.8, 0.7, 0.6]), 0.7).tolist(), [0, 2, 3])
+
+        # 十分に細かくサンプリングすればマスクIoUになる
+        fine = sampled_mask_iou_matrix(rles, boxes, max_side=40)
+        self.assertTrue(torch.allclose(fine, mask_iou_matrix(masks)))
+
+
+class TestRemoveSmallRegions(unittest.TestCase):
+    """小領域除去のテストクラス"""
+
+    def test_holes_and_islands(self):
+        """小さな穴が埋まり、小さな島が消えることのテスト"""
+        mask = np.zeros((20, 20), dtype=bool)
+        mask[2:12, 2:12] = True
+        mask[5, 5] = False  # 小さな穴
+        mask[16:18, 16:18] = True  # 小さな島
+
+        filled, changed = remove_small_regions(mask, 5, mode="holes")
+        self.assertTrue(changed)
+        self.assertTrue(filled[5, 5])
+
+        cleaned, changed = remove_small_regions(filled, 5, mode="islands")
+        self.assertTrue(changed)
+        self.assertFalse(cleaned[16:18, 16:18].any())
+        self.assertEqual(cleaned.sum(), 100)
+
+        # 全領域が閾値未満なら最大の領域を残す
+        kept, changed = remove_small_regions(mask, 1000, mode="islands")
+        self.assertEqual(kept.sum(), 99)
+
+    def test_batch_matches_single(self):
+        """一括処理が1枚ずつの処理と一致することのテスト"""
+        masks = make_masks(b=8, h=24, w=24).numpy()
+        new_masks, changed = remove_small_regions_batch(masks, 6, num_workers=3)
+        for mask, new_mask, mask_changed in zip(masks, new_masks, changed):
+            expected, changed_holes = remove_small_regions(mask, 6, mode="holes")
+            expected, changed_islands = remove_small_regions(expected, 6, mode="islands")
+            np.testing.assert_array_equal(new_mask, expected)
+            self.assertEqual(mask_changed, changed_holes or changed_islands)
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
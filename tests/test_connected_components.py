@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+"""
+連結成分ラベリング（get_connected_components）のCPU実装のテスト
+"""
+
+import unittest
+import os
+import sys
+import warnings
+import numpy as np
+import torch
+
+# プロジェクトルートを追加
+current_dir = os.path.dirname(os.path.abspath(__file__))
+project_root = os.path.dirname(current_dir)
+sys.path.insert(0, project_root)
+
+from sam2_package.utils.misc import (
+    _get_connected_components_cpu,
+    fill_holes_in_mask_scores,
+    get_connected_components,
+)
+
+
+def reference_components(mask):
+    """8近傍の幅優先探索による素朴な連結成分ラベリング（比較用）"""
+    h, w = mask.shape
+    labels = np.zeros((h, w), dtype=np.int64)
+    areas = np.zeros((h, w), dtype=np.int64)
+    next_label = 1
+    for y in range(h):
+        for x in range(w):
+            if not mask[y, x] or labels[y, x]:
+                continue
+            stack, pixels = [(y, x)], []
+            labels[y, x] = next_label
+            while stack:
+                cy, cx = stack.pop()
+                pixels.append((cy, cx))
+                for dy in (-1, 0, 1):
+                    for dx in (-1, 0, 1):
+                        ny, nx = cy + dy, cx + dx
+                        if 0 <= ny < h and 0 <= nx < w and mask[ny, nx] and not labels[ny, nx]:
+                            labels[ny, nx] = next_label
+                            stack.append((ny, nx))
+            for py, px in pixels:
+                areas[py, px] = len(pixels)
+            next_label += 1
+    return labels, areas
+
+
+class TestConnectedComponents(unittest.TestCase):
+    """CPU版連結成分ラベリングのテストクラス"""
+
+    def assert_same_partition(self, labels, expected):
+        """ラベルの値ではなく、成分の分割が一致することを確認"""
+        self.assertTrue(np.array_equal(labels > 0, expected > 0))
+        pairs = set(zip(labels[expected > 0].tolist(), expected[expected > 0].tolist()))
+        self.assertEqual(len(pairs), len(set(l for l, _ in pairs)))
+        self.assertEqual(len(pairs), len(set(e for _, e in pairs)))
+
+    def test_matches_kernel_semantics(self):
+        """CUDAカーネルと同じ (labels, counts) の仕様になることのテスト"""
+        generator = torch.Generator().manual_seed(0)
+        mask = torch.rand(4, 1, 17, 23, generator=generator) > 0.6
+        mask[0] = False
+        mask[1] = True
+
+        labels, counts = _get_connected_components_cpu(mask, num_workers=2)
+        self.assertEqual(labels.shape, mask.shape)
+        self.assertEqual(labels.dtype, torch.int32)
+        self.assertEqual(counts.dtype, torch.int32)
+
+        for i in range(mask.shape[0]):
+            expected_labels, expected_areas = reference_components(mask[i, 0].numpy())
+            self.assert_same_partition(labels[i, 0].numpy(), expected_labels)
+            np.testing.assert_array_equal(counts[i, 0].numpy(), expected_areas)
+
+    def test_diagonal_connectivity(self):
+        """斜めに接する画素が同じ成分になることのテスト"""
+        mask = torch.zeros(1, 1, 3, 3, dtype=torch.bool)
+        mask[0, 0, 0, 0] = mask[0, 0, 1, 1] = mask[0, 0, 2, 2] = True
+        labels, counts = get_connected_components(mask)
+        self.assertEqual(len(torch.unique(labels[labels > 0])), 1)
+        self.assertEqual(counts.max().item(), 3)
+
+    def test_fill_holes_on_cpu(self):
+        """CPUでも小さな穴埋めが警告なしに行われることのテスト"""
+        scores = torch.full((1, 1, 8, 8), 5.0)
+        scores[0, 0, 3, 3] = -5.0
+        with warnings.catch_warnings():
+            warnings.simplefilter("error")
+            filled = fill_holes_in_mask_scores(scores, max_area=2)
+        self.assertGreater(filled[0, 0, 3, 3].item(), 0)
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+"""
+画像埋め込みキャッシュ（EmbeddingCache）のテスト
+"""
+
+import unittest
+import os
+import sys
+import shutil
+import tempfile
+import time
+import numpy as np
+import torch
+
+# プロジェクトルートを追加
+current_dir = os.path.dirname(os.path.abspath(__file__))
+project_root = os.path.dirname(current_dir)
+sys.path.insert(0, project_root)
+
+from sam2_package.utils.embedding_cache import EmbeddingCache
+
+
+def make_features(value=0.0, orig_hw=(120, 160)):
+    """テスト用の小さな特徴量を作成（1エントリ = 4096 + 2048 + 1024 要素 * 4バイト）"""
+    return {
+        "image_embed": torch.full((1, 4, 32, 32), value),
+        "high_res_feats": [torch.full((1, 2, 32, 32), value), torch.full((1, 1, 32, 32), value)],
+        "orig_hw": [orig_hw],
+    }
+
+
+ENTRY_BYTES = (4 + 2 + 1) * 32 * 32 * 4
+
+
+class TestEmbeddingCache(unittest.TestCase):
+    """EmbeddingCacheのテストクラス"""
+
+    def setUp(self):
+        """テスト前の準備"""
+        self.temp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        """テスト後のクリーンアップ"""
+        shutil.rmtree(self.temp_dir)
+
+    def test_key_depends_on_content(self):
+        """キーが画像内容で決まることのテスト"""
+        cache = EmbeddingCache()
+        image = np.zeros((8, 8, 3), dtype=np.uint8)
+        self.assertEqual(cache.key_for_image(image), cache.key_for_image(image.copy()))
+
+        other = image.copy()
+        other[0, 0, 0] = 1
+        self.assertNotEqual(cache.key_for_image(image), cache.key_for_image(other))
+        self.assertNotEqual(
+            cache.key_for_image(image), EmbeddingCache(namespace="large").key_for_image(image)
+        )
+
+    def test_lru_eviction_by_bytes(self):
+        """バイト予算を超えたら最も古いエントリが追い出されることのテスト"""
+        cache = EmbeddingCache(max_bytes=2 * ENTRY_BYTES)
+        cache.put("a", make_features(1.0))
+        cache.put("b", make_features(2.0))
+        # "a" を参照して最近使ったものにする
+        self.assertIsNotNone(cache.get("a"))
+        cache.put("c", make_features(3.0))
+
+        self.assertIn("a", cache)
+        self.assertNotIn("b", cache)
+        self.assertIn("c", cache)
+
+        stats = cache.stats()
+        self.assertEqual(stats["evictions"], 1)
+        self.assertEqual(stats["hits"], 1)
+        self.assertEqual(stats["entries"], 2)
+        self.assertEqual(stats["bytes"], 2 * ENTRY_BYTES)
+
+    def test_miss_counter(self):
+        """存在しないキーでミスが数えられることのテスト"""
+        cache = EmbeddingCache()
+        self.assertIsNone(cache.get("missing"))
+        self.assertEqual(cache.stats()["misses"], 1)
+
+    def test_disk_tier(self):
+        """メモリから追い出されたエントリがディスクから復元されることのテスト"""
+        cache = EmbeddingCache(max_bytes=ENTRY_BYTES, disk_dir=self.temp_dir)
+        cache.put("a", make_features(1.0, orig_hw=(10, 20)))
+        cache.put("b", make_features(2.0))
+
+        features = cache.get("a")
+        self.assertIsNotNone(features)
+        self.assertTrue(torch.equal(features["image_embed"], torch.full((1, 4, 32, 32), 1.0)))
+        self.assertEqual(features["orig_hw"], [(10, 20)])
+
+        stats = cache.stats()
+        self.assertEqual(stats["disk_hits"], 1)
+        self.assertEqual(stats["disk_writes"], 2)
+
+        # 別インスタンス（再起動後）でもディスクから読める
+        restarted = EmbeddingCache(disk_dir=self.temp_dir)
+        self.assertIsNotNone(restarted.get("b"))
+
+    def test_disk_budget(self):
+        """ディスク予算を超えたら最も長く使われていないファイルが削除されることのテスト"""
+        disk_max_bytes = int(2.5 * ENTRY_BYTES)
+        cache = EmbeddingCache(disk_dir=self.temp_dir, disk_max_bytes=disk_max_bytes)
+        cache.put("a", make_features(1.0))
+        cache.put("b", make_features(2.0))
+        # 書き込み時刻が同じにならないよう、"a" を "b" より古くする
+        now = time.time()
+        os.utime(os.path.join(self.temp_dir, "a.pt"), (now - 20, now - 20))
+        os.utime(os.path.join(self.temp_dir, "b.pt"), (now - 10, now - 10))
+
+        # ディスクから読んだ "a" は最近使ったものになり、"b" が追い出される
+        cache.clear()
+        self.assertIsNotNone(cache.get("a"))
+        cache.put("c", make_features(3.0))
+
+        files = sorted(f for f in os.listdir(self.temp_dir) if f.endswith(".pt"))
+        self.assertEqual(files, ["a.pt", "c.pt"])
+        total = sum(os.path.getsize(os.path.join(self.temp_dir, f)) for f in os.listdir(self.temp_dir))
+        self.assertLessEqual(total, disk_max_bytes)
+        self.assertEqual(cache.stats()["disk_evictions"], 1)
+
+        # 残ったエントリは別インスタンスからも読める
+        restarted = EmbeddingCache(disk_dir=self.temp_dir)
+        self.assertIsNone(restarted.get("b"))
+        features = restarted.get("c")
+        self.assertTrue(torch.equal(features["image_embed"], torch.full((1, 4, 32, 32), 3.0)))
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
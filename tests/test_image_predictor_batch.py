@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+"""
+複数画像の一括デコード（SAM2ImagePredictor.predict_batch の batched_decoding）のテスト
+"""
+
+import unittest
+import os
+import sys
+import numpy as np
+import torch
+
+# プロジェクトルートを追加
+current_dir = os.path.dirname(os.path.abspath(__file__))
+project_root = os.path.dirname(current_dir)
+sys.path.insert(0, project_root)
+
+from src.sam2_utils import _import_sam2_package
+
+_import_sam2_package()
+from sam2.build_sam import build_sam2
+from sam2.sam2_image_predictor import SAM2ImagePredictor
+
+
+class TestBatchedDecoding(unittest.TestCase):
+    """一括デコードと画像ごとのデコードの結果の一致のテストクラス"""
+
+    @classmethod
+    def setUpClass(cls):
+        """チェックポイントなし（ランダムな重み）のモデルと、ランダムな画像特徴を設定"""
+        torch.manual_seed(0)
+        model = build_sam2("configs/sam2.1/sam2.1_hiera_t.yaml", None, device="cpu")
+        cls.predictor = SAM2ImagePredictor(model)
+        num_images = 2
+        cls.predictor.set_features(
+            torch.randn(num_images, 256, 64, 64),
+            [torch.randn(num_images, 32, 256, 256), torch.randn(num_images, 64, 128, 128)],
+            [(240, 320), (300, 200)],
+        )
+
+    def assert_same_as_loop(self, **prompts):
+        """batched_decoding の有無で同じ結果になることを確認"""
+        batched = self.predictor.predict_batch(
+            multimask_output=False, return_logits=True, batched_decoding=True, **prompts
+        )
+        looped = self.predictor.predict_batch(
+            multimask_output=False, return_logits=True, batched_decoding=False, **prompts
+        )
+        for batched_outputs, looped_outputs in zip(batched, looped):
+            for batched_np, looped_np in zip(batched_outputs, looped_outputs):
+                self.assertEqual(batched_np.shape, looped_np.shape)
+                np.testing.assert_allclose(batched_np, looped_np, rtol=1e-4, atol=1e-3)
+
+    def test_mask_input_with_multiple_prompts(self):
+        """画像ごとに複数のボックス・点とマスク入力がある場合のテスト"""
+        rng = np.random.default_rng(0)
+        boxes = [
+            np.array([[10, 10, 150, 120], [50, 60, 300, 200], [0, 0, 100, 100]], dtype=np.float32),
+            np.array([[20, 30, 180, 250], [5, 5, 60, 90]], dtype=np.float32),
+        ]
+        points = [
+            np.array([[[80, 60]], [[150, 120]], [[40, 40]]], dtype=np.float32),
+            np.array([[[100, 100]], [[30, 40]]], dtype=np.float32),
+        ]
+        labels = [np.ones((3, 1), dtype=np.int32), np.array([[1], [0]], dtype=np.int32)]
+        masks = [rng.normal(size=(1, 256, 256)).astype(np.float32) for _ in range(2)]
+
+        self.assert_same_as_loop(point_coords_batch=points, point_labels_batch=labels,
+                                 box_batch=boxes, mask_input_batch=masks)
+        # 一部の画像だけにマスク入力がある場合
+        self.assert_same_as_loop(box_batch=boxes, mask_input_batch=[masks[0], None])
+        # 1画像・1プロンプトの場合
+        self.assert_same_as_loop(box_batch=[boxes[0][:1], boxes[1]],
+                                 mask_input_batch=[None, masks[1]])
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
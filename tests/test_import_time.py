@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""
+パッケージのインポート時間のテスト
+
+CLIの軽量なサブコマンド（`app.py frames` など）が torch / matplotlib /
+hydra などの重いライブラリを読み込まないことと、インポート時間が予算内に
+収まることを確認する。
+"""
+
+import unittest
+import os
+import sys
+import json
+import subprocess
+
+# プロジェクトルートを追加
+current_dir = os.path.dirname(os.path.abspath(__file__))
+project_root = os.path.dirname(current_dir)
+sys.path.insert(0, project_root)
+
+# 遅延インポートすべき重いモジュール
+HEAVY_MODULES = ["torch", "torchvision", "matplotlib", "PIL", "hydra", "omegaconf", "cv2", "decord"]
+
+# インポート時間の予算（秒）。numpy のみを読み込む想定で十分な余裕を持たせる
+IMPORT_TIME_BUDGET = 1.0
+
+_MEASURE_SCRIPT = """
+import json, sys, time
+sys.path.insert(0, {root!r})
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+print(json.dumps({{"elapsed": elapsed, "loaded": sorted(m for m in {heavy!r} if m in sys.modules)}}))
+"""
+
+
+def measure_import(module):
+    """
+    新しいPythonプロセスでモジュールをインポートし、時間と読み込まれた重いモジュールを返す
+
+    Args:
+        module (str): インポートするモジュール名
+
+    Returns:
+        dict: {"elapsed": 秒, "loaded": 読み込まれた重いモジュールのリスト}
+    """
+    script = _MEASURE_SCRIPT.format(root=project_root, module=module, heavy=HEAVY_MODULES)
+    result = subprocess.run(
+        [sys.executable, "-c", script],
+        cwd=project_root,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+class TestImportTime(unittest.TestCase):
+    """インポート時間予算のテストクラス"""
+
+    def assert_lightweight(self, module):
+        """重いモジュールを読み込まず、予算内でインポートできることを確認"""
+        result = measure_import(module)
+        self.assertEqual(result["loaded"], [], f"{module} が重いモジュールを読み込みました")
+        self.assertLess(
+            result["elapsed"], IMPORT_TIME_BUDGET,
+            f"{module} のインポートに {result['elapsed']:.2f}秒 かかりました"
+        )
+
+    def test_import_sam2_utils(self):
+        """src.sam2_utils のインポートが軽量であることのテスト"""
+        self.assert_lightweight("src.sam2_utils")
+
+    def test_import_app(self):
+        """app.py（CLIエントリーポイント）のインポートが軽量であることのテスト"""
+        self.assert_lightweight("app")
+
+    def test_import_video_to_frames(self):
+        """フレーム分割スクリプトのインポートが軽量であることのテスト"""
+        self.assert_lightweight("scripts.video_to_frames")
+
+    def test_import_sam2_package(self):
+        """sam2_package 本体のインポートで hydra を読み込まないことのテスト"""
+        self.assert_lightweight("sam2_package")
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
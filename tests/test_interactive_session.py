@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+"""
+対話的な追跡セッションのプール（src.interactive_session）のテスト
+"""
+
+import unittest
+import os
+import sys
+import threading
+import time
+
+# プロジェクトルートを追加
+current_dir = os.path.dirname(os.path.abspath(__file__))
+project_root = os.path.dirname(current_dir)
+sys.path.insert(0, project_root)
+
+from src.interactive_session import (
+    FRAME_BYTES, MODEL_BYTES,
+    InteractiveSession, InteractiveSessionPool, MemoryBudgetError, SessionBusyError, SessionLimitError,
+    estimate_session_bytes,
+)
+
+
+class FakeSession:
+    """ワーカープロセスを起動しない InteractiveSession の代わり"""
+
+    def __init__(self, memory_bytes, busy=False, idle=0):
+        self.memory_bytes = memory_bytes
+        self.busy = busy
+        self.last_used = time.monotonic() - idle
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+class TestInteractiveSessionPool(unittest.TestCase):
+    """InteractiveSessionPoolのテストクラス"""
+
+    def setUp(self):
+        """テスト前の準備（予算100バイト、アイドル60秒）"""
+        self.pool = InteractiveSessionPool(memory_budget=100, idle_timeout=60, sweep_interval=3600)
+
+    def tearDown(self):
+        """テスト後のクリーンアップ"""
+        self.pool.shutdown()
+
+    def add(self, key, *args, **kwargs):
+        session = FakeSession(*args, **kwargs)
+        self.pool._sessions[key] = session
+        return session
+
+    def test_estimate(self):
+        """メモリ量の見積もりのテスト"""
+        self.assertEqual(estimate_session_bytes(10, "tiny"), MODEL_BYTES["tiny"] + 10 * FRAME_BYTES)
+        self.assertEqual(estimate_session_bytes(0, "unknown"), MODEL_BYTES["large"])
+
+    def test_make_room_evicts_least_recently_used(self):
+        """予算を超える分だけ、最近使われていない順に破棄されることのテスト"""
+        a = self.add("a", 40)
+        b = self.add("b", 40)
+        self.add("c", 10)
+        self.assertIs(self.pool.get("a"), a)  # a を最新にする
+
+        evicted = self.pool._make_room(30)
+        self.assertEqual(evicted, [b])
+        self.assertEqual(list(self.pool._sessions), ["c", "a"])
+        self.assertEqual(self.pool.stats()["memory_bytes"], 50)
+
+    def test_busy_and_excluded_sessions_are_kept(self):
+        """実行中・除外指定のセッションは破棄されないことのテスト"""
+        self.add("busy", 50, busy=True)
+        self.add("mine", 40)
+        self.add("idle", 10)
+
+        with self.assertRaises(MemoryBudgetError):
+            self.pool._make_room(60, exclude="mine")
+        # 例外時は何も取り除かない
+        self.assertEqual(len(self.pool._sessions), 3)
+
+        evicted = self.pool._make_room(60, exclude="mine", strict=False)
+        self.assertEqual(len(evicted), 1)
+        self.assertEqual(list(self.pool._sessions), ["busy", "mine"])
+
+    def test_max_sessions(self):
+        """セッション数の上限を超える分だけ、実行中でないセッションが古い順に破棄されることのテスト"""
+        self.pool.max_sessions = 2
+        old = self.add("old", 10)
+        self.add("running", 10, busy=True)
+
+        evicted = self.pool._make_room(10)
+        self.assertEqual(evicted, [old])
+        self.assertEqual(list(self.pool._sessions), ["running"])
+        self.assertEqual(self.pool.stats()["max_sessions"], 2)
+
+        # 残りがすべて実行中なら上限を超えて起動しない
+        self.add("busy", 10, busy=True)
+        with self.assertRaises(SessionLimitError):
+            self.pool._make_room(10)
+        self.assertEqual(len(self.pool._sessions), 2)
+        # 起動済みのセッションの確認し直しでは、上限内なら何も破棄しない
+        self.assertEqual(self.pool._make_room(0, strict=False, new_sessions=0), [])
+
+    def test_evict_idle_and_close(self):
+        """アイドルなセッションの破棄と明示的な終了のテスト"""
+        old = self.add("old", 10, idle=120)
+        self.add("running", 10, busy=True, idle=120)
+        recent = self.add("recent", 10)
+
+        self.assertEqual(self.pool.evict_idle(), ["old"])
+        self.assertTrue(old.closed)
+
+        self.assertTrue(self.pool.close("recent"))
+        self.assertTrue(recent.closed)
+        self.assertFalse(self.pool.close("recent"))
+        self.assertIsNone(self.pool.get("recent"))
+        self.assertEqual(self.pool.stats()["sessions"], 1)
+
+
+
+class TestInteractiveSessionReserve(unittest.TestCase):
+    """別スレッドで実行するコマンドの確保（reserve）のテストクラス"""
+
+    def setUp(self):
+        """ワーカープロセスを起動せず、送ったコマンドをそのまま結果として返すセッションを作成"""
+        session = InteractiveSession.__new__(InteractiveSession)
+        session._lock = threading.Lock()
+        session.last_used = 0
+        sent = []
+        session._send = sent.append
+        session._receive = lambda on_frame, timeout: sent[-1][0]
+        self.session = session
+
+    def test_reserve_and_release(self):
+        """確保中は他のコマンドが受け付けられず、解放は確保した側が行うことのテスト"""
+        session = self.session
+        session.reserve()
+        self.assertTrue(session.busy)
+        with self.assertRaises(SessionBusyError):
+            session.reserve()
+        with self.assertRaises(SessionBusyError):
+            session.call("reset")
+
+        # 確保済みの実行では解放しない
+        self.assertEqual(session.call("propagate", reserved=True), "propagate")
+        self.assertTrue(session.busy)
+        session.release()
+        self.assertFalse(session.busy)
+
+        # 通常の実行は終了時に解放する
+        self.assertEqual(session.call("reset"), "reset")
+        self.assertFalse(session.busy)
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+"""
+ジョブスケジューラ（src.job_queue）のテスト
+"""
+
+import unittest
+import os
+import sys
+import time
+
+# プロジェクトルートを追加
+current_dir = os.path.dirname(os.path.abspath(__file__))
+project_root = os.path.dirname(current_dir)
+sys.path.insert(0, project_root)
+
+from src.job_queue import (
+    CANCELLED, DONE, FAILED, RUNNING, TIMEOUT,
+    JobScheduler, QueueFullError,
+)
+
+
+def add_job(a, b, progress_callback=None):
+    """進捗を2回報告してから和を返すジョブ"""
+    progress_callback(50, "計算中")
+    progress_callback(100, "完了")
+    return a + b
+
+
+def sleep_job(seconds, progress_callback=None):
+    """指定秒数だけ待つジョブ"""
+    time.sleep(seconds)
+    return seconds
+
+
+def failing_job(progress_callback=None):
+    """例外を送出するジョブ"""
+    raise ValueError("テスト用のエラー")
+
+
+def crashing_job(progress_callback=None):
+    """結果を返さずにプロセスごと終了するジョブ"""
+    os._exit(3)
+
+
+class TestJobScheduler(unittest.TestCase):
+    """JobSchedulerのテストクラス"""
+
+    def setUp(self):
+        """テスト前の準備"""
+        self.scheduler = JobScheduler(max_workers=1, max_queue_size=2, poll_interval=0.05)
+
+    def tearDown(self):
+        """テスト後のクリーンアップ"""
+        self.scheduler.shutdown()
+
+    def test_result_and_progress(self):
+        """結果と進捗がコールバックに渡されることのテスト"""
+        events = []
+        job = self.scheduler.submit(
+            add_job, 2, 3,
+            on_start=lambda j: events.append(("start", j.state)),
+            on_progress=lambda *values: events.append(("progress",) + values),
+            on_finish=lambda j: events.append(("finish", j.state, j.result)),
+        )
+        self.assertTrue(job.wait(60))
+        self.assertEqual(job.state, DONE)
+        self.assertEqual(job.result, 5)
+        self.assertEqual(events, [
+            ("start", RUNNING),
+            ("progress", 50, "計算中"),
+            ("progress", 100, "完了"),
+            ("finish", DONE, 5),
+        ])
+
+    def test_failure(self):
+        """例外と異常終了が失敗として報告されることのテスト"""
+        job = self.scheduler.submit(failing_job)
+        self.assertTrue(job.wait(60))
+        self.assertEqual(job.state, FAILED)
+        self.assertIn("テスト用のエラー", job.error)
+
+        job = self.scheduler.submit(crashing_job)
+        self.assertTrue(job.wait(60))
+        self.assertEqual(job.state, FAILED)
+        self.assertIn("終了コード 3", job.error)
+
+    def test_queue_position_and_limit(self):
+        """待ち順番・優先度・キュー上限のテスト"""
+        running = self.scheduler.submit(sleep_job, 30)
+        deadline = time.time() + 60
+        while running.state != RUNNING and time.time() < deadline:
+            time.sleep(0.05)
+        self.assertEqual(running.state, RUNNING)
+        self.assertIsNone(self.scheduler.position(running))
+
+        low = self.scheduler.submit(sleep_job, 0, priority=1)
+        high = self.scheduler.submit(sleep_job, 0, priority=0)
+        self.assertEqual(self.scheduler.position(high), 1)
+        self.assertEqual(self.scheduler.position(low), 2)
+        self.assertEqual(self.scheduler.stats()["queued"], 2)
+
+        with self.assertRaises(QueueFullError):
+            self.scheduler.submit(sleep_job, 0)
+
+        # 待ち中のキャンセルで後続の順番が繰り上がる
+        self.assertTrue(self.scheduler.cancel(high))
+        self.assertEqual(high.state, CANCELLED)
+        self.assertEqual(self.scheduler.position(low), 1)
+
+        # 実行中のキャンセルでワーカープロセスが止まり、次のジョブが実行される
+        self.assertTrue(self.scheduler.cancel(running))
+        self.assertFalse(running._process.is_alive())
+        self.assertFalse(self.scheduler.cancel(running))
+        self.assertTrue(low.wait(60))
+        self.assertEqual(low.state, DONE)
+
+    def test_timeout(self):
+        """実行時間がタイムアウトを超えたジョブが停止されることのテスト"""
+        job = self.scheduler.submit(sleep_job, 30, timeout=0.5)
+        self.assertTrue(job.wait(60))
+        self.assertEqual(job.state, TIMEOUT)
+        self.assertFalse(job._process.is_alive())
+        self.assertLess(job.finished_at - job.started_at, 10)
+
+
+    def test_cancel_before_on_start(self):
+        """起動直後（on_start の前）にキャンセルされたジョブでは on_start が呼ばれないことのテスト"""
+        scheduler = CancelOnStartScheduler(max_workers=1, poll_interval=0.05)
+        events = []
+        try:
+            job = scheduler.submit(
+                sleep_job, 30,
+                on_start=lambda j: events.append("start"),
+                on_finish=lambda j: events.append(("finish", j.state)),
+            )
+            self.assertTrue(job.wait(60))
+            time.sleep(0.2)
+        finally:
+            scheduler.shutdown()
+        self.assertEqual(job.state, CANCELLED)
+        self.assertEqual(events, [("finish", CANCELLED)])
+
+
+class CancelOnStartScheduler(JobScheduler):
+    """ワーカーの起動直後、on_start を呼ぶ前にジョブをキャンセルするスケジューラ"""
+
+    def _start(self, job):
+        super()._start(job)
+        self.cancel(job)
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
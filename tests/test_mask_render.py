@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+"""
+結果画像の描画（src.mask_render）のテスト
+"""
+
+import unittest
+import os
+import sys
+import shutil
+import tempfile
+import numpy as np
+import cv2
+
+# プロジェクトルートを追加
+current_dir = os.path.dirname(os.path.abspath(__file__))
+project_root = os.path.dirname(current_dir)
+sys.path.insert(0, project_root)
+
+from src.mask_render import (
+    blend_masks, draw_points, mask_color, save_frames_with_masks, VideoResultWriter, POSITIVE_COLOR
+)
+from src.mask_store import MaskStore
+from src.sam2_utils import show_mask
+
+
+def make_masks(height=48, width=64):
+    """左半分と下半分を覆う2オブジェクトのマスク（SAM2と同じ (1, H, W) 形式）"""
+    left = np.zeros((1, height, width), dtype=bool)
+    left[:, :, :width // 2] = True
+    bottom = np.zeros((1, height, width), dtype=bool)
+    bottom[:, height // 2:, :] = True
+    return {1: left, 3: bottom}
+
+
+class TestMaskRender(unittest.TestCase):
+    """マスク・座標点の描画のテストクラス"""
+
+    def setUp(self):
+        """テスト前の準備"""
+        rng = np.random.default_rng(0)
+        self.image = rng.integers(0, 256, (48, 64, 3), dtype=np.uint8)
+
+    def test_matches_matplotlib(self):
+        """matplotlib の show_mask で重ねた結果と同じになることのテスト"""
+        import matplotlib
+        matplotlib.use("Agg")
+        import matplotlib.pyplot as plt
+
+        masks = make_masks()
+        height, width = self.image.shape[:2]
+        fig = plt.figure(figsize=(width / 100, height / 100), dpi=100)
+        ax = fig.add_axes([0, 0, 1, 1])
+        ax.axis("off")
+        ax.imshow(cv2.cvtColor(self.image, cv2.COLOR_BGR2RGB), interpolation="nearest")
+        for obj_id, mask in masks.items():
+            show_mask(mask, ax, obj_id=obj_id)
+        fig.canvas.draw()
+        expected = np.asarray(fig.canvas.buffer_rgba())[:, :, :3]
+        plt.close(fig)
+
+        result = cv2.cvtColor(blend_masks(self.image, masks), cv2.COLOR_BGR2RGB)
+        self.assertEqual(result.shape, expected.shape)
+        self.assertLessEqual(np.abs(result.astype(int) - expected.astype(int)).max(), 2)
+
+    def test_blend_order_and_unmasked_pixels(self):
+        """マスク外は元のまま、重なった部分は後のオブジェクトが上になることのテスト"""
+        result = blend_masks(self.image, make_masks())
+
+        np.testing.assert_array_equal(result[:24, 32:], self.image[:24, 32:])
+        overlap = self.image[30, 10].astype(np.float32)
+        first = overlap * 0.4 + mask_color(1) * 0.6
+        expected = np.rint(first * 0.4 + mask_color(3) * 0.6)
+        np.testing.assert_allclose(result[30, 10], expected, atol=1)
+
+        # 10以上のIDは tab10 の最後の色
+        np.testing.assert_array_equal(mask_color(12), mask_color(9))
+
+    def test_draw_points(self):
+        """座標点の位置に星が描画されることのテスト"""
+        image = np.zeros((200, 300, 3), dtype=np.uint8)
+        draw_points(image, np.array([[100, 80], [250, 150]]), np.array([1, 0]))
+
+        self.assertEqual(tuple(image[80, 100]), POSITIVE_COLOR)
+        self.assertGreater(image[150, 250, 2], 200)
+        self.assertEqual(tuple(image[10, 10]), (0, 0, 0))
+
+
+class TestSaveFramesWithMasks(unittest.TestCase):
+    """複数フレームの保存のテストクラス"""
+
+    def setUp(self):
+        """テスト前の準備"""
+        self.temp_dir = tempfile.mkdtemp()
+        self.video_dir = os.path.join(self.temp_dir, "frames")
+        os.makedirs(self.video_dir)
+        self.frame_names = [f"{i:05d}.jpg" for i in range(6)]
+        for i, name in enumerate(self.frame_names):
+            cv2.imwrite(os.path.join(self.video_dir, name), np.full((48, 64, 3), i * 40, dtype=np.uint8))
+        # 最後のフレームは結果なし
+        self.video_segments = {i: make_masks() for i in range(5)}
+
+    def tearDown(self):
+        """テスト後のクリーンアップ"""
+        shutil.rmtree(self.temp_dir)
+
+    def save(self, name, num_workers, video_segments=None):
+        """フレームを保存し、保存順のインデックスを返す"""
+        points = {0: (np.array([[20.0, 20.0]]), np.array([1]))}
+        output_dir = os.path.join(self.temp_dir, name)
+        if video_segments is None:
+            video_segments = self.video_segments
+        return list(save_frames_with_masks(self.video_dir, self.frame_names, video_segments,
+                                           output_dir, points_by_frame=points, num_workers=num_workers))
+
+    def test_parallel_matches_serial(self):
+        """並列に描画しても、同じ解像度・同じ内容の画像がフレーム順に保存されることのテスト"""
+        self.assertEqual(self.save("serial", 1), list(range(6)))
+        self.assertEqual(self.save("parallel", 2), list(range(6)))
+
+        for name in self.frame_names:
+            serial = cv2.imread(os.path.join(self.temp_dir, "serial", name))
+            parallel = cv2.imread(os.path.join(self.temp_dir, "parallel", name))
+            self.assertEqual(serial.shape, (48, 64, 3))
+            np.testing.assert_array_equal(serial, parallel)
+
+        # 結果のないフレームは元画像のまま
+        last = cv2.imread(os.path.join(self.temp_dir, "serial", self.frame_names[-1]))
+        self.assertAlmostEqual(last.mean(), 200, delta=2)
+
+    def test_mask_store(self):
+        """MaskStore を渡した場合（RLEのままワーカーに送る）も同じ画像になることのテスト"""
+        self.save("dict", 1)
+        with MaskStore.from_segments(self.video_segments, memmap=True) as store:
+            self.assertEqual(self.save("store", 2, store), list(range(6)))
+
+        for name in self.frame_names:
+            expected = cv2.imread(os.path.join(self.temp_dir, "dict", name))
+            np.testing.assert_array_equal(cv2.imread(os.path.join(self.temp_dir, "store", name)), expected)
+
+    def test_video_writer(self):
+        """結果のないフレームも含め、元動画と同じフレーム数・FPSの動画が書き込まれることのテスト"""
+        output_path = os.path.join(self.temp_dir, "out", "tracked.mp4")
+        with VideoResultWriter(output_path, self.video_dir, self.frame_names, 12.0) as writer:
+            # 伝播がフレーム1から始まった場合（フレーム0は結果なし）
+            for frame_idx in (1, 2, 4):
+                writer.write(frame_idx, self.video_segments[frame_idx])
+            with self.assertRaises(ValueError):
+                writer.write(2, self.video_segments[2])
+
+        cap = cv2.VideoCapture(output_path)
+        self.assertEqual(cap.get(cv2.CAP_PROP_FPS), 12.0)
+        frames = []
+        while True:
+            ret, frame = cap.read()
+            if not ret:
+                break
+            frames.append(frame)
+        cap.release()
+
+        self.assertEqual(len(frames), 6)
+        self.assertEqual(frames[0].shape, (48, 64, 3))
+        # フレーム0・3はマスクなし、フレーム1は左上にオブジェクト1の色が重なる
+        self.assertLess(frames[0].mean(), 4)
+        self.assertAlmostEqual(frames[3].mean(), 120, delta=4)
+        np.testing.assert_allclose(frames[1][10, 10], np.rint(40 * 0.4 + mask_color(1) * 0.6), atol=8)
+
+    def test_video_writer_removes_partial_file(self):
+        """書き込み中に失敗した場合、途中までの動画が残らないことのテスト"""
+        output_path = os.path.join(self.temp_dir, "tracked.mp4")
+        with self.assertRaises(RuntimeError):
+            with VideoResultWriter(output_path, self.video_dir, self.frame_names, 12.0) as writer:
+                writer.write(0, self.video_segments[0])
+                raise RuntimeError("追跡エラー")
+        self.assertFalse(os.path.exists(output_path))
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+"""
+マスクストア（src.mask_store）のテスト
+"""
+
+import unittest
+import os
+import sys
+import numpy as np
+
+# プロジェクトルートを追加
+current_dir = os.path.dirname(os.path.abspath(__file__))
+project_root = os.path.dirname(current_dir)
+sys.path.insert(0, project_root)
+
+from src.mask_store import MaskStore
+from src.sam2_utils import mask_to_rle
+
+
+def make_segments(num_frames=4, height=40, width=60):
+    """フレームごとに位置が変わる円と、1フレームおきの矩形（SAM2と同じ (1, H, W) 形式）"""
+    yy, xx = np.ogrid[:height, :width]
+    segments = {}
+    for i in range(num_frames):
+        circle = (yy - 20) ** 2 + (xx - 10 - i * 5) ** 2 < 64
+        segments[i] = {0: circle[None]}
+        if i % 2 == 0:
+            rect = np.zeros((1, height, width), dtype=bool)
+            rect[:, 5:15, 30:50] = True
+            segments[i][3] = rect
+    return segments
+
+
+class TestMaskStore(unittest.TestCase):
+    """MaskStoreのテストクラス"""
+
+    def setUp(self):
+        """テスト前の準備"""
+        self.segments = make_segments()
+
+    def check_store(self, store):
+        """元のマスクと同じ内容を取り出せることを確認"""
+        self.assertEqual(len(store), 4)
+        self.assertEqual(list(store), [0, 1, 2, 3])
+        self.assertEqual(store.shape, (40, 60))
+        self.assertEqual(store.obj_ids(1), [0])
+        self.assertEqual(store.obj_ids(2), [0, 3])
+        self.assertEqual(store.obj_ids(10), [])
+
+        for frame_idx, frame_masks in self.segments.items():
+            for obj_id, mask in frame_masks.items():
+                np.testing.assert_array_equal(store.mask(frame_idx, obj_id), mask[0])
+                self.assertEqual(store.area(frame_idx, obj_id), mask.sum())
+                self.assertEqual(store.rle(frame_idx, obj_id), mask_to_rle(mask))
+
+        # {frame_idx: {obj_id: マスク}} の辞書として読める
+        self.assertIn(2, store)
+        self.assertNotIn(10, store)
+        self.assertIsNone(store.get(10))
+        np.testing.assert_array_equal(store[2][3], self.segments[2][3][0])
+        with self.assertRaises(KeyError):
+            store.mask(1, 3)
+
+    def test_in_memory(self):
+        """メモリ上のストアのテスト"""
+        store = MaskStore.from_segments(self.segments)
+        self.check_store(store)
+        # bool 配列より十分小さい
+        self.assertLess(store.nbytes, sum(m.nbytes for f in self.segments.values() for m in f.values()) / 4)
+
+    def test_memmap(self):
+        """一時ファイルに書き込むストアのテスト（追記の途中でも読み出せ、close で削除される）"""
+        with MaskStore(memmap=True) as store:
+            path = store.path
+            for frame_idx, frame_masks in self.segments.items():
+                store.add_frame(frame_idx, frame_masks)
+                np.testing.assert_array_equal(store.mask(frame_idx, 0), frame_masks[0][0])
+            self.assertTrue(os.path.exists(path))
+            self.assertEqual(os.path.getsize(path), store.nbytes)
+            self.check_store(store)
+        self.assertFalse(os.path.exists(path))
+
+    def test_edge_cases(self):
+        """空・全面のマスクと、大きさの異なるマスクのテスト"""
+        store = MaskStore()
+        store.add(0, 1, np.zeros((8, 6), dtype=bool))
+        store.add(0, 2, np.ones((8, 6), dtype=bool))
+        self.assertEqual(store.area(0, 1), 0)
+        self.assertEqual(store.area(0, 2), 48)
+        self.assertTrue(store.mask(0, 2).all())
+        with self.assertRaises(ValueError):
+            store.add(1, 1, np.zeros((6, 8), dtype=bool))
+
+    def test_analyze_results(self):
+        """analyze_results がストアからカバレッジを求めることのテスト"""
+        from src.sam2_video_tracker import SAM2VideoTracker
+
+        # analyze_results はモデルを使わないため、モデルを読み込まずに作成する
+        tracker = SAM2VideoTracker.__new__(SAM2VideoTracker)
+        store = MaskStore.from_segments(self.segments)
+        analysis = tracker.analyze_results(store, [f"{i:05d}.jpg" for i in range(5)])
+
+        self.assertEqual(analysis["total_frames"], 5)
+        self.assertEqual(analysis["processed_frames"], 4)
+        self.assertEqual(analysis["objects_detected"], {0: 4, 3: 2})
+        self.assertAlmostEqual(analysis["mask_coverage"][0][3], 200 / 2400 * 100)
+
+        # 従来の辞書を渡しても同じ結果になる
+        self.assertEqual(tracker.analyze_results(self.segments, [f"{i:05d}.jpg" for i in range(5)]), analysis)
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
@@ -15,7 +15,7 @@ current_dir = os.path.dirname(os.path.abspath(__file__))
 project_root = os.path.dirname(current_dir)
 sys.path.insert(0, project_root)
 
-from src.sam2_utils import get_frame_names, show_points, show_mask
+from src.sam2_utils import get_frame_names, show_points, show_mask, resolve_model_config, mask_to_rle, rle_to_mask
 
 
 class TestSAM2Utils(unittest.TestCase):
@@ -123,6 +123,53 @@ class TestVideoToFrames(unittest.TestCase):
         self.assertTrue(import_success, "video_to_frames関数をインポートできませんでした")
 
 
+class TestMaskToRLE(unittest.TestCase):
+    """マスクのRLE変換のテストクラス"""
+    
+    def test_roundtrip(self):
+        """列優先のRLEに変換して元に戻せることのテスト"""
+        mask = np.random.RandomState(0).rand(7, 5) > 0.5
+        mask[0, 0] = True
+        rle = mask_to_rle(mask[None])
+        self.assertEqual(rle["size"], [7, 5])
+        self.assertEqual(rle["counts"][0], 0)
+        np.testing.assert_array_equal(rle_to_mask(rle), mask)
+        self.assertEqual(sum(rle["counts"][1::2]), mask.sum())
+    
+    def test_empty_and_full(self):
+        """全0・全1のマスクのテスト"""
+        self.assertEqual(mask_to_rle(np.zeros((3, 4), dtype=bool))["counts"], [12])
+        self.assertEqual(mask_to_rle(np.ones((3, 4), dtype=bool))["counts"], [0, 12])
+        np.testing.assert_array_equal(rle_to_mask({"size": [3, 4], "counts": [12]}), np.zeros((3, 4), dtype=bool))
+        np.testing.assert_array_equal(rle_to_mask({"size": [3, 4], "counts": [0, 12]}), np.ones((3, 4), dtype=bool))
+
+
+class TestResolveModelConfig(unittest.TestCase):
+    """モデル設定名の解決のテストクラス"""
+    
+    def test_config_name(self):
+        """パッケージ内の設定名はそのまま使われることのテスト"""
+        name = "configs/sam2.1/sam2.1_hiera_t.yaml"
+        self.assertEqual(resolve_model_config(name), name)
+    
+    def test_absolute_path(self):
+        """configs/ 以下の絶対パスが作業ディレクトリに依存せず設定名に変換されることのテスト"""
+        path = os.path.join(project_root, "configs", "sam2", "sam2_hiera_s.yaml")
+        original_cwd = os.getcwd()
+        try:
+            os.chdir(tempfile.gettempdir())
+            self.assertEqual(resolve_model_config(path), "configs/sam2/sam2_hiera_s.yaml")
+        finally:
+            os.chdir(original_cwd)
+    
+    def test_missing_config(self):
+        """存在しない設定でFileNotFoundErrorになることのテスト"""
+        with self.assertRaises(FileNotFoundError):
+            resolve_model_config("configs/sam2.1/missing.yaml")
+        with self.assertRaises(FileNotFoundError):
+            resolve_model_config(os.path.join(tempfile.gettempdir(), "model.yaml"))
+
+
 if __name__ == "__main__":
     # テストを実行
     print("SAM2ユーティリティ関数のテストを開始...")
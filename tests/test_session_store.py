@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+"""
+セッションストア（src.session_store）のテスト
+"""
+
+import unittest
+import os
+import sys
+import shutil
+import tempfile
+import time
+
+# プロジェクトルートを追加
+current_dir = os.path.dirname(os.path.abspath(__file__))
+project_root = os.path.dirname(current_dir)
+sys.path.insert(0, project_root)
+
+from src.session_store import SessionStore
+
+
+class FakeSession:
+    """テスト用のセッション（アップロード動画を1つ持つ）"""
+
+    def __init__(self, session_id, video_path=None, status="uploaded", active=False):
+        self.session_id = session_id
+        self.video_path = video_path
+        self.status = status
+        self.active = active
+
+    def to_metadata(self):
+        return {"session_id": self.session_id, "video_path": self.video_path, "status": self.status}
+
+    @classmethod
+    def from_metadata(cls, metadata):
+        return cls(metadata["session_id"], metadata["video_path"], metadata["status"])
+
+    def artifact_paths(self):
+        return [self.video_path] if self.video_path else []
+
+
+class TestSessionStore(unittest.TestCase):
+    """SessionStoreのテストクラス"""
+
+    def setUp(self):
+        """テスト前の準備"""
+        self.temp_dir = tempfile.mkdtemp()
+        self.root = os.path.join(self.temp_dir, "web_results")
+        self.upload_dir = os.path.join(self.temp_dir, "web_uploads")
+        os.makedirs(self.upload_dir)
+        self.evicted = []
+
+    def tearDown(self):
+        """テスト後のクリーンアップ"""
+        shutil.rmtree(self.temp_dir)
+
+    def make_store(self, **kwargs):
+        """バックグラウンドの確認なしでストアを作成"""
+        options = dict(ttl=60, sweep_interval=0, upload_dir=self.upload_dir,
+                       is_active=lambda session: session.active, on_evict=self.evicted.append)
+        options.update(kwargs)
+        return SessionStore(self.root, FakeSession.from_metadata, **options)
+
+    def add_session(self, store, session_id, size, **kwargs):
+        """size バイトのアップロード動画を持つセッションを追加"""
+        video_path = os.path.join(self.upload_dir, f"{session_id}.mp4")
+        with open(video_path, "wb") as f:
+            f.write(b"\0" * size)
+        session = FakeSession(session_id, video_path, **kwargs)
+        store[session_id] = session
+        return session
+
+    def test_ttl_expiry(self):
+        """期限切れのセッションが成果物ごと破棄され、実行中のセッションは残ることのテスト"""
+        store = self.make_store()
+        old = self.add_session(store, "old", 10)
+        self.add_session(store, "running", 10, active=True)
+        self.add_session(store, "recent", 10)
+        for session_id in ("old", "running"):
+            store._last_access[session_id] -= 120
+
+        self.assertEqual(store.sweep(), ["old"])
+        self.assertEqual(self.evicted, [old])
+        self.assertNotIn("old", store)
+        self.assertFalse(os.path.exists(old.video_path))
+        self.assertFalse(os.path.exists(os.path.join(self.root, "old")))
+        self.assertEqual(len(store), 2)
+        self.assertEqual(store.stats()["evictions"]["ttl"], 1)
+
+    def test_disk_quota_lru(self):
+        """容量超過時に最近使われていない順に破棄されることのテスト"""
+        store = self.make_store(disk_quota=2500)
+        for session_id in ("a", "b", "c"):
+            self.add_session(store, session_id, 1000)
+            time.sleep(0.01)
+        store["a"]  # a を最近使ったことにする
+
+        self.assertEqual(store.sweep(), ["b"])
+        self.assertEqual(sorted(s.session_id for s in store.values()), ["a", "c"])
+        stats = store.stats()
+        self.assertEqual(stats["evictions"]["quota"], 1)
+        self.assertGreaterEqual(stats["bytes"], 2000)
+
+    def test_persistence_and_orphans(self):
+        """再起動後にセッションが復元され、管理外の古いファイルが削除されることのテスト"""
+        store = self.make_store()
+        session = self.add_session(store, "kept", 10)
+        session.status = "completed"
+        store.sweep()
+        store.shutdown()
+
+        # どのセッションにも属さないファイル（古いものだけ削除される）
+        old_orphan = os.path.join(self.upload_dir, "old.mp4")
+        new_orphan = os.path.join(self.upload_dir, "new.mp4")
+        old_dir = os.path.join(self.root, "legacy")
+        for path in (old_orphan, new_orphan):
+            open(path, "wb").close()
+        os.makedirs(old_dir)
+        past = time.time() - 3600
+        os.utime(old_orphan, (past, past))
+        os.utime(old_dir, (past, past))
+
+        restored = self.make_store()
+        self.assertIn("kept", restored)
+        self.assertEqual(restored["kept"].status, "completed")
+        self.assertTrue(os.path.exists(session.video_path))
+        self.assertFalse(os.path.exists(old_orphan))
+        self.assertFalse(os.path.exists(old_dir))
+        self.assertTrue(os.path.exists(new_orphan))
+        self.assertEqual(restored.stats()["evictions"]["orphans"], 2)
+
+        del restored["kept"]
+        self.assertNotIn("kept", restored)
+        self.assertFalse(os.path.exists(session.video_path))
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+"""
+タイル分割による高解像度画像の予測（sam2.sam2_tiled_image_predictor）のテスト
+"""
+
+import unittest
+import os
+import sys
+import numpy as np
+import torch
+
+# プロジェクトルートを追加
+current_dir = os.path.dirname(os.path.abspath(__file__))
+project_root = os.path.dirname(current_dir)
+sys.path.insert(0, project_root)
+
+from src.sam2_utils import _import_sam2_package
+
+_import_sam2_package()
+from sam2.sam2_tiled_image_predictor import SAM2TiledImagePredictor, generate_tile_boxes
+
+
+class FakeImagePredictor:
+    """タイルごとに、タイル全面で値が (バッチ内の順番 + 1) のロジットを返す予測器"""
+
+    def set_features(self, image_embed, high_res_feats, orig_hw):
+        self.orig_hw = orig_hw
+
+    def predict_batch(self, point_coords_batch=None, point_labels_batch=None, box_batch=None,
+                      multimask_output=True, return_logits=False):
+        num_masks = 3 if multimask_output else 1
+        masks = [np.full((num_masks, h, w), float(i + 1), dtype=np.float32)
+                 for i, (h, w) in enumerate(self.orig_hw)]
+        ious = [np.full(num_masks, 0.5, dtype=np.float32) for _ in self.orig_hw]
+        return masks, ious, None
+
+    def reset_predictor(self):
+        pass
+
+
+def make_tiled_predictor(im_size, tile_size=1024, tile_overlap=256):
+    """モデルを読み込まずに、タイルの分割だけを設定した予測器を作成"""
+    predictor = SAM2TiledImagePredictor.__new__(SAM2TiledImagePredictor)
+    predictor.tile_size = tile_size
+    predictor.tile_overlap = tile_overlap
+    predictor.mask_threshold = 0.0
+    predictor.predictor = FakeImagePredictor()
+    predictor._image = np.zeros((*im_size, 3), dtype=np.uint8)
+    predictor._orig_hw = im_size
+    predictor.tile_boxes = generate_tile_boxes(im_size, tile_size, tile_overlap)
+
+    def embed_tiles(tile_idxs):
+        features = []
+        for tile_idx in tile_idxs:
+            x0, y0, x1, y1 = predictor.tile_boxes[tile_idx]
+            features.append({
+                "image_embed": torch.zeros(1, 1),
+                "high_res_feats": [torch.zeros(1, 1)],
+                "orig_hw": [(y1 - y0, x1 - x0)],
+            })
+        return features
+
+    predictor._embed_tiles = embed_tiles
+    return predictor
+
+
+class TestGenerateTileBoxes(unittest.TestCase):
+    """generate_tile_boxes のテストクラス"""
+
+    def test_coverage_and_overlap(self):
+        """タイルが画像全体を覆い、隣り合うタイルが overlap 以上重なることのテスト"""
+        im_h, im_w = 3000, 4000
+        boxes = np.array(generate_tile_boxes((im_h, im_w), 1024, 256))
+
+        covered = np.zeros((im_h, im_w), dtype=bool)
+        for x0, y0, x1, y1 in boxes:
+            self.assertLessEqual(x1 - x0, 1024)
+            self.assertLessEqual(y1 - y0, 1024)
+            covered[y0:y1, x0:x1] = True
+        self.assertTrue(covered.all())
+
+        xs = np.unique(boxes[:, [0, 2]], axis=0)
+        ys = np.unique(boxes[:, [1, 3]], axis=0)
+        for starts_ends in (xs, ys):
+            self.assertGreaterEqual((starts_ends[:-1, 1] - starts_ends[1:, 0]).min(), 256)
+        self.assertEqual(xs[-1, 1], im_w)
+        self.assertEqual(ys[-1, 1], im_h)
+
+    def test_image_smaller_than_tile(self):
+        """タイルより小さい画像・辺は1枚のタイルになることのテスト"""
+        self.assertEqual(generate_tile_boxes((600, 800), 1024, 256), [[0, 0, 800, 600]])
+        boxes = generate_tile_boxes((600, 2000), 1024, 256)
+        self.assertEqual([b[1::2] for b in boxes], [[0, 600]] * 3)
+        self.assertEqual(boxes[-1][2], 2000)
+
+
+class TestRoutePrompt(unittest.TestCase):
+    """プロンプトのタイルへの割り当てのテストクラス"""
+
+    def setUp(self):
+        """テスト前の準備"""
+        self.predictor = make_tiled_predictor((4000, 4000))
+
+    def route(self, points, labels, box=None):
+        """プロンプトを割り当てたタイルのボックスを返す"""
+        points = np.array(points, dtype=np.float32) if points is not None else None
+        labels = np.array(labels) if labels is not None else None
+        box = np.array(box, dtype=np.float32) if box is not None else None
+        tile_idxs = self.predictor._route_prompt(points, labels, box)
+        return [self.predictor.tile_boxes[i] for i in tile_idxs]
+
+    def test_single_tile(self):
+        """1枚のタイルに収まるプロンプトは、最も中央に近いタイルに割り当てられることのテスト"""
+        self.assertEqual(self.route([[1000, 1000]], [1]), [[744, 744, 1768, 1768]])
+        # 背景点だけでも1枚に収まれば割り当てられる
+        self.assertEqual(self.route([[10, 10], [20, 30]], [0, 0]), [[0, 0, 1024, 1024]])
+        # 前景点だけで位置を決める（タイル外の背景点は無視）
+        self.assertEqual(self.route([[100, 100], [3900, 3900]], [1, 0]), [[0, 0, 1024, 1024]])
+
+    def test_spanning_tiles(self):
+        """1枚に収まらないプロンプトは、前景点・ボックスを含むタイルに割り当てられることのテスト"""
+        # 前景点を含むタイルだけを使う
+        self.assertEqual(self.route([[10, 10], [3900, 10]], [1, 1]),
+                         [[0, 0, 1024, 1024], [2976, 0, 4000, 1024]])
+        # ボックスは重なるタイルすべて
+        boxes = self.route(None, None, box=[10, 10, 1900, 500])
+        self.assertEqual(boxes, [[0, 0, 1024, 1024], [744, 0, 1768, 1024], [1488, 0, 2512, 1024]])
+
+    def test_background_only(self):
+        """1枚に収まらない背景点だけのプロンプトはエラーになることのテスト"""
+        with self.assertRaises(ValueError):
+            self.route([[10, 10], [3900, 3900]], [0, 0])
+        with self.assertRaises(ValueError):
+            self.predictor.predict(np.array([[10, 10], [3900, 3900]]), np.array([0, 0]))
+
+
+class TestTiledPredict(unittest.TestCase):
+    """タイルの結果の統合のテストクラス"""
+
+    def test_masks_cover_only_used_tiles(self):
+        """マスクは使ったタイルを囲む範囲だけで返されることのテスト"""
+        predictor = make_tiled_predictor((4000, 4000))
+        # 左端の点はタイル0、x=1500 の点はタイル1・2に含まれる
+        points = np.array([[10, 10], [1500, 10]])
+
+        logits, ious, crop_box = predictor.predict(points, np.array([1, 1]), return_logits=True)
+        self.assertEqual(crop_box, [0, 0, 2512, 1024])
+        self.assertEqual(logits.shape, (1, 1024, 2512))
+        self.assertEqual(logits.dtype, np.float32)
+        # 重なった部分は大きい方（後のタイル）のロジット
+        self.assertEqual(logits[0, 0, 500], 1.0)
+        self.assertEqual(logits[0, 0, 900], 2.0)
+        self.assertEqual(logits[0, 0, 2500], 3.0)
+        np.testing.assert_allclose(ious, [0.5])
+
+        masks, _, mask_box = predictor.predict(points, np.array([1, 1]))
+        self.assertEqual(mask_box, crop_box)
+        self.assertEqual(masks.dtype, bool)
+        self.assertTrue(masks.all())
+
+    def test_single_tile_multimask(self):
+        """1枚のタイルに収まるプロンプトは、そのタイルの範囲で複数マスクを返すことのテスト"""
+        predictor = make_tiled_predictor((4000, 4000))
+        masks, ious, crop_box = predictor.predict(np.array([[1000, 1000]]), np.array([1]))
+        self.assertEqual(crop_box, [744, 744, 1768, 1768])
+        self.assertEqual(masks.shape, (3, 1024, 1024))
+        self.assertEqual(ious.shape, (3,))
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+"""
+動画のフレーム分割（scripts.video_to_frames）のテスト
+"""
+
+import unittest
+import os
+import sys
+import shutil
+import tempfile
+import threading
+import time
+import numpy as np
+import cv2
+
+# プロジェクトルートを追加
+current_dir = os.path.dirname(os.path.abspath(__file__))
+project_root = os.path.dirname(current_dir)
+sys.path.insert(0, project_root)
+
+from scripts.video_to_frames import (
+    video_to_frames, video_to_frames_streaming, can_decode_partial, read_video_fps, DEFAULT_FPS
+)
+
+
+def write_video(path, fourcc, num_frames=30):
+    """フレームごとに明るさが変わるテスト用動画を作成"""
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*fourcc), 10, (96, 64))
+    for i in range(num_frames):
+        writer.write(np.full((64, 96, 3), i * 8, dtype=np.uint8))
+    writer.release()
+
+
+class TestVideoToFramesStreaming(unittest.TestCase):
+    """書き込み途中の動画のフレーム分割のテストクラス"""
+
+    def setUp(self):
+        """テスト前の準備"""
+        self.temp_dir = tempfile.mkdtemp()
+        self.growing_path = os.path.join(self.temp_dir, "growing.bin")
+        self.complete = threading.Event()
+
+    def tearDown(self):
+        """テスト後のクリーンアップ"""
+        shutil.rmtree(self.temp_dir)
+
+    def upload(self, source, chunks=10, interval=0.1):
+        """source を少しずつ growing_path に書き込むスレッドを開始"""
+        data = open(source, "rb").read()
+        step = len(data) // chunks + 1
+
+        def run():
+            with open(self.growing_path, "wb") as f:
+                for start in range(0, len(data), step):
+                    f.write(data[start:start + step])
+                    f.flush()
+                    time.sleep(interval)
+            self.complete.set()
+
+        thread = threading.Thread(target=run)
+        thread.start()
+        return thread
+
+    def extract(self, name, **kwargs):
+        """growing_path をフレーム分割し、(フレーム数, 完了前に書き出したフレーム数) を返す"""
+        written_before_complete = []
+
+        def on_frame(frame_count):
+            if not self.complete.is_set():
+                written_before_complete.append(frame_count)
+
+        frame_count = video_to_frames_streaming(
+            self.growing_path, os.path.join(self.temp_dir, name), self.complete.is_set,
+            poll_interval=0.02, frame_callback=on_frame, **kwargs
+        )
+        return frame_count, len(written_before_complete)
+
+    def assert_same_frames(self, source, name, frame_count):
+        """一括変換と同じフレームが書き出されていることを確認"""
+        expected_dir = os.path.join(self.temp_dir, "expected")
+        self.assertEqual(video_to_frames(source, expected_dir), frame_count)
+        self.assertEqual(sorted(os.listdir(expected_dir)), sorted(os.listdir(os.path.join(self.temp_dir, name))))
+        for i in (0, frame_count - 1):
+            frame = cv2.imread(os.path.join(self.temp_dir, name, f"{i:05d}.jpg"))
+            self.assertAlmostEqual(frame.mean(), i * 8, delta=3)
+
+    def test_frames_are_written_during_upload(self):
+        """MKVなど途中から読める形式では、書き込み中にフレームが書き出されることのテスト"""
+        source = os.path.join(self.temp_dir, "source.mkv")
+        write_video(source, "MJPG")
+
+        thread = self.upload(source)
+        frame_count, early = self.extract("frames")
+        thread.join()
+
+        self.assertEqual(frame_count, 30)
+        self.assertGreater(early, 0)
+        self.assertLess(early, 30)
+        self.assert_same_frames(source, "frames", frame_count)
+
+        # 元動画のFPSがフレームと一緒に記録される
+        self.assertEqual(read_video_fps(os.path.join(self.temp_dir, "frames")), 10)
+        self.assertEqual(read_video_fps(self.temp_dir), DEFAULT_FPS)
+
+    def test_index_at_end(self):
+        """インデックスが末尾にあるMP4は、完了後にまとめて変換されることのテスト"""
+        source = os.path.join(self.temp_dir, "source.mp4")
+        write_video(source, "mp4v")
+
+        thread = self.upload(source, chunks=4)
+        frame_count, _ = self.extract("frames")
+        thread.join()
+
+        self.assert_same_frames(source, "frames", frame_count)
+
+    def test_stall_timeout(self):
+        """書き込みが止まったら中断されることのテスト"""
+        open(self.growing_path, "wb").close()
+        with self.assertRaises(TimeoutError):
+            self.extract("frames", stall_timeout=0.2)
+
+
+
+def mp4_box(box_type, payload=b""):
+    """ISO BMFF のボックスを作成"""
+    return (8 + len(payload)).to_bytes(4, "big") + box_type + payload
+
+
+class TestCanDecodePartial(unittest.TestCase):
+    """書き込み途中の動画を読めるかどうかの判定のテストクラス"""
+
+    def setUp(self):
+        """テスト前の準備"""
+        self.temp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.temp_dir, "video.bin")
+
+    def tearDown(self):
+        """テスト後のクリーンアップ"""
+        shutil.rmtree(self.temp_dir)
+
+    def check(self, data):
+        """data を書き込んだファイルを判定"""
+        with open(self.path, "wb") as f:
+            f.write(data)
+        return can_decode_partial(self.path)
+
+    def test_mp4_boxes(self):
+        """MP4はインデックス（moov）が先頭にあり、届いている場合だけ読めることのテスト"""
+        ftyp = mp4_box(b"ftyp", b"isom" + bytes(8))
+        moov = mp4_box(b"moov", bytes(100))
+        mdat = mp4_box(b"mdat", bytes(1000))
+
+        self.assertTrue(self.check(ftyp + moov + mdat[:20]))
+        self.assertFalse(self.check(ftyp + moov[:50]))
+        self.assertFalse(self.check(ftyp + mdat + moov))
+        self.assertFalse(self.check(ftyp + mdat[:100]))
+        self.assertFalse(self.check(ftyp[:6]))
+
+        # 64ビットサイズのボックス
+        large_free = (1).to_bytes(4, "big") + b"free" + (24).to_bytes(8, "big") + bytes(8)
+        self.assertTrue(self.check(ftyp + large_free + moov))
+
+    def test_video_files(self):
+        """OpenCVで書き出したMP4（インデックスが末尾）・MKVの判定のテスト"""
+        mp4 = os.path.join(self.temp_dir, "source.mp4")
+        write_video(mp4, "mp4v")
+        mkv = os.path.join(self.temp_dir, "source.mkv")
+        write_video(mkv, "MJPG")
+
+        # OpenCVはインデックスを末尾に書くため、最後まで届いても途中からは読めない形式
+        self.assertFalse(can_decode_partial(mp4))
+        self.assertFalse(self.check(open(mp4, "rb").read()[:-500]))
+        self.assertTrue(self.check(open(mkv, "rb").read()[:1000]))
+        self.assertFalse(self.check(b""))
+        self.assertFalse(can_decode_partial(os.path.join(self.temp_dir, "missing.mp4")))
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""
+追跡結果のServer-Sent Events配信（web_app の /stream）のテスト
+"""
+
+import unittest
+import os
+import sys
+import json
+import tempfile
+import shutil
+from unittest import mock
+
+# プロジェクトルートを追加
+current_dir = os.path.dirname(os.path.abspath(__file__))
+project_root = os.path.dirname(current_dir)
+sys.path.insert(0, project_root)
+
+import web_app
+
+
+def parse_event(chunk):
+    """SSEのイベント1つを (event, id, data) に変換"""
+    fields = {}
+    for line in chunk.decode('utf-8').strip().split('\n'):
+        key, _, value = line.partition(': ')
+        fields[key] = value
+    data = fields.get('data')
+    return fields.get('event'), fields.get('id'), json.loads(data) if data else None
+
+
+class TestStreamTracking(unittest.TestCase):
+    """/stream のテストクラス"""
+
+    def setUp(self):
+        """テスト前の準備"""
+        self.test_dir = tempfile.mkdtemp()
+        self.session = web_app.ProcessingSession('stream-test')
+        # web_results のセッションストアは使わない
+        patcher = mock.patch.object(web_app, 'processing_sessions', {'stream-test': self.session})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.client = web_app.app.test_client()
+
+    def tearDown(self):
+        """テスト後のクリーンアップ"""
+        shutil.rmtree(self.test_dir)
+
+    def start_run(self, name):
+        """新しい処理の結果ファイルに切り替え、書き込み用に開く"""
+        path = os.path.join(self.test_dir, name)
+        masks_file = open(path, 'w', encoding='utf-8')
+        self.addCleanup(masks_file.close)
+        web_app.reset_frame_events(self.session, path)
+        return masks_file
+
+    def add_frames(self, masks_file, frame_idxs):
+        """フレームの結果を書き出して通知"""
+        for frame_idx in frame_idxs:
+            self.session.progress = frame_idx
+            web_app.write_frame_line(masks_file, {'frame_idx': frame_idx, 'objects': []})
+            web_app.append_frame_event(self.session)
+
+    def read_events(self, last_event_id=None):
+        """終了済みの処理の /stream をすべて読む"""
+        headers = {'Last-Event-ID': last_event_id} if last_event_id else {}
+        response = self.client.get('/stream/stream-test', headers=headers)
+        chunks = response.get_data().split(b'\n\n')
+        return [parse_event(chunk) for chunk in chunks if chunk.strip()]
+
+    def test_resume_same_run(self):
+        """同じ処理への再接続では Last-Event-ID の次のフレームから送ることのテスト"""
+        self.add_frames(self.start_run('run1.jsonl'), [0, 1, 2])
+
+        events = self.read_events()
+        self.assertEqual([e[1] for e in events[:-1]], ['1-0', '1-1', '1-2'])
+        self.assertEqual([e[2]['frame_idx'] for e in events[:-1]], [0, 1, 2])
+        self.assertEqual(events[-1][0], 'end')
+
+        events = self.read_events('1-1')
+        self.assertEqual([(e[1], e[2]['frame_idx']) for e in events[:-1]], [('1-2', 2)])
+
+    def test_reconnect_after_rerun(self):
+        """処理がやり直された後の再接続では、新しい処理の最初のフレームから送ることのテスト"""
+        self.add_frames(self.start_run('run1.jsonl'), [0, 1, 2])
+        self.add_frames(self.start_run('run2.jsonl'), [5, 6])
+
+        events = self.read_events('1-2')
+        self.assertEqual([(e[1], e[2]['frame_idx']) for e in events[:-1]], [('2-0', 5), ('2-1', 6)])
+
+    def test_rerun_while_connected(self):
+        """接続中に処理がやり直された場合、新しい処理のフレームを最初から送ることのテスト"""
+        self.session.propagating = True
+        self.add_frames(self.start_run('run1.jsonl'), [0, 1, 2])
+        response = self.client.get('/stream/stream-test', buffered=False)
+        stream = iter(response.response)
+        self.assertEqual([parse_event(next(stream))[1] for _ in range(3)], ['1-0', '1-1', '1-2'])
+
+        self.add_frames(self.start_run('run2.jsonl'), [5, 6])
+        self.session.propagating = False
+        events = [parse_event(chunk) for chunk in stream]
+        self.assertEqual([(e[1], e[2]['frame_idx']) for e in events[:-1]], [('2-0', 5), ('2-1', 6)])
+        self.assertEqual(events[-1][0], 'end')
+        response.close()
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+"""
+ストリーミングZIP生成（src.zip_stream）のテスト
+"""
+
+import unittest
+import os
+import sys
+import io
+import shutil
+import tempfile
+import zipfile
+
+# プロジェクトルートを追加
+current_dir = os.path.dirname(os.path.abspath(__file__))
+project_root = os.path.dirname(current_dir)
+sys.path.insert(0, project_root)
+
+from src.zip_stream import compression_for, iter_zip
+
+
+class TestIterZip(unittest.TestCase):
+    """iter_zipのテストクラス"""
+
+    def setUp(self):
+        """テスト前の準備"""
+        self.temp_dir = tempfile.mkdtemp()
+        self.image_path = os.path.join(self.temp_dir, "frame.jpg")
+        self.image_data = os.urandom(300 * 1024)
+        with open(self.image_path, "wb") as f:
+            f.write(self.image_data)
+
+    def tearDown(self):
+        """テスト後のクリーンアップ"""
+        shutil.rmtree(self.temp_dir)
+
+    def test_archive_contents(self):
+        """ファイル・文字列・ジェネレータの内容が正しく格納されることのテスト"""
+        lines = [f'{{"frame_idx": {i}}}\n'.encode() for i in range(1000)]
+        entries = [
+            ("frames/frame.jpg", ("file", self.image_path)),
+            ("README.txt", "SAM2 動画追跡結果"),
+            ("masks_rle.jsonl", iter(lines)),
+        ]
+        chunks = list(iter_zip(entries, chunk_size=64 * 1024))
+
+        # 画像は読み込み単位ごとに少しずつ出力される
+        self.assertGreater(len(chunks), 4)
+        self.assertTrue(all(chunks))
+
+        with zipfile.ZipFile(io.BytesIO(b"".join(chunks))) as zip_file:
+            self.assertIsNone(zip_file.testzip())
+            self.assertEqual(zip_file.read("frames/frame.jpg"), self.image_data)
+            self.assertEqual(zip_file.read("README.txt").decode("utf-8"), "SAM2 動画追跡結果")
+            self.assertEqual(zip_file.read("masks_rle.jsonl"), b"".join(lines))
+
+            # 既に圧縮されている形式は無圧縮、テキストは圧縮して格納される
+            self.assertEqual(zip_file.getinfo("frames/frame.jpg").compress_type, zipfile.ZIP_STORED)
+            info = zip_file.getinfo("masks_rle.jsonl")
+            self.assertEqual(info.compress_type, zipfile.ZIP_DEFLATED)
+            self.assertLess(info.compress_size, info.file_size)
+
+    def test_compression_for(self):
+        """拡張子ごとの圧縮方式のテスト"""
+        self.assertEqual(compression_for("a/B.PNG"), zipfile.ZIP_STORED)
+        self.assertEqual(compression_for("masks/00000.npz"), zipfile.ZIP_STORED)
+        self.assertEqual(compression_for("analysis_result.json"), zipfile.ZIP_DEFLATED)
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
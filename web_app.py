@@ -6,14 +6,14 @@ Flask + JavaScript でブラウザから簡単に使用可能
 
 import os
 import sys
+import io
 import json
 import uuid
 import threading
 import time
 from datetime import datetime
-from flask import Flask, render_template, request, jsonify, send_file, redirect, url_for
+from flask import Flask, Response, render_template, request, jsonify, send_file, redirect, url_for, stream_with_context
 from werkzeug.utils import secure_filename
-import zipfile
 import shutil
 import numpy as np
 
@@ -21,29 +21,54 @@ import numpy as np
 current_dir = os.path.dirname(os.path.abspath(__file__))
 sys.path.insert(0, current_dir)
 
-# SAM2のディレクトリ制約に対応するため、sam2ディレクトリに移動してインポート
-original_cwd = os.getcwd()
-sam2_dir = os.path.join(current_dir, 'sam2')
-
-def import_sam2_components():
-    """SAM2コンポーネントを安全にインポート"""
-    os.chdir(sam2_dir)
-    sys.path.insert(0, sam2_dir)
-    try:
-        from src.sam2_video_tracker import SAM2VideoTracker
-        return SAM2VideoTracker
-    finally:
-        os.chdir(original_cwd)
-
-# SAM2VideoTrackerをインポート
-SAM2VideoTracker = None
-
-from scripts.video_to_frames import video_to_frames
+from scripts.video_to_frames import video_to_frames, video_to_frames_streaming, can_decode_partial
+from src.job_queue import JobScheduler, QueueFullError, DONE, CANCELLED
+from src.sam2_utils import rle_to_mask
+from src.zip_stream import iter_zip
+from src.mask_store import MaskStore
+from src.session_store import SessionStore
+from src.interactive_session import (
+    InteractiveSessionPool, InteractiveSessionError, SessionBusyError, MemoryBudgetError, SessionLimitError,
+)
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = 'sam2-video-tracking-web-app'
 app.config['UPLOAD_FOLDER'] = 'web_uploads'
-app.config['MAX_CONTENT_LENGTH'] = 100 * 1024 * 1024  # 100MB max
+app.config['MAX_CONTENT_LENGTH'] = 100 * 1024 * 1024  # 100MB max（1リクエストあたり）
+
+# 分割アップロードの設定。チャンクごとのリクエストは MAX_CONTENT_LENGTH 以下に収まるため、
+# 動画全体の上限は MAX_UPLOAD_SIZE で別に制限する
+app.config['MAX_UPLOAD_SIZE'] = int(os.environ.get('SAM2_WEB_MAX_UPLOAD_MB', 2048)) * 1024 * 1024
+app.config['UPLOAD_CHUNK_SIZE'] = int(os.environ.get('SAM2_WEB_UPLOAD_CHUNK_MB', 8)) * 1024 * 1024
+# アップロードがこの秒数止まったら、並行して動いているフレーム分割を中断する（再開時にやり直す）
+app.config['UPLOAD_STALL_TIMEOUT'] = float(os.environ.get('SAM2_WEB_UPLOAD_STALL_TIMEOUT', 60))
+
+# ジョブスケジューラの設定（環境変数で変更可能）
+# 同時に動かすSAM2は JOB_WORKERS 個までに制限し、それ以上は待ちキューに並べる
+app.config['JOB_WORKERS'] = int(os.environ.get('SAM2_WEB_WORKERS', 1))
+app.config['JOB_QUEUE_SIZE'] = int(os.environ.get('SAM2_WEB_QUEUE_SIZE', 8))
+app.config['EXTRACT_TIMEOUT'] = float(os.environ.get('SAM2_WEB_EXTRACT_TIMEOUT', 600))
+app.config['TRACKING_TIMEOUT'] = float(os.environ.get('SAM2_WEB_TRACKING_TIMEOUT', 3600))
+# 結果画像を並列に描画するスレッド数（0でCPUコア数）
+app.config['RENDER_WORKERS'] = int(os.environ.get('SAM2_WEB_RENDER_WORKERS', 0))
+
+# 対話モードの設定。予測器とフレームを保持し続けるため、合計メモリ量とアイドル時間で破棄する
+app.config['INTERACTIVE_MEMORY_MB'] = int(os.environ.get('SAM2_WEB_INTERACTIVE_MEMORY_MB', 4096))
+app.config['INTERACTIVE_IDLE_TIMEOUT'] = float(os.environ.get('SAM2_WEB_INTERACTIVE_IDLE', 600))
+# 対話セッションはそれぞれSAM2のワーカープロセスを持つため、ジョブと同じく同時に起動する数を制限する
+# （既定はジョブのワーカー数と同じ、0で無制限）
+app.config['INTERACTIVE_MAX_SESSIONS'] = int(
+    os.environ.get('SAM2_WEB_INTERACTIVE_MAX_SESSIONS', app.config['JOB_WORKERS'])
+)
+
+# セッションの保持期間とディスク容量の上限（web_uploads と web_results の合計）
+app.config['SESSION_TTL'] = float(os.environ.get('SAM2_WEB_SESSION_TTL', 24 * 3600))
+app.config['DISK_QUOTA_MB'] = int(os.environ.get('SAM2_WEB_DISK_QUOTA_MB', 10240))  # 0で無制限
+app.config['SWEEP_INTERVAL'] = float(os.environ.get('SAM2_WEB_SWEEP_INTERVAL', 60))
+
+# ジョブの優先度（小さいほど先に実行）。短いフレーム分割を長い追跡より先に実行する
+EXTRACT_PRIORITY = 0
+TRACKING_PRIORITY = 1
 
 # アップロードフォルダを作成
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
@@ -52,118 +77,264 @@ os.makedirs('web_results', exist_ok=True)
 # 許可されるファイル拡張子
 ALLOWED_VIDEO_EXTENSIONS = {'mp4', 'mov', 'avi', 'wmv', 'mkv'}
 
-# セッション管理
-processing_sessions = {}
 
-def run_complete_video_tracking_with_progress(video_dir, output_dir, objects_to_track, model_size="tiny", progress_callback=None):
+# ジョブスケジューラ（spawnされたワーカープロセスでこのモジュールが再インポートされても
+# 作られないよう、初めて使う時に作成する）
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+def get_scheduler():
+    """
+    ジョブスケジューラを取得する
+
+    Returns:
+        JobScheduler: アプリ全体で共有するスケジューラ
+    """
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = JobScheduler(
+                max_workers=app.config['JOB_WORKERS'],
+                max_queue_size=app.config['JOB_QUEUE_SIZE'],
+            )
+        return _scheduler
+
+_interactive_pool = None
+
+def get_interactive_pool():
+    """
+    対話モードのセッションプールを取得する
+
+    Returns:
+        InteractiveSessionPool: アプリ全体で共有するプール
+    """
+    global _interactive_pool
+    with _scheduler_lock:
+        if _interactive_pool is None:
+            _interactive_pool = InteractiveSessionPool(
+                memory_budget=app.config['INTERACTIVE_MEMORY_MB'] * 1024 ** 2,
+                idle_timeout=app.config['INTERACTIVE_IDLE_TIMEOUT'],
+                max_sessions=app.config['INTERACTIVE_MAX_SESSIONS'] or None,
+            )
+        return _interactive_pool
+
+def extract_frames_job(video_path, frames_dir, progress_callback=None):
+    """
+    フレーム分割ジョブ（ワーカープロセスで実行）
+
+    Args:
+        video_path (str): 入力動画ファイルのパス
+        frames_dir (str): フレーム出力ディレクトリ
+        progress_callback (callable): 進捗通知関数 (progress, message)
+
+    Returns:
+        tuple: (抽出したフレーム数, フレームファイル名のリスト)
+    """
+    os.makedirs(frames_dir, exist_ok=True)
+
+    if progress_callback:
+        progress_callback(20, "フレーム抽出を開始...")
+
+    # フレーム分割実行
+    frame_count = video_to_frames(video_path, frames_dir, quality=85)
+
+    if progress_callback:
+        progress_callback(80, "フレームファイルを確認中...")
+
+    # フレームファイル一覧を取得
+    frame_files = [f for f in os.listdir(frames_dir) if f.endswith('.jpg')]
+    frame_files.sort()
+    return frame_count, frame_files
+
+def extract_frames_streaming_job(video_path, frames_dir, complete_marker, upload_size,
+                                 stall_timeout=60, progress_callback=None):
+    """
+    アップロード中の動画のフレーム分割ジョブ（ワーカープロセスで実行）
+
+    チャンクが届くたびに伸びる動画ファイルから、読めるようになったフレームを順に書き出す。
+    complete_marker が作られた時点でアップロード完了とみなす。
+
+    Args:
+        video_path (str): アップロード中の動画ファイルのパス
+        frames_dir (str): フレーム出力ディレクトリ
+        complete_marker (str): アップロード完了時に作られるファイルのパス
+        upload_size (int): 動画ファイルの最終的なサイズ（バイト）
+        stall_timeout (float): アップロードがこの秒数止まったら中断する
+        progress_callback (callable): 進捗通知関数 (progress, message, frame_count)
+
+    Returns:
+        tuple: (抽出したフレーム数, フレームファイル名のリスト)
+    """
+    def is_complete():
+        return os.path.exists(complete_marker)
+
+    def on_frame(frame_count):
+        if progress_callback is None:
+            return
+        if is_complete():
+            message = f"フレーム抽出中: {frame_count}フレーム"
+            progress = 95
+        else:
+            uploaded = os.path.getsize(video_path) / max(upload_size, 1)
+            message = f"アップロード中（{uploaded:.0%}）: {frame_count}フレーム抽出済み"
+            progress = int(90 * uploaded)
+        progress_callback(progress, message, frame_count)
+
+    frame_count = video_to_frames_streaming(
+        video_path, frames_dir, is_complete,
+        quality=85, stall_timeout=stall_timeout, frame_callback=on_frame,
+    )
+    frame_files = [f"{i:05d}.jpg" for i in range(frame_count)]
+    return frame_count, frame_files
+
+def run_complete_video_tracking_with_progress(video_dir, output_dir, objects_to_track, model_size="tiny",
+                                              render_workers=None, output_format="images", progress_callback=None):
     """
     プログレスコールバック付きの完全な動画追跡を実行
+
+    追跡中はフレームの結果を output_dir/masks_rle.jsonl に1フレーム1行
+    （{"frame_idx", "frame_name", "objects": [{"id", "rle"}]}）で書き出し、書き出すたびに
+    progress_callback(stage, progress, message, frame_idx) を呼ぶ。マスクはプロセス間で送らず、
+    /stream やマスクのみのダウンロードはこのファイルから読む。
+    output_format が "video" の場合は、結果画像の代わりにマスクを重ねたフレームを
+    伝播しながら output_dir/tracked.mp4 に書き込む。
     """
-    # 正しいディレクトリでSAM2を実行
-    original_cwd = os.getcwd()
-    sam2_dir = os.path.join(current_dir, 'sam2')
+    # torch / SAM2本体の読み込みは重いため、実際に追跡する時に遅延インポートする
+    from src.sam2_video_tracker import SAM2VideoTracker
     
-    try:
-        # sam2ディレクトリに移動
-        os.chdir(sam2_dir)
-        sys.path.insert(0, sam2_dir)
-        
-        # SAM2 componentsをインポート
-        from src.sam2_video_tracker import run_complete_video_tracking
-        
-        if progress_callback:
-            progress_callback("初期化", 10, "SAM2実行環境を準備中...")
-        
-        # 絶対パスに変換
-        video_dir = os.path.abspath(video_dir)
-        output_dir = os.path.abspath(output_dir)
-        
-        if progress_callback:
-            progress_callback("実行", 20, "SAM2による物体追跡を開始...")
-        
-        # SAM2のパスを修正してから実行
-        # SAM2VideoTrackerクラスを直接使用してパス問題を回避
-        import datetime
-        start_time = datetime.datetime.now()
-        
-        from src.sam2_video_tracker import SAM2VideoTracker
-        
-        # トラッカーを初期化（sam2ディレクトリ内で実行）
-        tracker = SAM2VideoTracker(model_size=model_size, device="cpu")
-        
-        if progress_callback:
-            progress_callback("初期化", 30, "動画フレームを初期化中...")
-        
-        # 動画を初期化
-        frame_names = tracker.initialize_video(video_dir)
-        
-        if progress_callback:
-            progress_callback("物体追加", 40, "追跡対象オブジェクトを設定中...")
-        
-        # 追跡対象オブジェクトを追加
-        initial_points = None
-        initial_labels = None
+    if progress_callback:
+        progress_callback("初期化", 10, "SAM2実行環境を準備中...")
+    
+    # 作業ディレクトリに依存しないよう絶対パスに変換
+    video_dir = os.path.abspath(video_dir)
+    output_dir = os.path.abspath(output_dir)
+    
+    if progress_callback:
+        progress_callback("実行", 20, "SAM2による物体追跡を開始...")
+    
+    start_time = datetime.now()
+    
+    # トラッカーを初期化
+    tracker = SAM2VideoTracker(model_size=model_size, device="cpu")
+    
+    if progress_callback:
+        progress_callback("初期化", 30, "動画フレームを初期化中...")
+    
+    # 動画を初期化
+    frame_names = tracker.initialize_video(video_dir)
+    
+    if progress_callback:
+        progress_callback("物体追加", 40, "追跡対象オブジェクトを設定中...")
+    
+    # 追跡対象オブジェクトを追加
+    initial_points = None
+    initial_labels = None
+    
+    for obj_config in objects_to_track:
+        frame_idx = obj_config["frame"]
+        obj_id = obj_config["id"]
         
-        for obj_config in objects_to_track:
-            frame_idx = obj_config["frame"]
-            obj_id = obj_config["id"]
+        if "points" in obj_config:
+            points = obj_config["points"]
+            labels = obj_config["labels"]
+            tracker.add_object_points(frame_idx, obj_id, points, labels)
             
-            if "points" in obj_config:
-                points = obj_config["points"]
-                labels = obj_config["labels"]
-                tracker.add_object_points(frame_idx, obj_id, points, labels)
-                
-                # 最初のオブジェクトの座標を保存（表示用）
-                if initial_points is None:
-                    initial_points = np.array(points, dtype=np.float32)
-                    initial_labels = np.array(labels, dtype=np.int32)
-        
+            # 最初のオブジェクトの座標を保存（表示用）
+            if initial_points is None:
+                initial_points = np.array(points, dtype=np.float32)
+                initial_labels = np.array(labels, dtype=np.int32)
+    
+    if progress_callback:
+        progress_callback("追跡", 60, "動画全体に追跡を伝播中...")
+    
+    # フレームごとの結果をRLEにして保存し、逐次通知する（ライブ表示用）
+    # マスクはRLEで一時ファイルに追記し、長い動画でもメモリに溜めない
+    mask_store = MaskStore(memmap=True)
+    processed_frames = []
+    os.makedirs(output_dir, exist_ok=True)
+    masks_file = open(os.path.join(output_dir, "masks_rle.jsonl"), 'w', encoding='utf-8')
+    video_writer = None
+    if output_format == "video":
+        video_writer = tracker.open_video_writer(video_dir, frame_names, output_dir,
+                                                 initial_points, initial_labels)
+    
+    def on_frame(frame_idx, frame_masks):
+        processed_frames.append(frame_idx)
+        if video_writer is not None:
+            video_writer.write(frame_idx, frame_masks)
+        write_frame_line(masks_file, {
+            "frame_idx": int(frame_idx),
+            "frame_name": frame_names[frame_idx],
+            "objects": [
+                {"id": int(obj_id), "rle": mask_store.rle(frame_idx, obj_id)}
+                for obj_id in frame_masks
+            ],
+        })
         if progress_callback:
-            progress_callback("追跡", 60, "動画全体に追跡を伝播中...")
-        
+            progress_callback(
+                "追跡",
+                60 + 20 * len(processed_frames) / max(len(frame_names), 1),
+                f"{len(processed_frames)}/{len(frame_names)}フレーム処理",
+                int(frame_idx),
+            )
+    
+    with mask_store:
         # 動画全体に追跡を伝播
-        video_segments = tracker.propagate_in_video()
-        
-        if progress_callback:
-            progress_callback("保存", 80, "結果を保存中...")
+        with masks_file:
+            if video_writer is not None:
+                with video_writer:
+                    video_segments = tracker.propagate_in_video(frame_callback=on_frame, mask_store=mask_store)
+            else:
+                video_segments = tracker.propagate_in_video(frame_callback=on_frame, mask_store=mask_store)
         
-        # 結果を保存
-        tracker.save_results(
-            video_dir=video_dir,
-            frame_names=frame_names,
-            video_segments=video_segments,
-            output_dir=output_dir,
-            show_initial_points=initial_points,
-            show_initial_labels=initial_labels
-        )
+        if video_writer is None:
+            if progress_callback:
+                progress_callback("保存", 80, "結果を保存中...")
+            
+            # 結果を保存
+            tracker.save_results(
+                video_dir=video_dir,
+                frame_names=frame_names,
+                video_segments=video_segments,
+                output_dir=output_dir,
+                show_initial_points=initial_points,
+                show_initial_labels=initial_labels,
+                num_workers=render_workers
+            )
         
         if progress_callback:
             progress_callback("分析", 90, "結果を分析中...")
         
         # 結果を分析
         analysis = tracker.analyze_results(video_segments, frame_names)
-        
-        # 処理時間計算
-        end_time = datetime.datetime.now()
-        processing_time = end_time - start_time
-        
-        # 分析結果を保存
-        analysis["processing_time"] = str(processing_time)
-        analysis["model_size"] = model_size
-        analysis["frames_per_second"] = len(frame_names) / processing_time.total_seconds()
-        
-        analysis_file = os.path.join(output_dir, "analysis_result.json")
-        with open(analysis_file, 'w', encoding='utf-8') as f:
-            json.dump(analysis, f, indent=2, ensure_ascii=False)
-        
-        if progress_callback:
-            progress_callback("完了", 100, "SAM2追跡が完了しました")
-        
-        return analysis
-        
-    finally:
-        # 元のディレクトリに戻す
-        os.chdir(original_cwd)
+    
+    # 処理時間計算
+    end_time = datetime.now()
+    processing_time = end_time - start_time
+    
+    # 分析結果を保存
+    analysis["processing_time"] = str(processing_time)
+    analysis["model_size"] = model_size
+    analysis["output_format"] = output_format
+    analysis["frames_per_second"] = len(frame_names) / processing_time.total_seconds()
+    
+    analysis_file = os.path.join(output_dir, "analysis_result.json")
+    with open(analysis_file, 'w', encoding='utf-8') as f:
+        json.dump(analysis, f, indent=2, ensure_ascii=False)
+    
+    if progress_callback:
+        progress_callback("完了", 100, "SAM2追跡が完了しました")
+    
+    return analysis
+
+def write_frame_line(masks_file, frame):
+    """
+    フレームの結果を masks_rle.jsonl 形式で1行追記する
+
+    /stream は行が書き終わった後の通知を受けてファイルから読むため、行ごとに書き出す。
+    """
+    masks_file.write(json.dumps(frame) + "\n")
+    masks_file.flush()
 
 def allowed_file(filename, allowed_extensions):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in allowed_extensions
@@ -176,6 +347,10 @@ class ProcessingSession:
         self.progress = 0
         self.message = ""
         self.video_path = None
+        # 分割アップロードの状態
+        self.upload_size = None
+        self.upload_received = 0
+        self.upload_lock = threading.Lock()
         self.frames_dir = None
         self.frame_count = 0
         self.frame_list = []
@@ -183,7 +358,101 @@ class ProcessingSession:
         self.tracking_results = None
         self.result_dir = None
         self.error = None
+        self.job = None
+        # 追跡中のフレームごとの結果（/stream で配信）
+        # マスクは events_path（masks_rle.jsonl 形式）から読み、メモリには各フレームの進捗だけを持つ
+        self.events_path = None
+        self.event_progress = []
+        self.events_run = 0
+        self.events_cond = threading.Condition()
+        self.propagating = False  # 対話モードで再伝播中かどうか
         self.created_at = datetime.now()
+    
+    # session.json に保存する属性
+    METADATA_FIELDS = (
+        'status', 'progress', 'message', 'video_path', 'frames_dir', 'frame_count',
+        'selected_points', 'tracking_results', 'result_dir', 'error', 'upload_size', 'upload_received',
+    )
+    
+    # 再起動で中断された処理の戻り先
+    INTERRUPTED_STATUS = {'extracting': 'uploaded', 'tracking': 'points_selected'}
+    
+    def to_metadata(self):
+        """保存用の辞書を返す"""
+        metadata = {key: getattr(self, key) for key in self.METADATA_FIELDS}
+        metadata['session_id'] = self.session_id
+        metadata['created_at'] = self.created_at.isoformat()
+        return metadata
+    
+    @classmethod
+    def from_metadata(cls, metadata):
+        """
+        保存された辞書からセッションを復元する
+
+        実行中だった処理（フレーム分割・追跡）は再起動で失われているため、やり直せる状態に戻す。
+        """
+        session = cls(metadata['session_id'])
+        for key in cls.METADATA_FIELDS:
+            if key in metadata:
+                setattr(session, key, metadata[key])
+        session.created_at = datetime.fromisoformat(metadata['created_at'])
+        
+        # 分割アップロードはチャンクを順に書き込むため、ファイルサイズが受信済みバイト数
+        if session.upload_size is not None and session.video_path and os.path.exists(session.video_path):
+            session.upload_received = os.path.getsize(session.video_path)
+        
+        if session.status in cls.INTERRUPTED_STATUS:
+            session.status = cls.INTERRUPTED_STATUS[session.status]
+            if session.status == 'uploaded' and not upload_complete(session):
+                session.status = 'uploading'
+            session.progress = 0
+            session.message = "サーバーの再起動により中断されました。もう一度実行してください"
+        
+        if session.status not in ('uploading', 'uploaded') and session.frames_dir and os.path.isdir(session.frames_dir):
+            session.frame_list = sorted(f for f in os.listdir(session.frames_dir) if f.endswith('.jpg'))
+            session.frame_count = len(session.frame_list)
+        return session
+    
+    def artifact_paths(self):
+        """セッションディレクトリ（web_results/<session_id>）以外の成果物のパス"""
+        if not self.video_path:
+            return []
+        return [self.video_path, self.video_path + '.complete']
+
+def session_is_active(session):
+    """ジョブ・再伝播の実行中かどうか（実行中のセッションは期限切れ・容量超過でも破棄しない）"""
+    return (session.job is not None and not session.job.finished) or session.propagating
+
+def stop_session_work(session):
+    """破棄するセッションの実行待ち・実行中の処理を止める"""
+    if session.job is not None:
+        get_scheduler().cancel(session.job)
+    if _interactive_pool is not None:
+        _interactive_pool.close(session.session_id)
+
+# セッション管理（期限切れ・容量超過のセッションは成果物ごとバックグラウンドで破棄する）
+processing_sessions = SessionStore(
+    root='web_results',
+    session_factory=ProcessingSession.from_metadata,
+    ttl=app.config['SESSION_TTL'],
+    disk_quota=app.config['DISK_QUOTA_MB'] * 1024 * 1024 or None,
+    sweep_interval=app.config['SWEEP_INTERVAL'],
+    upload_dir=app.config['UPLOAD_FOLDER'],
+    is_active=session_is_active,
+    on_evict=stop_session_work,
+)
+
+def stream_finished(session):
+    """/stream で配信中の処理（追跡ジョブ・対話モードの再伝播）が終わっているかどうか"""
+    if session.propagating:
+        return False
+    return session.job is None or session.job.wait(0)
+
+def set_job_error(session, job):
+    """失敗・タイムアウトしたジョブのエラーをセッションに記録"""
+    session.status = "error"
+    session.error = job.error
+    session.message = f"エラー: {job.error}"
 
 @app.route('/')
 def index():
@@ -227,6 +496,201 @@ def upload_video():
     
     return jsonify({'error': 'サポートされていないファイル形式です'}), 400
 
+@app.route('/upload/init', methods=['POST'])
+def init_upload():
+    """
+    分割アップロードを開始
+
+    JSON {filename, size} を受け取り、セッションを作成する。以降は
+    PUT /upload/<session_id>?offset=<受信済みバイト数> でチャンクを順に送る。
+    """
+    data = request.get_json(silent=True) or {}
+    filename = data.get('filename', '')
+    size = data.get('size')
+    
+    if not filename or not allowed_file(filename, ALLOWED_VIDEO_EXTENSIONS):
+        return jsonify({'error': 'サポートされていないファイル形式です'}), 400
+    if not isinstance(size, int) or size <= 0:
+        return jsonify({'error': 'ファイルサイズが不正です'}), 400
+    if size > app.config['MAX_UPLOAD_SIZE']:
+        max_mb = app.config['MAX_UPLOAD_SIZE'] // (1024 * 1024)
+        return jsonify({'error': f'ファイルサイズが上限（{max_mb}MB）を超えています'}), 413
+    
+    # セッションIDを生成
+    session_id = str(uuid.uuid4())
+    
+    # 書き込み先のファイルを作成
+    filename = secure_filename(filename)
+    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+    safe_filename = f"{timestamp}_{filename}"
+    video_path = os.path.join(app.config['UPLOAD_FOLDER'], safe_filename)
+    open(video_path, 'wb').close()
+    
+    # セッションを作成
+    session = ProcessingSession(session_id)
+    session.video_path = video_path
+    session.upload_size = size
+    session.status = "uploading"
+    session.message = "アップロード中..."
+    
+    processing_sessions[session_id] = session
+    
+    return jsonify({
+        'session_id': session_id,
+        'filename': filename,
+        'chunk_size': app.config['UPLOAD_CHUNK_SIZE'],
+        'received': 0
+    })
+
+@app.route('/upload/<session_id>', methods=['GET'])
+def get_upload(session_id):
+    """分割アップロードの受信済みバイト数を取得（中断したアップロードの再開用）"""
+    if session_id not in processing_sessions:
+        return jsonify({'error': 'セッションが見つかりません'}), 404
+    
+    session = processing_sessions[session_id]
+    
+    return jsonify({
+        'received': session.upload_received,
+        'size': session.upload_size,
+        'complete': upload_complete(session)
+    })
+
+@app.route('/upload/<session_id>', methods=['PUT'])
+def upload_chunk(session_id):
+    """
+    分割アップロードのチャンクを受信
+
+    offset が受信済みバイト数と一致しない場合は409と受信済みバイト数を返すので、
+    クライアントはそこから送り直す。届いた分から読める形式（MKV・AVI、インデックスが
+    先頭にあるMP4など）は、読めるようになった時点でフレーム分割を開始し、アップロードと
+    並行してフレームを書き出す。インデックスが末尾にあるMP4は、読めないままワーカーを
+    占有しないよう、アップロード完了後にフレーム分割を開始する。
+    """
+    if session_id not in processing_sessions:
+        return jsonify({'error': 'セッションが見つかりません'}), 404
+    
+    session = processing_sessions[session_id]
+    
+    if session.upload_size is None:
+        return jsonify({'error': '分割アップロードのセッションではありません'}), 400
+    
+    try:
+        offset = int(request.args.get('offset', -1))
+    except ValueError:
+        offset = -1
+    chunk = request.get_data(cache=False)
+    
+    with session.upload_lock:
+        if offset != session.upload_received:
+            return jsonify({'error': 'オフセットが一致しません', 'received': session.upload_received}), 409
+        if offset + len(chunk) > session.upload_size:
+            return jsonify({'error': 'ファイルサイズを超えるデータです', 'received': session.upload_received}), 400
+        
+        with open(session.video_path, 'r+b') as f:
+            f.seek(offset)
+            f.write(chunk)
+        session.upload_received += len(chunk)
+        
+        complete = upload_complete(session)
+        if complete:
+            # 並行して動いているフレーム分割ジョブに完了を知らせる
+            open(complete_marker_path(session), 'w').close()
+        
+        if session.status == "uploading" and (complete or can_decode_partial(session.video_path)):
+            try:
+                submit_extraction(session)
+            except QueueFullError:
+                # 混雑時はアップロード完了後に /extract_frames から投入し直す
+                if complete:
+                    session.status = "uploaded"
+                    session.message = "動画アップロード完了"
+    
+    return jsonify({
+        'received': session.upload_received,
+        'size': session.upload_size,
+        'complete': complete
+    })
+
+def upload_complete(session):
+    """アップロードが完了しているかどうか（一括アップロードは常にTrue）"""
+    return session.upload_size is None or session.upload_received >= session.upload_size
+
+def complete_marker_path(session):
+    """分割アップロードの完了を示すファイルのパス"""
+    return session.video_path + '.complete'
+
+def submit_extraction(session):
+    """
+    フレーム分割ジョブを投入する
+
+    アップロード中の場合は、届いた分から順にフレームを書き出すジョブを投入する。
+    書き出したフレームは session.frame_list に順次追加される。
+
+    Raises:
+        QueueFullError: 待ちキューが満杯の場合
+    """
+    frames_dir = os.path.join('web_results', session.session_id, 'frames')
+    session.frames_dir = frames_dir
+    streaming = not upload_complete(session)
+
+    def on_start(job):
+        session.progress = 10
+        session.message = "フレーム分割中..."
+
+    def on_progress(progress, message, frame_count=None):
+        session.progress = progress
+        session.message = message
+        if frame_count is not None:
+            session.frame_list.extend(f"{i:05d}.jpg" for i in range(len(session.frame_list), frame_count))
+            session.frame_count = frame_count
+
+    def on_finish(job):
+        if job.state == DONE:
+            frame_count, frame_files = job.result
+            session.frame_count = len(frame_files)
+            session.frame_list = frame_files
+            session.progress = 100
+            session.status = "frames_ready"
+            session.message = f"フレーム分割完了: {frame_count}フレーム"
+        elif streaming and not upload_complete(session):
+            # アップロードが止まった場合は、次のチャンクが届いた時にやり直す
+            session.status = "uploading"
+            session.progress = 0
+            session.message = "アップロードの再開を待っています"
+        elif job.state == CANCELLED:
+            session.status = "uploaded"
+            session.progress = 0
+            session.message = "フレーム分割をキャンセルしました"
+        else:
+            set_job_error(session, job)
+        processing_sessions.save(session)
+
+    if streaming:
+        func = extract_frames_streaming_job
+        args = (session.video_path, frames_dir, complete_marker_path(session),
+                session.upload_size, app.config['UPLOAD_STALL_TIMEOUT'])
+        # アップロードが終わるまで続くため、タイムアウトは停止検出に任せる
+        timeout = None
+    else:
+        func = extract_frames_job
+        args = (session.video_path, frames_dir)
+        timeout = app.config['EXTRACT_TIMEOUT']
+
+    session.frame_list = []
+    session.frame_count = 0
+    session.job = get_scheduler().submit(
+        func, *args,
+        priority=EXTRACT_PRIORITY,
+        timeout=timeout,
+        on_start=on_start,
+        on_progress=on_progress,
+        on_finish=on_finish,
+    )
+    session.status = "extracting"
+    session.progress = 0
+    session.message = "順番待ち中..."
+
 @app.route('/extract_frames/<session_id>', methods=['POST'])
 def extract_frames(session_id):
     """フレーム分割を実行"""
@@ -238,6 +702,8 @@ def extract_frames(session_id):
     if session.status not in ["uploaded", "extracting"]:
         if session.status == "frames_ready":
             return jsonify({'message': 'フレーム分割は既に完了しています'}), 200
+        elif session.status == "uploading":
+            return jsonify({'error': 'アップロードが完了していません'}), 400
         else:
             return jsonify({'error': f'現在の状態({session.status})ではフレーム分割を実行できません'}), 400
     
@@ -245,45 +711,11 @@ def extract_frames(session_id):
     if session.status == "extracting":
         return jsonify({'message': 'フレーム分割が既に実行中です'}), 200
     
-    def process_frames():
-        try:
-            session.status = "extracting"
-            session.message = "フレーム分割中..."
-            session.progress = 10
-            
-            # フレーム出力ディレクトリを作成
-            frames_dir = os.path.join('web_results', session_id, 'frames')
-            os.makedirs(frames_dir, exist_ok=True)
-            session.frames_dir = frames_dir
-            
-            session.progress = 20
-            session.message = "フレーム抽出を開始..."
-            
-            # フレーム分割実行
-            frame_count = video_to_frames(session.video_path, frames_dir, quality=85)
-            
-            session.progress = 80
-            session.message = "フレームファイルを確認中..."
-            
-            # フレームファイル一覧を取得
-            frame_files = [f for f in os.listdir(frames_dir) if f.endswith('.jpg')]
-            frame_files.sort()
-            
-            session.frame_count = len(frame_files)
-            session.frame_list = frame_files
-            session.progress = 100
-            session.status = "frames_ready"
-            session.message = f"フレーム分割完了: {frame_count}フレーム"
-            
-        except Exception as e:
-            session.status = "error"
-            session.error = str(e)
-            session.message = f"エラー: {e}"
-    
-    # バックグラウンドで処理を実行
-    thread = threading.Thread(target=process_frames)
-    thread.daemon = True
-    thread.start()
+    # ワーカープロセスで処理を実行
+    try:
+        submit_extraction(session)
+    except QueueFullError:
+        return jsonify({'error': 'サーバーが混雑しています。しばらくしてから再度お試しください'}), 503
     
     return jsonify({'message': 'フレーム分割を開始しました'})
 
@@ -295,7 +727,8 @@ def get_frames(session_id):
     
     session = processing_sessions[session_id]
     
-    if session.status != "frames_ready":
+    # フレーム分割中でも、書き出し済みのフレームは返す
+    if session.status != "frames_ready" and not (session.status == "extracting" and session.frame_list):
         return jsonify({'error': 'フレームがまだ準備されていません'}), 400
     
     # 最初の数フレームのプレビューを作成
@@ -310,7 +743,8 @@ def get_frames(session_id):
     return jsonify({
         'total_frames': session.frame_count,
         'preview_frames': preview_frames,
-        'status': session.status
+        'status': session.status,
+        'extracting': session.status == "extracting"
     })
 
 @app.route('/frame_image/<session_id>/<frame_name>')
@@ -325,7 +759,7 @@ def get_frame_image(session_id, frame_name):
     if not os.path.exists(frame_path):
         return "フレームが見つかりません", 404
     
-    return send_file(frame_path)
+    return send_file(os.path.abspath(frame_path))
 
 @app.route('/select_points/<session_id>', methods=['POST'])
 def select_points(session_id):
@@ -339,6 +773,9 @@ def select_points(session_id):
     if not data or 'points' not in data:
         return jsonify({'error': '座標データが不正です'}), 400
     
+    if session.status in ("uploading", "extracting"):
+        return jsonify({'error': 'フレーム分割の完了を待ってください'}), 409
+    
     session.selected_points = data['points']
     session.status = "points_selected"
     session.message = f"{len(session.selected_points)}個の座標が選択されました"
@@ -361,85 +798,98 @@ def start_tracking(session_id):
     
     data = request.get_json()
     model_size = data.get('model_size', 'tiny')
+    output_format = data.get('output_format', 'images')
+    if output_format not in ('images', 'video'):
+        return jsonify({'error': f'不明な出力形式です: {output_format}'}), 400
     
-    def process_tracking():
-        try:
-            session.status = "tracking"
-            session.message = "SAM2による物体追跡を開始..."
-            session.progress = 10
-            
-            # 結果ディレクトリを作成
-            result_dir = os.path.join('web_results', session_id, 'tracked')
-            os.makedirs(result_dir, exist_ok=True)
-            session.result_dir = result_dir
-            
-            session.progress = 20
-            session.message = "SAM2モデルを読み込み中..."
-            
-            # 追跡対象オブジェクトを作成
-            objects_to_track = []
-            print(f"Debug - selected_points type: {type(session.selected_points)}")
-            print(f"Debug - selected_points content: {session.selected_points}")
-            
-            # 座標データの正しい形式を取得
-            if isinstance(session.selected_points, dict) and 'coords' in session.selected_points:
-                coords = session.selected_points['coords']
-                labels = session.selected_points.get('labels', [1] * len(coords))
-                
-                for i, coord in enumerate(coords):
-                    objects_to_track.append({
-                        "frame": 0,  # 最初のフレーム
-                        "id": i,    # オブジェクトID
-                        "points": [coord],  # 座標 [x, y]
-                        "labels": [labels[i] if i < len(labels) else 1]  # ラベル
-                    })
-            else:
-                # 旧形式への対応
-                for i, point in enumerate(session.selected_points):
-                    if isinstance(point, dict) and 'x' in point and 'y' in point:
-                        objects_to_track.append({
-                            "frame": 0,  # 最初のフレーム
-                            "id": i,    # オブジェクトID
-                            "points": [[float(point['x']), float(point['y'])]],  # 座標
-                            "labels": [1]  # Positive
-                        })
-            
-            print(f"Debug - objects_to_track: {objects_to_track}")
-            
-            session.progress = 30
-            session.message = f"{len(objects_to_track)}個のオブジェクトを追跡中..."
-            
-            # プログレス更新用のコールバック関数を作成
-            def update_progress(stage, progress, message):
-                session.progress = min(30 + int(progress * 0.65), 95)  # 30-95%の範囲
-                session.message = f"{stage}: {message}"
-            
-            # 実際のSAM2追跡を実行
-            analysis = run_complete_video_tracking_with_progress(
-                video_dir=session.frames_dir,
-                output_dir=result_dir,
-                objects_to_track=objects_to_track,
-                model_size=model_size,
-                progress_callback=update_progress
-            )
-            
-            session.tracking_results = analysis
+    # 結果ディレクトリを作成
+    result_dir = os.path.join('web_results', session_id, 'tracked')
+    os.makedirs(result_dir, exist_ok=True)
+    session.result_dir = result_dir
+    
+    # 追跡対象オブジェクトを作成
+    objects_to_track = []
+    print(f"Debug - selected_points type: {type(session.selected_points)}")
+    print(f"Debug - selected_points content: {session.selected_points}")
+    
+    # 座標データの正しい形式を取得
+    if isinstance(session.selected_points, dict) and 'coords' in session.selected_points:
+        coords = session.selected_points['coords']
+        labels = session.selected_points.get('labels', [1] * len(coords))
+        
+        for i, coord in enumerate(coords):
+            objects_to_track.append({
+                "frame": 0,  # 最初のフレーム
+                "id": i,    # オブジェクトID
+                "points": [coord],  # 座標 [x, y]
+                "labels": [labels[i] if i < len(labels) else 1]  # ラベル
+            })
+    else:
+        # 旧形式への対応
+        for i, point in enumerate(session.selected_points):
+            if isinstance(point, dict) and 'x' in point and 'y' in point:
+                objects_to_track.append({
+                    "frame": 0,  # 最初のフレーム
+                    "id": i,    # オブジェクトID
+                    "points": [[float(point['x']), float(point['y'])]],  # 座標
+                    "labels": [1]  # Positive
+                })
+    
+    print(f"Debug - objects_to_track: {objects_to_track}")
+    
+    def on_start(job):
+        session.progress = 30
+        session.message = f"{len(objects_to_track)}個のオブジェクトを追跡中..."
+    
+    # プログレス更新用のコールバック関数
+    def update_progress(stage, progress, message, frame_idx=None):
+        session.progress = min(30 + int(progress * 0.65), 95)  # 30-95%の範囲
+        session.message = f"{stage}: {message}"
+        if frame_idx is not None:
+            append_frame_event(session)
+    
+    def on_finish(job):
+        if job.state == DONE:
+            session.tracking_results = job.result
             session.progress = 100
             session.status = "completed"
             session.message = "追跡完了！"
-            
-        except Exception as e:
-            session.status = "error"
-            session.error = str(e)
-            session.message = f"エラー: {e}"
-            print(f"SAM2追跡エラー: {e}")
-            import traceback
-            traceback.print_exc()
+        elif job.state == CANCELLED:
+            session.status = "points_selected"
+            session.progress = 0
+            session.message = "追跡をキャンセルしました"
+        else:
+            set_job_error(session, job)
+            print(f"SAM2追跡エラー: {job.error}")
+        processing_sessions.save(session)
+        with session.events_cond:
+            session.events_cond.notify_all()
     
-    # バックグラウンドで処理を実行
-    thread = threading.Thread(target=process_tracking)
-    thread.daemon = True
-    thread.start()
+    session.status = "tracking"
+    session.progress = 0
+    session.message = "順番待ち中..."
+    reset_frame_events(session, os.path.join(result_dir, 'masks_rle.jsonl'))
+    
+    # 実際のSAM2追跡をワーカープロセスで実行
+    try:
+        session.job = get_scheduler().submit(
+            run_complete_video_tracking_with_progress,
+            video_dir=os.path.abspath(session.frames_dir),
+            output_dir=os.path.abspath(result_dir),
+            objects_to_track=objects_to_track,
+            model_size=model_size,
+            render_workers=app.config['RENDER_WORKERS'] or None,
+            output_format=output_format,
+            priority=TRACKING_PRIORITY,
+            timeout=app.config['TRACKING_TIMEOUT'],
+            on_start=on_start,
+            on_progress=update_progress,
+            on_finish=on_finish,
+        )
+    except QueueFullError:
+        session.status = "points_selected"
+        session.message = ""
+        return jsonify({'error': 'サーバーが混雑しています。しばらくしてから再度お試しください'}), 503
     
     return jsonify({'message': 'SAM2追跡を開始しました'})
 
@@ -451,55 +901,409 @@ def get_status(session_id):
     
     session = processing_sessions[session_id]
     
+    # 待ちキュー内の順番（実行中・未投入の場合はNone）
+    queue_position = get_scheduler().position(session.job) if session.job else None
+    message = session.message
+    if queue_position is not None:
+        message = f"順番待ち中（{queue_position}番目）"
+    
     return jsonify({
         'session_id': session_id,
         'status': session.status,
         'progress': session.progress,
-        'message': session.message,
+        'message': message,
+        'queue_position': queue_position,
+        'job_state': session.job.state if session.job else None,
         'frame_count': session.frame_count,
+        'upload': {
+            'received': session.upload_received,
+            'size': session.upload_size,
+        } if session.upload_size is not None else None,
         'error': session.error,
         'tracking_results': session.tracking_results
     })
 
-@app.route('/download_results/<session_id>')
-def download_results(session_id):
-    """結果をZIPでダウンロード"""
+@app.route('/stream/<session_id>')
+def stream_tracking(session_id):
+    """
+    追跡結果をフレームごとにServer-Sent Eventsで配信
+
+    追跡ジョブ、または対話モードの再伝播で propagate_in_video がフレームを出力するたびに "frame" イベント
+    （frame_idx, frame_name, progress, objects[{id, rle}]）を送り、
+    ジョブが終了したら "end" イベント（status, message, error）を送って閉じる。
+    イベントIDは "<処理の番号>-<フレームの通し番号>" で、再接続時は同じ処理の Last-Event-ID 以降から再送する。
+    処理がやり直された（reset_frame_events）場合は、新しい処理の最初のフレームから送り直す。
+    フレームの結果は session.events_path から順に読むため、長い動画でもメモリに溜めない。
+    """
     if session_id not in processing_sessions:
-        return "セッションが見つかりません", 404
+        return jsonify({'error': 'セッションが見つかりません'}), 404
     
     session = processing_sessions[session_id]
+    last_event_id = request.headers.get('Last-Event-ID', request.args.get('last_event_id', ''))
+    try:
+        start_run, last_index = (int(part) for part in last_event_id.split('-'))
+        start = last_index + 1
+    except ValueError:
+        start_run, start = None, 0
     
-    if session.status != "completed":
-        return "まだ処理が完了していません", 400
+    def generate():
+        index = start
+        run = start_run
+        events_file = None
+        try:
+            while True:
+                with session.events_cond:
+                    finished = stream_finished(session)
+                    if run == session.events_run and index >= len(session.event_progress) and not finished:
+                        session.events_cond.wait(timeout=15)
+                        finished = stream_finished(session)
+                    if run != session.events_run:
+                        # 最初の接続・処理のやり直し時は、新しい処理の最初のフレームから送る
+                        run = session.events_run
+                        index = 0
+                        if events_file is not None:
+                            events_file.close()
+                            events_file = None
+                    progress = session.event_progress[index:]
+                    total = len(session.event_progress)
+                    path = session.events_path
+                
+                if progress and events_file is None:
+                    # ファイルを開いて index 行目まで読み飛ばす（同じ処理への再接続時）
+                    events_file = open(path, encoding='utf-8')
+                    for _ in range(index):
+                        events_file.readline()
+                
+                for frame_progress in progress:
+                    event = json.loads(events_file.readline())
+                    event['progress'] = frame_progress
+                    yield f"id: {run}-{index}\nevent: frame\ndata: {json.dumps(event)}\n\n"
+                    index += 1
+                
+                if finished and index >= total:
+                    end = {'status': session.status, 'message': session.message, 'error': session.error}
+                    yield f"event: end\ndata: {json.dumps(end, ensure_ascii=False)}\n\n"
+                    return
+                if not progress:
+                    # プロキシに切断されないよう定期的にコメントを送る
+                    yield ": keep-alive\n\n"
+                if session_id not in processing_sessions:
+                    return
+        finally:
+            if events_file is not None:
+                events_file.close()
+    
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'},
+    )
+
+def reset_frame_events(session, events_path):
+    """/stream で配信するフレームの結果を、events_path に書き出す新しい処理のものに切り替える"""
+    with session.events_cond:
+        session.events_path = events_path
+        session.event_progress = []
+        session.events_run += 1
+        session.events_cond.notify_all()
+
+def append_frame_event(session):
+    """events_path に1フレーム分の行が書き出されたことを /stream に通知"""
+    with session.events_cond:
+        session.event_progress.append(session.progress)
+        session.events_cond.notify_all()
+
+def get_interactive(session_id):
+    """
+    対話モードのセッションを取得
+
+    Returns:
+        tuple: (ProcessingSession, InteractiveSession, エラーレスポンス)
+    """
+    if session_id not in processing_sessions:
+        return None, None, (jsonify({'error': 'セッションが見つかりません'}), 404)
+    interactive = get_interactive_pool().get(session_id)
+    if interactive is None:
+        return None, None, (jsonify({'error': '対話モードが開始されていないか、破棄されました。再度開始してください'}), 410)
+    return processing_sessions[session_id], interactive, None
+
+def interactive_error(error):
+    """対話モードの例外をレスポンスに変換"""
+    if isinstance(error, SessionBusyError):
+        return jsonify({'error': '再伝播の実行中です。停止するか完了を待ってください'}), 409
+    return jsonify({'error': str(error)}), 500
+
+@app.route('/interactive/<session_id>/start', methods=['POST'])
+def start_interactive(session_id):
+    """対話モードを開始（モデルとフレームを読み込んだワーカーを保持する）"""
+    if session_id not in processing_sessions:
+        return jsonify({'error': 'セッションが見つかりません'}), 404
+    
+    session = processing_sessions[session_id]
     
-    # ZIPファイルを作成
-    zip_path = os.path.join('web_results', f"{session_id}_results.zip")
+    if not session.frame_list or session.status in ("uploading", "extracting"):
+        return jsonify({'error': 'フレームがまだ準備されていません'}), 400
+    
+    data = request.get_json(silent=True) or {}
+    model_size = data.get('model_size', 'tiny')
     
-    with zipfile.ZipFile(zip_path, 'w') as zip_file:
+    try:
+        interactive = get_interactive_pool().open(
+            session_id,
+            video_dir=os.path.abspath(session.frames_dir),
+            model_size=model_size,
+            num_frames=session.frame_count,
+            timeout=app.config['TRACKING_TIMEOUT'],
+        )
+    except (MemoryBudgetError, SessionLimitError) as e:
+        return jsonify({'error': f'サーバーが混雑しています: {e}'}), 503
+    except InteractiveSessionError as e:
+        return interactive_error(e)
+    
+    return jsonify({
+        'message': '対話モードを開始しました',
+        'frame_count': len(interactive.frame_names),
+        'memory_mb': round(interactive.memory_bytes / 1024 ** 2),
+    })
+
+@app.route('/interactive/<session_id>/click', methods=['POST'])
+def interactive_click(session_id):
+    """クリックを追加し、そのフレームのマスクをプレビュー"""
+    session, interactive, error = get_interactive(session_id)
+    if error:
+        return error
+    
+    data = request.get_json(silent=True) or {}
+    if 'points' not in data or 'labels' not in data:
+        return jsonify({'error': '座標データが不正です'}), 400
+    
+    try:
+        frame = interactive.call(
+            'add_points',
+            frame_idx=int(data.get('frame_idx', 0)),
+            obj_id=int(data.get('obj_id', 0)),
+            points=[[float(x), float(y)] for x, y in data['points']],
+            labels=[int(label) for label in data['labels']],
+            clear_old_points=bool(data.get('clear_old_points', False)),
+        )
+    except InteractiveSessionError as e:
+        return interactive_error(e)
+    
+    if frame['frame_idx'] < len(session.frame_list):
+        frame['frame_name'] = session.frame_list[frame['frame_idx']]
+    return jsonify(frame)
+
+@app.route('/interactive/<session_id>/remove_object', methods=['POST'])
+def interactive_remove_object(session_id):
+    """物体を追跡対象から削除"""
+    session, interactive, error = get_interactive(session_id)
+    if error:
+        return error
+    
+    data = request.get_json(silent=True) or {}
+    if 'obj_id' not in data:
+        return jsonify({'error': 'obj_id を指定してください'}), 400
+    
+    try:
+        obj_ids = interactive.call('remove_object', int(data['obj_id']))
+    except InteractiveSessionError as e:
+        return interactive_error(e)
+    
+    return jsonify({'obj_ids': obj_ids})
+
+@app.route('/interactive/<session_id>/reset', methods=['POST'])
+def interactive_reset(session_id):
+    """追加したクリックと追跡結果を破棄（フレームは読み込んだまま）"""
+    session, interactive, error = get_interactive(session_id)
+    if error:
+        return error
+    
+    try:
+        interactive.call('reset')
+    except InteractiveSessionError as e:
+        return interactive_error(e)
+    
+    return jsonify({'message': 'クリックをリセットしました'})
+
+@app.route('/interactive/<session_id>/propagate', methods=['POST'])
+def interactive_propagate(session_id):
+    """
+    指定したフレームから追跡を再伝播
+
+    結果は /stream/<session_id> でフレームごとに配信される。
+    """
+    session, interactive, error = get_interactive(session_id)
+    if error:
+        return error
+    
+    data = request.get_json(silent=True) or {}
+    start_frame_idx = data.get('start_frame_idx')
+    max_frames = data.get('max_frames')
+    reverse = bool(data.get('reverse', False))
+    
+    # 実行中のコマンドがあれば、配信中の結果を消さずに409を返す
+    try:
+        interactive.reserve()
+    except SessionBusyError as e:
+        return interactive_error(e)
+    
+    try:
+        # 再伝播の結果も masks_rle.jsonl と同じ形式でファイルに書き出して配信する
+        events_path = os.path.join('web_results', session_id, 'propagate_rle.jsonl')
+        os.makedirs(os.path.dirname(events_path), exist_ok=True)
+        events_file = open(events_path, 'w', encoding='utf-8')
+    except OSError:
+        interactive.release()
+        raise
+    reset_frame_events(session, events_path)
+    with session.events_cond:
+        session.propagating = True
+    session.message = "再伝播中..."
+    
+    def on_frame(frame):
+        done = len(session.event_progress) + 1
+        session.progress = min(int(100 * done / max(session.frame_count, 1)), 100)
+        session.message = f"再伝播中: {done}フレーム処理"
+        if frame['frame_idx'] < len(session.frame_list):
+            frame['frame_name'] = session.frame_list[frame['frame_idx']]
+        write_frame_line(events_file, frame)
+        append_frame_event(session)
+    
+    def run():
+        try:
+            result = interactive.call(
+                'propagate',
+                start_frame_idx=None if start_frame_idx is None else int(start_frame_idx),
+                max_frames=None if max_frames is None else int(max_frames),
+                reverse=reverse,
+                on_frame=on_frame,
+                reserved=True,
+            )
+            session.message = f"再伝播完了: {result['frames']}フレーム" + ("（中止）" if result['stopped'] else "")
+        except InteractiveSessionError as e:
+            session.message = f"エラー: {e}"
+        finally:
+            events_file.close()
+            with session.events_cond:
+                session.propagating = False
+                session.events_cond.notify_all()
+            # 終了を記録してから解放し、次の再伝播の状態を上書きしないようにする
+            interactive.release()
+    
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    
+    return jsonify({'message': '再伝播を開始しました'})
+
+@app.route('/interactive/<session_id>/stop', methods=['POST'])
+def interactive_stop(session_id):
+    """実行中の再伝播を停止"""
+    session, interactive, error = get_interactive(session_id)
+    if error:
+        return error
+    
+    try:
+        interactive.stop()
+    except InteractiveSessionError as e:
+        return interactive_error(e)
+    
+    return jsonify({'message': '再伝播を停止しました'})
+
+@app.route('/interactive/<session_id>/close', methods=['POST'])
+def close_interactive(session_id):
+    """対話モードを終了し、ワーカーのメモリを解放"""
+    get_interactive_pool().close(session_id)
+    return jsonify({'message': '対話モードを終了しました'})
+
+@app.route('/cancel/<session_id>', methods=['POST'])
+def cancel_job(session_id):
+    """実行待ち・実行中の処理をキャンセル"""
+    if session_id not in processing_sessions:
+        return jsonify({'error': 'セッションが見つかりません'}), 404
+    
+    session = processing_sessions[session_id]
+    
+    if session.job is None or not get_scheduler().cancel(session.job):
+        return jsonify({'error': 'キャンセルできる処理がありません'}), 400
+    
+    return jsonify({
+        'message': session.message,
+        'status': session.status
+    })
+
+# ダウンロード形式: ZIPの内容の説明
+DOWNLOAD_FORMATS = {
+    'full': [
+        "frames/ - 元の動画フレーム（一部のみ含まれています）",
+        "tracked_results/ - SAM2による追跡結果（フレームごとの画像、または tracked.mp4）",
+        "analysis_result.json - 詳細な解析結果データ",
+    ],
+    'rle': [
+        "masks_rle.jsonl - 1フレーム1行のマスク（frame_idx, frame_name, objects[{id, rle}]）。"
+        "rle は列優先の非圧縮RLE（COCO形式、0の連続から開始）",
+        "analysis_result.json - 詳細な解析結果データ",
+    ],
+    'npz': [
+        "masks/<フレーム名>.npz - フレームごとのマスク。obj_ids (N,)、"
+        "masks (N, H, ceil(W/8)) は np.packbits(axis=-1) でビット詰めした二値マスク、shape は [H, W]。"
+        "np.unpackbits(masks, axis=-1, count=W) で元に戻せる",
+        "analysis_result.json - 詳細な解析結果データ",
+    ],
+}
+
+def iter_npz_masks(masks_path):
+    """masks_rle.jsonl をフレームごとのNPZ（ビット詰めしたマスク）に変換して返す"""
+    with open(masks_path, encoding='utf-8') as f:
+        for line in f:
+            frame = json.loads(line)
+            rles = [obj['rle'] for obj in frame['objects']]
+            shape = rles[0]['size'] if rles else [0, 0]
+            masks = np.stack([rle_to_mask(rle) for rle in rles]) if rles else np.zeros((0, 0, 0), dtype=bool)
+            buffer = io.BytesIO()
+            np.savez_compressed(
+                buffer,
+                obj_ids=np.array([obj['id'] for obj in frame['objects']], dtype=np.int32),
+                masks=np.packbits(masks, axis=-1),
+                shape=np.array(shape, dtype=np.int32),
+            )
+            stem = os.path.splitext(frame.get('frame_name', f"{frame['frame_idx']:05d}.jpg"))[0]
+            yield f"masks/{stem}.npz", buffer.getvalue()
+
+def iter_result_entries(session, download_format):
+    """ダウンロードするZIPのエントリ (アーカイブ内の名前, 内容) を順に返す"""
+    masks_path = os.path.join(session.result_dir or '', 'masks_rle.jsonl')
+    
+    if download_format == 'full':
         # 元フレームを追加（最初の20フレームのみ）
         for frame_name in session.frame_list[:20]:
             frame_path = os.path.join(session.frames_dir, frame_name)
             if os.path.exists(frame_path):
-                zip_file.write(frame_path, f"frames/{frame_name}")
+                yield f"frames/{frame_name}", ('file', frame_path)
         
         # 追跡結果フレームを追加
         if session.result_dir and os.path.exists(session.result_dir):
             for root, dirs, files in os.walk(session.result_dir):
-                for file in files:
+                dirs.sort()
+                for file in sorted(files):
                     file_path = os.path.join(root, file)
                     arcname = os.path.relpath(file_path, session.result_dir)
-                    zip_file.write(file_path, f"tracked_results/{arcname}")
-        
-        # 結果データを追加
-        if session.tracking_results:
-            result_json = json.dumps(session.tracking_results, indent=2, ensure_ascii=False)
-            zip_file.writestr("analysis_result.json", result_json)
-        
-        # README を追加
-        readme_content = f"""SAM2 動画追跡結果
+                    yield f"tracked_results/{arcname}", ('file', file_path)
+    elif download_format == 'rle':
+        yield "masks_rle.jsonl", ('file', masks_path)
+    else:
+        yield from iter_npz_masks(masks_path)
+    
+    # 結果データを追加
+    if session.tracking_results:
+        result_json = json.dumps(session.tracking_results, indent=2, ensure_ascii=False)
+        yield "analysis_result.json", result_json
+    
+    # README を追加
+    contents = "\n".join(f"{i}. {line}" for i, line in enumerate(DOWNLOAD_FORMATS[download_format], 1))
+    readme_content = f"""SAM2 動画追跡結果
 ===================
 
-セッションID: {session_id}
+セッションID: {session.session_id}
 処理日時: {session.created_at.strftime('%Y-%m-%d %H:%M:%S')}
 フレーム数: {session.frame_count}
 選択座標: {session.selected_points}
@@ -509,36 +1313,63 @@ def download_results(session_id):
 {json.dumps(session.tracking_results, indent=2, ensure_ascii=False) if session.tracking_results else 'エラーが発生しました'}
 
 使用方法:
-1. frames/ - 元の動画フレーム（一部のみ含まれています）
-2. tracked_results/ - SAM2による追跡結果フレーム
-3. analysis_result.json - 詳細な解析結果データ
+{contents}
 """
-        zip_file.writestr("README.txt", readme_content)
+    yield "README.txt", readme_content
+
+@app.route('/download_results/<session_id>')
+def download_results(session_id):
+    """
+    結果をZIPでダウンロード
+
+    ZIPはディスクに作らず、エントリを読みながらストリーミングで送る。
+    クエリ format で内容を選べる: full（結果画像、既定）、rle（マスクのRLE）、npz（ビット詰めしたマスク）、
+    video（動画出力で追跡した場合の tracked.mp4。ZIPにせずそのまま送る）
+    """
+    if session_id not in processing_sessions:
+        return "セッションが見つかりません", 404
+    
+    session = processing_sessions[session_id]
+    
+    if session.status != "completed":
+        return "まだ処理が完了していません", 400
+    
+    download_format = request.args.get('format', 'full')
+    if download_format == 'video':
+        video_path = os.path.join(session.result_dir or '', 'tracked.mp4')
+        if not os.path.exists(video_path):
+            return "結果動画がありません（出力形式を動画にして追跡してください）", 404
+        return send_file(os.path.abspath(video_path), mimetype='video/mp4', as_attachment=True,
+                         download_name=f'sam2_results_{session_id}.mp4')
+    if download_format not in DOWNLOAD_FORMATS:
+        return f"不明な形式です: {download_format}", 400
+    if download_format != 'full' and not os.path.exists(os.path.join(session.result_dir or '', 'masks_rle.jsonl')):
+        return "マスクデータがありません", 404
     
-    return send_file(zip_path, as_attachment=True, download_name=f"sam2_results_{session_id}.zip")
+    suffix = '' if download_format == 'full' else f"_{download_format}"
+    return Response(
+        iter_zip(iter_result_entries(session, download_format)),
+        mimetype='application/zip',
+        headers={'Content-Disposition': f'attachment; filename=sam2_results_{session_id}{suffix}.zip'},
+    )
 
 @app.route('/cleanup/<session_id>', methods=['POST'])
 def cleanup_session(session_id):
     """セッションをクリーンアップ"""
-    if session_id in processing_sessions:
-        session = processing_sessions[session_id]
-        
-        # ファイルを削除
-        try:
-            if session.video_path and os.path.exists(session.video_path):
-                os.remove(session.video_path)
-            
-            session_dir = os.path.join('web_results', session_id)
-            if os.path.exists(session_dir):
-                shutil.rmtree(session_dir)
-        except Exception as e:
-            print(f"クリーンアップエラー: {e}")
-        
-        # セッションを削除
-        del processing_sessions[session_id]
+    # 実行待ち・実行中の処理を止め、ファイルを削除する
+    processing_sessions.remove(session_id)
     
     return jsonify({'message': 'セッションをクリーンアップしました'})
 
+@app.route('/metrics')
+def get_metrics():
+    """セッション数・ディスク使用量・破棄数とジョブの状況を取得"""
+    return jsonify({
+        'sessions': processing_sessions.stats(),
+        'jobs': get_scheduler().stats(),
+        'interactive': get_interactive_pool().stats(),
+    })
+
 if __name__ == '__main__':
     print("SAM2 動画追跡 Webアプリケーションを開始...")
     print("ブラウザで http://localhost:5001 にアクセスしてください")